@@ -1,24 +1,37 @@
 """AIOComments Consumers."""
+import asyncio
+
 from core.pubsub import Consumer, Channel
 
 
-class DlResponseConsumer(Consumer):
-    """Consumer for DlRequests.
+# channel notified when a batch of the events is stored
+EVENTS_CHANNEL = 'eventlog'
+
+
+class EventFeedConsumer(Consumer):
+    """Consumer for the stored events.
 
-    Provides aility to wait for response from report file builders.
+    Provides ability to wait for the new events (long polling of the feed).
+    Only the events stored by the current process wake it up.
     """
 
-    def __init__(self, dlrequest_id, fmt='xml', loop=None):
-        """Setup consumer settings and subscriptions."""
+    def __init__(self, loop=None):
+        """Setup consumer subscription."""
         super().__init__(loop=loop)
-        self.dlrequest_id = dlrequest_id
-        self.fmt = fmt
-        self.subscribe(Channel('%s-dl-request-%s'
-                               % (self.fmt, self.dlrequest_id)))
-        Channel('%s-dl-request' % self.fmt).publish(self.dlrequest_id)
-
-    async def on_message(self, msg):
-        """On message handler."""
-        self.unsubscribe(Channel('%s-dl-request-%s'
-                                 % (self.fmt, self.dlrequest_id)))
-        self.done = True
+        self.subscribe(Channel(EVENTS_CHANNEL))
+
+    async def wait(self, timeout):
+        """Wait for the stored events, return False on timeout."""
+        try:
+            await asyncio.wait_for(self.queue.get(), timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            return False
+
+        # skip notifications about the same events
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        return True
+
+    def close(self):
+        """Unsubscribe consumer."""
+        self.unsubscribe()
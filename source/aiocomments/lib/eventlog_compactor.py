@@ -0,0 +1,188 @@
+"""AIOComments EventLog Retention."""
+import asyncio
+import logging
+
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from core.db import get_connection, BACKGROUND_POOL
+
+from ..models import DlRequest, EventLog
+
+
+log = logging.getLogger('compactor')
+
+# advisory lock that lets a single process compact the log at a time
+LOCK_KEY = 0x6576656e74
+
+
+class EventLogCompactor:
+    """Delete (or archive) events that can't invalidate any report.
+
+    Download checks only the events newer than the creation date of
+    the VALID report and the incremental rebuild of the INVALID one
+    applies the events since its creation, so events older than the
+    oldest stored report (the invalidation horizon) are never consulted
+    again.
+
+    Events are deleted in bounded batches (each one is a short
+    transaction) with pauses between them, so the log isn't locked
+    for long. Monthly partitions that end before the horizon are
+    dropped afterwards, so the log indexes don't grow.
+    """
+
+    def __init__(self, app, interval=3600, keep=3600, batch_size=5000,
+                 pause=0.1, archive=False, loop=None):
+        """Setup compactor and start periodic runs (unless interval is 0).
+
+        keep - seconds of the latest events that are always kept.
+        archive - move events to the archive table instead of deleting.
+        """
+        self.app = app
+        self.interval = interval
+        self.keep = keep
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive = archive
+        self.loop = loop or asyncio.get_event_loop()
+        self.table = EventLog._meta.storagename
+        self.archive_table = '%s_archive' % self.table
+        self.task = self.loop.create_task(self.run()) if interval else None
+
+        if 'metrics' in app:
+            self.reclaimed = app['metrics'].counter(
+                'eventlog_reclaimed_rows_total', 'Compacted events')
+            self.index_bytes = app['metrics'].gauge(
+                'eventlog_index_bytes', 'Size of the events indexes')
+        else:
+            self.reclaimed = self.index_bytes = None
+
+    async def horizon(self, db):
+        """Return the date events older than which could be compacted.
+
+        Reports that are still stored (VALID or INVALID ones
+        that could be rebuilt incrementally) limit the horizon.
+        """
+        r = await db.execute(
+            sa.select([sa.func.min(DlRequest.created)])
+            .where((DlRequest.state == DlRequest.State.VALID) |
+                   DlRequest.size.isnot(None)))
+        oldest_stored = await r.scalar()
+        horizon = datetime.utcnow() - timedelta(seconds=self.keep)
+        if oldest_stored is not None:
+            horizon = min(horizon, oldest_stored.replace(tzinfo=None))
+        return horizon
+
+    def batch_query(self, horizon):
+        """Return query that compacts a single batch of the events."""
+        query = """
+            WITH expired AS (
+                SELECT id, e_date FROM {table}
+                WHERE e_date < :horizon LIMIT :limit
+            ), moved AS (
+                DELETE FROM {table} e USING expired x
+                WHERE e.id = x.id AND e.e_date = x.e_date
+                RETURNING e.*
+            )
+        """
+        if self.archive:
+            query += "INSERT INTO {archive} SELECT * FROM moved"
+        else:
+            query += "SELECT count(*) FROM moved"
+
+        return sa.text(query.format(table=self.table,
+                                    archive=self.archive_table)).bindparams(
+            horizon=horizon, limit=self.batch_size)
+
+    async def compact(self):
+        """Compact the log once and return number of reclaimed events."""
+        db = get_connection(self.app, BACKGROUND_POOL)
+        reclaimed = 0
+        try:
+            # session lock is held by the acquired connection
+            r = await db.execute(sa.select([sa.func.pg_try_advisory_lock(
+                LOCK_KEY)]))
+            if not await r.scalar():
+                log.debug('Compaction is in progress in another process')
+                return reclaimed
+
+            try:
+                horizon = await self.horizon(db)
+                if self.archive:
+                    await db.execute(
+                        'CREATE TABLE IF NOT EXISTS %s (LIKE %s)'
+                        % (self.archive_table, self.table))
+
+                while True:
+                    r = await db.execute(self.batch_query(horizon))
+                    count = r.rowcount if self.archive else await r.scalar()
+                    reclaimed += count
+                    if count < self.batch_size:
+                        break
+                    await asyncio.sleep(self.pause, loop=self.loop)
+
+                await self.drop_partitions(db, horizon)
+                index_size = await self.get_index_size(db)
+
+            finally:
+                await db.execute(sa.select([sa.func.pg_advisory_unlock(
+                    LOCK_KEY)]))
+
+        finally:
+            await db.release()
+
+        if self.reclaimed is not None:
+            self.reclaimed.inc((), reclaimed)
+            self.index_bytes.set(index_size)
+        log.info('EventLog compaction: %s events reclaimed before %s, '
+                 'index size %s bytes', reclaimed, horizon, index_size)
+        return reclaimed
+
+    async def drop_partitions(self, db, horizon):
+        """Drop empty monthly partitions that end before the horizon."""
+        partition = EventLog._meta.partition
+        if partition is None:
+            return
+
+        r = await db.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = '%s'::regclass" % self.table)
+        partitions = [row[0] for row in await r.fetchall()]
+
+        for name in partition.expired(self.table, partitions, horizon):
+            r = await db.execute('SELECT 1 FROM %s LIMIT 1' % name)
+            if await r.fetchone() is None:
+                await db.execute('DROP TABLE IF EXISTS %s' % name)
+                log.info('EventLog partition %s is dropped', name)
+
+    async def get_index_size(self, db):
+        """Return total size of the log indexes (with partitions).
+
+        Partitions are listed by pg_inherits since pg_partition_tree()
+        is missing in PostgreSQL 11.
+        """
+        r = await db.execute(
+            "SELECT pg_indexes_size('{table}'::regclass) + coalesce(("
+            "SELECT sum(pg_indexes_size(i.inhrelid)) FROM pg_inherits i "
+            "WHERE i.inhparent = '{table}'::regclass), 0)".format(
+                table=self.table))
+        return int(await r.scalar())
+
+    async def run(self):
+        """Compact the log periodically."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval, loop=self.loop)
+                try:
+                    await self.compact()
+                except Exception:
+                    log.exception("EventLog compaction failed")
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self):
+        """Stop periodic runs."""
+        if self.task is not None:
+            self.task.cancel()
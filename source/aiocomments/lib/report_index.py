@@ -0,0 +1,109 @@
+"""AIOComments Report Index.
+
+Report file consists of the head, segments of the comments (every
+segment is a batch of rows written at once) and the tail. The index
+keeps byte lengths of the parts and ids of the comments of every
+segment, so the report could be rebuilt by copying the unchanged
+segments of the previous file and rendering only the changed ones.
+
+Functions of the module do file IO and are called in the executor.
+"""
+import json
+import os
+
+from collections import namedtuple
+
+
+# segment of the previous report file that is copied as is
+Segment = namedtuple('Segment', ('offset', 'length', 'ids'))
+
+
+def index_path(path):
+    """Return path of the report index file."""
+    return '%s.idx' % path
+
+
+class ReportIndex:
+    """Index of the report file parts."""
+
+    def __init__(self, head=0, segments=None, tail=0):
+        """Setup lengths of the parts.
+
+        segments - list of (length, comment ids) of the segments.
+        """
+        self.head = head
+        self.segments = segments if segments is not None else []
+        self.tail = tail
+
+    @property
+    def size(self):
+        """Return size of the indexed report file."""
+        return self.head + sum(s[0] for s in self.segments) + self.tail
+
+    def add(self, length, ids):
+        """Add a segment (empty ones are skipped)."""
+        if length:
+            self.segments.append((length, ids))
+
+    def locate(self):
+        """Return dict of comment id -> segment number."""
+        return {cid: n for n, (length, ids) in enumerate(self.segments)
+                for cid in ids}
+
+    def copies(self):
+        """Yield Segment of every indexed segment."""
+        offset = self.head
+        for length, ids in self.segments:
+            yield Segment(offset, length, ids)
+            offset += length
+
+
+def load_index(path):
+    """Return index of the report file (None if it's missing or stale)."""
+    try:
+        with open(index_path(path)) as fd:
+            data = json.load(fd)
+        index = ReportIndex(data['head'], data['segments'], data['tail'])
+        # report file could be replaced without the index
+        if index.size != os.path.getsize(path):
+            return None
+        return index
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_index(path, index, tmp_path):
+    """Store index and move the new report file in place of the old one.
+
+    Readers that opened the previous file keep reading it.
+    Return size of the index file.
+    """
+    ipath = index_path(path)
+    data = json.dumps({'head': index.head,
+                       'segments': index.segments,
+                       'tail': index.tail}).encode('utf-8')
+    with open(ipath + '.tmp', 'wb') as fd:
+        fd.write(data)
+    os.replace(tmp_path, path)
+    os.replace(ipath + '.tmp', ipath)
+    return len(data)
+
+
+def copy_segment(src, dst, offset, length):
+    """Append the segment of the src file to the dst one.
+
+    Bytes are copied by the kernel (sendfile) without reading them.
+    Return number of the copied bytes.
+    """
+    copied = length
+    # sendfile doesn't write to O_APPEND files
+    with open(src, 'rb') as src_fd, open(dst, 'r+b') as dst_fd:
+        dst_fd.seek(0, os.SEEK_END)
+        while length > 0:
+            sent = os.sendfile(dst_fd.fileno(), src_fd.fileno(),
+                               offset, length)
+            if not sent:
+                raise OSError('Report file %s is truncated' % src)
+            offset += sent
+            length -= sent
+    return copied
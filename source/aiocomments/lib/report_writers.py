@@ -0,0 +1,173 @@
+"""AIOComments Report Writers.
+
+Writers serialize parts of the report (head, batch of comments, tail)
+and write them to the report file. They are called in the executor
+(thread or process pool) with plain data and keep no state between
+the calls, so every call holds a single batch of rows in memory.
+"""
+import csv
+import gzip
+import io
+
+from core.utils.json import json_dumps
+
+from ..models import DlRequest
+
+
+# fields of the report comments
+COMMENT_FIELDS = ('id', 'i_id', 'itype_id', 'author_id', 'content',
+                  'created', 'updated', 'parent_id')
+
+
+class ReportWriter:
+    """Base report writer.
+
+    Compressed variant writes every part as a separate gzip member
+    (concatenated members are a valid gzip file).
+    """
+
+    content_type = 'application/octet-stream'
+
+    def __init__(self, compress=False, compresslevel=6):
+        """Setup writer."""
+        self.compress = compress
+        self.compresslevel = compresslevel
+
+    @property
+    def mimetype(self):
+        """Content type of the report file."""
+        return 'application/gzip' if self.compress else self.content_type
+
+    def head(self, request, root):
+        """Return bytes of the report head."""
+        return b''
+
+    def rows(self, rows):
+        """Return bytes of the comments batch."""
+        raise NotImplementedError()
+
+    def tail(self):
+        """Return bytes of the report tail."""
+        return b''
+
+    def write_head(self, path, request, root=None):
+        """Create report file with the head."""
+        return self.write(path, 'wb', self.head(request, root))
+
+    def write_rows(self, path, rows):
+        """Append a batch of the comments to the report file."""
+        return self.write(path, 'ab', self.rows(rows))
+
+    def write_tail(self, path):
+        """Append the tail to the report file."""
+        return self.write(path, 'ab', self.tail())
+
+    def write(self, path, mode, data):
+        """Write data to the file (new file is created even without data).
+
+        Return number of the written bytes.
+        """
+        if not data and mode != 'wb':
+            return 0
+
+        if self.compress and data:
+            data = gzip.compress(data, compresslevel=self.compresslevel)
+        with open(path, mode) as fd:
+            fd.write(data)
+        return len(data)
+
+
+def dict_to_element(tag, d, skip_none=True):
+    """Helper that transforms dicts to LXML Elements."""
+    from lxml import etree
+
+    element = etree.Element(tag)
+    for name, value in d.items():
+        if value is not None or not skip_none:
+            etree.SubElement(element, name).text = str(value)
+    return element
+
+
+def to_bytes(element):
+    """Return serialized element."""
+    from lxml import etree
+
+    return etree.tostring(element, encoding='utf-8', xml_declaration=False)
+
+
+class XMLReportWriter(ReportWriter):
+    """XML report with the request, the root and the comments."""
+
+    content_type = 'text/xml'
+
+    def head(self, request, root):
+        """Return XML declaration, request and root elements."""
+        data = [b"<?xml version='1.0' encoding='utf-8' standalone='yes'?>\n",
+                b'<user_request>',
+                to_bytes(dict_to_element('request', request)),
+                b'<report>']
+        if root is not None:
+            data.append(to_bytes(dict_to_element('root', root)))
+        return b''.join(data)
+
+    def rows(self, rows):
+        """Return comment elements."""
+        return b''.join(to_bytes(dict_to_element('comment', row, False))
+                        for row in rows)
+
+    def tail(self):
+        """Close the report elements."""
+        return b'</report></user_request>'
+
+
+class CSVReportWriter(ReportWriter):
+    """CSV report of the comments (with the header row)."""
+
+    content_type = 'text/csv'
+
+    def head(self, request, root):
+        """Return the header row."""
+        return self.rows([dict(zip(COMMENT_FIELDS, COMMENT_FIELDS))])
+
+    def rows(self, rows):
+        """Return CSV rows (None values are empty)."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow(['' if row.get(n) is None else row[n]
+                             for n in COMMENT_FIELDS])
+        return buf.getvalue().encode('utf-8')
+
+
+class NDJSONReportWriter(ReportWriter):
+    r"""Report of the comments as JSON dicts separated by \n."""
+
+    content_type = 'application/x-ndjson'
+
+    def rows(self, rows):
+        """Return JSON lines."""
+        return ''.join('%s\n' % json_dumps(row)
+                       for row in rows).encode('utf-8')
+
+
+# DlRequest.Format -> writer
+REPORT_WRITERS = {}
+
+
+def register_writer(fmt, writer):
+    """Register writer of the report format."""
+    REPORT_WRITERS[fmt] = writer
+
+
+def get_writer(fmt):
+    """Return writer of the report format."""
+    return REPORT_WRITERS[fmt]
+
+
+register_writer(DlRequest.Format.XML, XMLReportWriter())
+register_writer(DlRequest.Format.CSV, CSVReportWriter())
+register_writer(DlRequest.Format.NDJSON, NDJSONReportWriter())
+register_writer(DlRequest.Format.XML_GZ, XMLReportWriter(compress=True))
+register_writer(DlRequest.Format.CSV_GZ, CSVReportWriter(compress=True))
+register_writer(DlRequest.Format.NDJSON_GZ,
+                NDJSONReportWriter(compress=True))
@@ -0,0 +1,535 @@
+"""AIOComments Reports Builder based on Background Consumer."""
+import asyncio
+import bisect
+import logging
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from core.db import get_connection, BACKGROUND_POOL
+from core.metrics import JOB_BUCKETS
+from core.pubsub import Channel, BackgroundConsumer
+
+from ..models import DlRequest, Comment, EventLog
+from .report_index import ReportIndex, Segment, copy_segment, load_index, \
+    save_index
+from .report_writers import REPORT_WRITERS, get_writer
+
+
+log = logging.getLogger('reporter')
+
+# advisory lock of the report builds (the second key is the request id)
+LOCK_KEY = 0x7265706f
+# advisory lock of the report evictions
+EVICT_KEY = 0x6576696374
+
+# compiled representation of the request
+request_to_dict = DlRequest.projection('i_id', 'itype_id', 'author_id',
+                                       'start', 'end')
+# fields of the report root (could be either Comment or Instance)
+ROOT_FIELDS = ('i_id', 'itype_id', 'author_id', 'content', 'created',
+               'updated', 'parent_id')
+# columns of the report comments
+COMMENT_COLUMNS = (Comment.id, Comment.i_id, Comment.itype_id,
+                   Comment.author_id, Comment.content, Comment.created,
+                   Comment.updated, Comment.parent_id)
+# report is built from scratch when more than this part
+# of its segments is changed
+REBUILD_RATIO = 0.5
+
+
+def eviction_query(max_size):
+    """Return query of the reports over the budget (least recent first).
+
+    Reports are summed up from the most recently downloaded one,
+    the ones the budget is exceeded by are evicted.
+    """
+    total = sa.func.sum(DlRequest.size).over(
+        order_by=(DlRequest.downloaded.desc(), DlRequest.id.desc()))
+    stored = sa.select([DlRequest.id, DlRequest.filename, DlRequest.size,
+                        DlRequest.downloaded, total.label('total')]) \
+        .where(DlRequest.size.isnot(None)).alias('stored')
+    return sa.select([stored.c.id, stored.c.filename, stored.c.size]) \
+        .where(stored.c.total > max_size) \
+        .order_by(stored.c.downloaded, stored.c.id)
+
+
+# report rendering executors
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+class ReportJob:
+    """Build of the report the downloads are attached to.
+
+    The report file is written part by part (head, segments, tail),
+    downloads tail it while it's growing: size is the number of bytes
+    of the written parts and waiters are woken up after every part.
+    """
+
+    def __init__(self, loop):
+        """Setup job."""
+        self.loop = loop
+        # True if the report is built with success
+        self.future = loop.create_future()
+        # file being written (None until the head is written)
+        self.path = None
+        self.size = 0
+        self._progress = loop.create_future()
+
+    @property
+    def done(self):
+        """Return True if the build is finished."""
+        return self.future.done()
+
+    @property
+    def success(self):
+        """Return True if the build is finished with success."""
+        return self.done and self.future.result()
+
+    def write(self, path, length):
+        """Register the written part of the file."""
+        self.path = path
+        self.size += length
+        self.notify()
+
+    def finish(self, success):
+        """Resolve the build for all the waiters."""
+        if not self.done:
+            self.future.set_result(success)
+        self.notify()
+
+    def notify(self):
+        """Wake up the waiters."""
+        if not self._progress.done():
+            self._progress.set_result(None)
+        self._progress = self.loop.create_future()
+
+    async def wait(self, size):
+        """Wait until more than size bytes are written or the build is done.
+
+        Cancellation of the waiter doesn't affect the other ones.
+        """
+        while self.size <= size and not self.done:
+            await asyncio.wait([self._progress], loop=self.loop)
+
+
+class CommentsReporter(BackgroundConsumer):
+    """Reports creator for the comments.
+
+    Reports of all the registered formats (see report_writers) are built.
+    Comments are fetched in batches and passed through a bounded queue
+    to the format writer, which serializes and writes them in the executor
+    (thread or process pool), so the event loop isn't blocked by the
+    serialization and file writes. Invalidated reports are rebuilt
+    incrementally (see report_index). Downloads of the report being
+    built tail the growing file (see ReportJob).
+    """
+
+    def __init__(self, app, *args, executor='thread', workers=2,
+                 batch_size=500, queue_size=4, wait_timeout=300, **kwargs):
+        """Setup Consumer and the rendering executor."""
+        super().__init__(*args, **kwargs)
+        self.app = app
+        self.executor = EXECUTORS[executor](workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.wait_timeout = wait_timeout
+        self.subscribe(*(Channel('%s-dl-request' % self.format_name(fmt))
+                         for fmt in REPORT_WRITERS))
+        # request id -> ReportJob of the build
+        self.jobs = {}
+        self.in_progress = set()
+        self.durations = app['metrics'].histogram(
+            'report_duration_seconds', 'Report generation time',
+            ('format',), JOB_BUCKETS)
+        self.builds = app['metrics'].counter(
+            'report_builds_total', 'Reports built (incrementally or full)',
+            ('mode',))
+        self.coalesced = app['metrics'].counter(
+            'report_waiters_coalesced_total',
+            'Report waiters attached to the build in progress', ('format',))
+        self.timeouts = app['metrics'].counter(
+            'report_wait_timeouts_total',
+            'Report waiters timed out', ('format',))
+        self.evictions = app['metrics'].counter(
+            'report_evictions_total', 'Reports evicted from the storage')
+        self.usage = app['metrics'].gauge(
+            'report_storage_bytes', 'Bytes of the stored reports')
+
+    def request(self, req_id, fmt):
+        """Return ReportJob of the report build.
+
+        The build is queued by the first request, the concurrent ones
+        get the same job, so the report is generated once.
+        """
+        job = self.jobs.get(req_id)
+        if job is None:
+            job = self.jobs[req_id] = ReportJob(self.loop)
+            self.receive(req_id)
+        else:
+            self.coalesced.inc((fmt,))
+        return job
+
+    async def wait(self, req_id, fmt):
+        """Return ReportJob of the report once it's being written.
+
+        The job is returned as soon as the report head is written
+        or the build is finished. asyncio.TimeoutError is raised when
+        it isn't started in wait_timeout seconds (the build goes on).
+        """
+        job = self.request(req_id, fmt)
+        try:
+            await asyncio.wait_for(job.wait(0), self.wait_timeout,
+                                   loop=self.loop)
+        except asyncio.TimeoutError:
+            self.timeouts.inc((fmt,))
+            raise
+        return job
+
+    async def handle(self, msg):
+        """Request handler.
+
+        Build requested over the channel gets the future as well,
+        so the downloads coming meanwhile wait for it.
+        """
+        req_id = int(msg)
+        if req_id not in self.jobs:
+            self.jobs[req_id] = ReportJob(self.loop)
+        if req_id not in self.in_progress:
+            db = get_connection(self.app, BACKGROUND_POOL)
+            started = time.monotonic()
+            self.in_progress.add(req_id)
+            try:
+                req = await DlRequest.list(db).get(DlRequest.id == req_id)
+                fmt = self.format_name(req.fmt)
+
+                # every worker process of the prefork mode has its own
+                # reporter, so the report is built under the session lock
+                # (held by the connection until the report is done)
+                await db.execute(sa.select([sa.func.pg_advisory_lock(
+                    LOCK_KEY, req_id)]))
+                try:
+                    # the report could be built by another process meanwhile
+                    req = await DlRequest.list(db).get(DlRequest.id == req_id)
+                    if req.state != DlRequest.State.VALID:
+                        await self.build(db, req, self.jobs[req_id])
+                        self.durations.observe(time.monotonic() - started,
+                                               (fmt,))
+                finally:
+                    await db.execute(sa.select([sa.func.pg_advisory_unlock(
+                        LOCK_KEY, req_id)]))
+
+                self.done_job(req_id, True)
+
+            except DlRequest.DoesNotExist:
+                self.done_job(req_id, False)
+
+            except Exception:
+                # executor, disk or database errors
+                log.exception('Report %s generation failed', req_id)
+                self.done_job(req_id, False)
+
+            finally:
+                await db.release()
+
+    async def build(self, db, req, job=None):
+        """Generate the report file and mark the request VALID.
+
+        The report is rebuilt incrementally when the previous file has
+        an index: unchanged segments are copied, segments with changed
+        or deleted comments are rendered again and the new comments are
+        appended at the end. Otherwise (or when the most part of the
+        report is changed) the report is built from scratch.
+        The new file replaces the previous one when it's done.
+        Written parts are registered in the job (if any).
+        """
+        job = job or ReportJob(self.loop)
+        writer = get_writer(req.fmt)
+        # the events since the start are applied by the next rebuild
+        started = datetime.utcnow()
+        root, comments = await self.report_query(db, req)
+
+        path = self.app['fs'].path(req.filename)
+        tmp_path = '%s.tmp' % path
+        index = ReportIndex()
+        index.head = await self.render(
+            writer.write_head, tmp_path, request_to_dict(req),
+            None if root is None
+            else type(root).projection(*ROOT_FIELDS)(root))
+        job.write(tmp_path, index.head)
+
+        segments = None
+        if req.state == DlRequest.State.INVALID:
+            previous = await self.render(load_index, path)
+            if previous is not None:
+                segments = await self.changed_segments(
+                    db, req, root, comments, previous)
+
+        if segments is None:
+            mode = 'full'
+            segments = self.batches(comments.raw.select(*COMMENT_COLUMNS))
+        else:
+            mode = 'incremental'
+
+        try:
+            async for segment in segments:
+                if isinstance(segment, Segment):
+                    length = await self.render(
+                        copy_segment, path, tmp_path,
+                        segment.offset, segment.length)
+                    index.add(length, segment.ids)
+                    job.write(tmp_path, length)
+                else:
+                    length = await self.render(writer.write_rows, tmp_path,
+                                               segment)
+                    index.add(length, [row['id'] for row in segment])
+                    job.write(tmp_path, length)
+        finally:
+            # stop fetching on errors
+            await segments.aclose()
+
+        index.tail = await self.render(writer.write_tail, tmp_path)
+        job.write(tmp_path, index.tail)
+        size = index.size + await self.render(save_index, path, index,
+                                              tmp_path)
+        self.builds.inc((mode,))
+
+        req.state = DlRequest.State.VALID
+        req.created = started
+        req.size = size
+        req.downloaded = datetime.utcnow()
+        await req.save(db, self.app['fs'])
+        await self.evict(db, req)
+
+    async def evict(self, db, req):
+        """Evict the least recently downloaded reports over the budget.
+
+        Sizes and download dates of the reports are stored with the
+        requests, so the budget of the storage is shared by the worker
+        processes (evictions are serialized by the advisory lock).
+        Requests of the evicted reports are marked INVALID before their
+        files are removed. The reports being built (locked by their
+        builders) and the report of the request are kept.
+        """
+        max_size = self.app['fs'].max_size
+        await db.execute(sa.select([sa.func.pg_advisory_lock(EVICT_KEY)]))
+        try:
+            r = await db.execute(sa.select([sa.func.coalesce(
+                sa.func.sum(DlRequest.size), 0)]).where(
+                    DlRequest.size.isnot(None)))
+            usage = await r.scalar()
+            victims = []
+            if max_size and usage > max_size:
+                victims = await (await db.execute(eviction_query(max_size)))\
+                    .fetchall()
+
+            for victim in victims:
+                if victim['id'] == req.id:
+                    continue
+                r = await db.execute(sa.select([
+                    sa.func.pg_try_advisory_lock(LOCK_KEY, victim['id'])]))
+                if not await r.scalar():
+                    continue
+                try:
+                    await DlRequest.list(db).filter(
+                        DlRequest.id == victim['id']).update(
+                            state=DlRequest.State.INVALID, size=None)
+                    await self.render(self.app['fs'].remove,
+                                      [victim['filename']])
+                finally:
+                    await db.execute(sa.select([sa.func.pg_advisory_unlock(
+                        LOCK_KEY, victim['id'])]))
+                usage -= victim['size']
+                self.evictions.inc()
+
+        finally:
+            await db.execute(sa.select([sa.func.pg_advisory_unlock(
+                EVICT_KEY)]))
+        self.usage.set(usage)
+
+    async def report_query(self, db, req):
+        """Return (root, comments query) of the request.
+
+        Comments of the tree are in the tree order, the rest ones
+        (of the author) are in the creation order.
+        """
+        # in case instance id was provided
+        # we should get comments only for it
+        if req.i_id is not None:
+            root, comments = await Comment.tree(db, req.i_id, req.itype_id)
+        else:
+            root = None
+            comments = Comment.list(db).order_by(Comment.created, Comment.id)
+
+        if req.author_id:
+            comments = comments.filter(Comment.author_id == req.author_id)
+
+        if req.start is not None and req.end is not None:
+            comments = comments.filter(
+                Comment.created.between(req.start, req.end))
+
+        elif req.start is not None:
+            comments = comments.filter(Comment.created >= req.start)
+
+        elif req.end is not None:
+            comments = comments.filter(Comment.created <= req.end)
+
+        return root, comments
+
+    async def changed_segments(self, db, req, root, comments, index):
+        """Return segments of the report rebuild.
+
+        None is returned if the rebuild is not cheaper than a full one.
+        """
+        events = await (await req.events(
+            db, root.tree_id if root is not None else None).raw.select(
+                EventLog.comment_id))
+        # created, changed or deleted comments
+        changed = set(e['comment_id'] for e in events)
+
+        located = index.locate()
+        dirty = set(located[cid] for cid in changed if cid in located)
+        created = sorted(cid for cid in changed if cid not in located)
+        rebuilt = len(dirty) + len(created) / self.batch_size
+        if rebuilt > REBUILD_RATIO * max(len(index.segments), 1):
+            return None
+
+        segments = list(index.copies())
+        if root is not None and created:
+            plan = await self.tree_plan(comments, segments, dirty, created)
+        else:
+            # new comments are the latest ones in the creation order
+            plan = [s.ids if n in dirty else s
+                    for n, s in enumerate(segments)]
+            plan.append(created)
+
+        return self.rebuild_segments(comments, plan)
+
+    async def tree_plan(self, comments, segments, dirty, created):
+        """Return plan of the tree report rebuild.
+
+        New comments go to their place in the tree order: segments are
+        grouped in runs, every run starts with the segment whose first
+        comment still exists, so its tree key is the lower bound of the
+        run. Runs with the new comments are fetched at once.
+        """
+        firsts = [segment.ids[0] for segment in segments]
+        rows = await (await comments.filter(
+            Comment.id.in_(firsts + created)).raw.select(
+                Comment.id, Comment.lft_num, Comment.lft_den, Comment.scale))
+        keys = {row['id']: (row['lft_num'] / row['lft_den'], row['scale'])
+                for row in rows}
+
+        starts = [0] + [n for n in range(1, len(segments))
+                        if firsts[n] in keys]
+        bounds = [keys[firsts[n]] for n in starts[1:]]
+        # run number -> new comments (filtered out ones are skipped)
+        placed = defaultdict(list)
+        for cid in created:
+            if cid in keys:
+                placed[bisect.bisect_right(bounds, keys[cid])].append(cid)
+
+        plan = []
+        for run, (start, end) in enumerate(zip(starts,
+                                               starts[1:] + [len(segments)])):
+            if run in placed:
+                plan.append([cid for s in segments[start:end]
+                             for cid in s.ids] + placed[run])
+            else:
+                plan.extend(s.ids if n in dirty else s for n, s in
+                            enumerate(segments[start:end], start))
+        return plan
+
+    async def rebuild_segments(self, comments, plan):
+        """Yield segments of the previous report and the rows batches.
+
+        Plan is a list of segments (copied) and ids lists (fetched
+        at once in the report order and split into batches).
+        """
+        for item in plan:
+            if isinstance(item, Segment):
+                yield item
+                continue
+
+            # rows of the deleted or filtered out comments are missing
+            rows = await self.fetch_rows(comments, item)
+            for i in range(0, len(rows), self.batch_size):
+                yield rows[i:i + self.batch_size]
+
+    async def fetch_rows(self, comments, ids):
+        """Return rows of the report comments with the ids."""
+        return await (await comments.filter(Comment.id.in_(ids)).raw.select(
+            *COMMENT_COLUMNS))
+
+    async def batches(self, comments):
+        """Yield batches of the comments rows.
+
+        Batches are fetched ahead through the bounded queue,
+        while the previous ones are being rendered.
+        """
+        batches = asyncio.Queue(self.queue_size, loop=self.loop)
+        fetcher = self.loop.create_task(self.fetch(comments, batches))
+        try:
+            while True:
+                rows = await batches.get()
+                if rows is None:
+                    break
+                yield rows
+            # raise fetching errors
+            await fetcher
+        finally:
+            fetcher.cancel()
+
+    def done_job(self, req_id, success):
+        """Resolve the build for all the waiters.
+
+        The next request of the report starts a new build.
+        """
+        self.in_progress.discard(req_id)
+        job = self.jobs.pop(req_id, None)
+        if job is not None:
+            job.finish(success)
+
+    @staticmethod
+    def format_name(fmt):
+        """Return name of the report format."""
+        return DlRequest.Format[fmt].verbose
+
+    async def fetch(self, comments, batches):
+        """Put batches of the comments rows to the queue.
+
+        None is put at the end.
+        """
+        try:
+            result = await comments
+            while True:
+                rows = await result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                await batches.put(rows)
+        except asyncio.CancelledError:
+            # the queue isn't read anymore, so nothing is put to it
+            raise
+        except Exception:
+            await batches.put(None)
+            raise
+        await batches.put(None)
+
+    async def render(self, writer, *args):
+        """Run report writer in the executor."""
+        return await self.loop.run_in_executor(self.executor, writer, *args)
+
+    async def stop(self):
+        """Stop consumer and the rendering executor."""
+        await super().stop()
+        self.executor.shutdown(wait=False)
+        # the waiters aren't left hanging
+        for req_id in list(self.jobs):
+            self.done_job(req_id, False)
@@ -1,10 +1,14 @@
 """AIOComments Models."""
-from datetime import datetime
-from sqlalchemy import text
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Float, cast, text
 
 from core.collections import Enum
 from core.db.models import Model
 from core.db import fields as f
+from core.db.indexes import Index
+from core.db.partitions import HashPartition, RangePartition
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 class DlRequest(Model):
@@ -14,6 +18,11 @@ class DlRequest(Model):
         """Supported Report Formats."""
 
         XML = 0, 'xml'
+        CSV = 1, 'csv'
+        NDJSON = 2, 'ndjson'
+        XML_GZ = 3, 'xml.gz'
+        CSV_GZ = 4, 'csv.gz'
+        NDJSON_GZ = 5, 'ndjson.gz'
 
     class State(Enum):
         """Request States."""
@@ -26,12 +35,16 @@ class DlRequest(Model):
     author_id = f.Integer(index=True)
     start = f.DateTime(with_timezone=True)
     end = f.DateTime(with_timezone=True)
-    # file format: 0 - XML
+    # file format (see Format)
     fmt = f.Integer(nullable=False, default=Format.XML)
     state = f.Integer(default=State.INVALID)
     filename = f.String()
     created = f.DateTime(with_timezone=True, nullable=False,
                          default=datetime.utcnow)
+    # bytes of the report stored in the file storage (None if it's missing)
+    size = f.BigInteger()
+    # last download of the report (the least recent ones are evicted)
+    downloaded = f.DateTime(with_timezone=True)
 
     class Meta:
         """Meta Descriptions."""
@@ -40,6 +53,12 @@ class DlRequest(Model):
         index = (
             ('ix_generic_tree_id', 'itype_id', 'i_id'),
             ('ix_dates', 'start', 'end'),
+            # valid reports are looked up to find the invalidation horizon
+            Index('ix_valid_requests', 'created',
+                  where=lambda m: m.state == m.State.VALID),
+            # stored reports are looked up to find the eviction victims
+            Index('ix_stored_requests', 'downloaded',
+                  where=lambda m: m.size.isnot(None)),
         )
         # Unique
         unique = (
@@ -56,6 +75,43 @@ class DlRequest(Model):
 
         return super().save(db, *args, **kwargs)
 
+    @property
+    def etag(self):
+        """Return ETag of the report generation.
+
+        Every build of the report sets the new created date.
+        """
+        created = self.created
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        micros = (created - EPOCH) // timedelta(microseconds=1)
+        return '"%x-%x"' % (self.id, micros)
+
+    def events(self, db, tree_id=None):
+        """Return query of the events that affected the report since created.
+
+        tree_id - tree of the report root (if instance id was provided).
+        """
+        events = EventLog.list(db).filter(EventLog.e_date > self.created)
+
+        if tree_id is not None:
+            events = events.filter(EventLog.tree_id == tree_id)
+
+        if self.author_id:
+            events = events.filter(EventLog.author_id == self.author_id)
+
+        if self.start:
+            if self.end:
+                events = events.filter(
+                    EventLog.comment_cdate.between(self.start, self.end))
+            else:
+                events = events.filter(EventLog.comment_cdate >= self.start)
+
+        elif self.end:
+            events = events.filter(EventLog.comment_cdate <= self.end)
+
+        return events
+
 
 class UserDlRequest(Model):
     """Users vs Download Requests."""
@@ -82,6 +138,11 @@ class Instance(Model):
                             nullable=False, default=0)
     lft_ins_den = f.Integer(f.CheckConstraint('lft_ins_den > 0'),
                             nullable=False, default=1)
+    # version of the tree, it's increased on every change of the comments
+    # (it's changed by bump_version only, so load instances without it)
+    version = f.Integer(nullable=False, default=0)
+    versioned = f.DateTime(with_timezone=True, nullable=False,
+                           default=datetime.utcnow)
     scale = -1
 
     class Meta:
@@ -101,6 +162,18 @@ class Instance(Model):
         """Return tree_id of the instance."""
         return self.pk
 
+    @classmethod
+    def list_unversioned(cls, db):
+        """Return query of the instances without version fields."""
+        return cls.list(db).defer(cls.version, cls.versioned)
+
+    @classmethod
+    async def bump_version(cls, db, tree_id):
+        """Increase version of the tree and return the new one."""
+        r = await cls.list(db).filter(cls.id == tree_id).update(
+            version=cls.version + 1, versioned=datetime.utcnow())
+        return r['version']
+
 
 class Comment(Model):
     """Model to store Comments as collection of the trees.
@@ -110,7 +183,7 @@ class Comment(Model):
 
     itype_id = f.Integer(nullable=False, default=0)
     i_id = f.Integer(nullable=False)
-    author_id = f.Integer(nullable=False, index=True)
+    author_id = f.Integer(nullable=False)
     content = f.Text(nullable=False)
     created = f.DateTime(with_timezone=True, nullable=False,
                          default=datetime.utcnow)
@@ -118,7 +191,8 @@ class Comment(Model):
                          default=datetime.utcnow)
 
     tree_id = f.ForeignKey(Instance.id, index=True)
-    parent_id = f.ForeignKey('comment.id', index=True)
+    # partitioned table can't be referenced by a foreign key
+    parent_id = f.Integer(index=True)
     children_cnt = f.Integer(f.CheckConstraint('children_cnt >= 0'),
                              nullable=False, default=0)
     scale = f.Integer(f.CheckConstraint('scale >= 0'),
@@ -139,10 +213,22 @@ class Comment(Model):
 
         # Indexes
         index = (
-            ('ix_hierarhy_tree', 'tree_id', 'scale',
-             text('(lft_num/lft_den::float)')),
-            ('ix_tree_level', 'tree_id', 'parent_id'),
+            Index('ix_hierarhy_tree', 'tree_id', 'scale',
+                  lambda m: m.lft_num / cast(m.lft_den, Float)),
+            # covering index for the index-only scans of the tree levels
+            Index('ix_tree_level', 'tree_id', 'parent_id',
+                  include=('id', 'lft_num', 'lft_den', 'i_id', 'itype_id',
+                           'author_id', 'created', 'updated')),
+            # user comments ordered by creation date
+            Index('ix_author_comments', 'author_id', 'created'),
+        )
+        # large content is kept aside from the tree keys
+        # and joined only when it's selected
+        storages = (
+            ('comment_content', ('content',)),
         )
+        # every tree lives in a single partition
+        partition = HashPartition('tree_id', 8)
 
     @property
     def lft(self):
@@ -175,12 +261,27 @@ class Comment(Model):
 
         return root, childern
 
+    def branch_filter(self):
+        """Return filter of the branch comments including this one."""
+        flt = text('lft_num/lft_den::float >= %s' % self.lft) \
+            & text('lft_num/lft_den::float < %s' % self.rht)
+        return (Comment.tree_id == self.tree_id) & flt & \
+            (Comment.scale >= self.scale)
+
+    async def branch(self, db):
+        """Return (id, author_id, created) rows of the branch comments."""
+        return await (await Comment.list(db).raw.select(
+            Comment.id, Comment.author_id, Comment.created).filter(
+                self.branch_filter()))
+
     async def delete(self, db):
         """Delete a tree branch."""
         if self.parent_id:
-            parent = await Comment.list(db).get(Comment.id == self.parent_id)
+            parent = await Comment.list(db).defer(Comment.content).get(
+                Comment.id == self.parent_id)
         else:
-            parent = await Instance.list(db).get(Instance.id == self.tree_id)
+            parent = await Instance.list_unversioned(db).get(
+                Instance.id == self.tree_id)
 
         # set parent's medaint base
         if self.rht_num == parent.lft_ins_num \
@@ -189,12 +290,7 @@ class Comment(Model):
             parent.lft_ins_den = self.lft_den
 
         # delete full branch including this comment
-        flt = text('lft_num/lft_den::float >= %s' % self.lft) \
-            & text('lft_num/lft_den::float < %s' % self.rht)
-
-        rows_count = await Comment.list(db).delete(
-            (Comment.tree_id == self.tree_id) & flt &
-            (Comment.scale >= self.scale))
+        rows_count = await Comment.list(db).delete(self.branch_filter())
 
         setattr(self, type(self)._meta.pk, None)
 
@@ -214,7 +310,7 @@ class Comment(Model):
                 # !Important: Instance will be a "root" for a comments tree
                 try:
                     # try to get tree for the instance
-                    parent = await Instance.list(db).get(
+                    parent = await Instance.list_unversioned(db).get(
                         (Instance.itype_id == self.itype_id) &
                         (Instance.i_id == self.i_id))
 
@@ -232,7 +328,8 @@ class Comment(Model):
                 med_den = parent.lft_ins_den + 1  # root rht_den is always 1
 
             else:
-                parent = await Comment.list(db).get(Comment.id == self.i_id)
+                parent = await Comment.list(db).defer(Comment.content).get(
+                    Comment.id == self.i_id)
                 self.parent_id = parent.id
                 self.scale = parent.scale + 1
                 self.tree_id = parent.tree_id
@@ -287,6 +384,11 @@ class EventLog(Model):
     e_type = f.Integer(nullable=False, default=EventType.CREATED)
     e_date = f.DateTime(with_timezone=True, nullable=False,
                         default=datetime.utcnow)
+    # version of the tree after the event
+    tree_version = f.Integer(nullable=False, default=0)
+    # id of the transaction that stored the event (the change feed order),
+    # now() would be the transaction start, not the time it's committed
+    txid = f.BigInteger(nullable=False, server_default=f.func.txid_current())
 
     class Meta:
         """Meta Descriptions."""
@@ -294,9 +396,18 @@ class EventLog(Model):
         # Indexes
         index = (
             ('ix_tree_events', 'tree_id', 'e_date'),
+            # tree changes since the version
+            ('ix_tree_versions', 'tree_id', 'tree_version'),
             ('ix_author_events', 'author_id', 'e_date'),
+            # change feed seeks
+            ('ix_tree_feed', 'tree_id', 'txid'),
+            ('ix_author_feed', 'author_id', 'txid'),
             ('ix_tree_author_events', 'tree_id', 'author_id', 'e_date'),
+            # cheap index for the date ranges of the append-only log
+            Index('ix_events_date', 'e_date', using='brin'),
         )
+        # monthly partitions (see `run.py partitions`)
+        partition = RangePartition('e_date')
 
     async def save(self, *args, **kwargs):
         """Save event.
@@ -1,8 +1,10 @@
 """AIOComments Router."""
 from .views.comments_rest import CommentAPIView
 from .views.comments_tree import get_comments_list, get_comments_tree, \
-    get_comments_branch, stream_comments_tree, stream_user_comments
+    get_comments_branch, get_comments_changes, stream_comments_tree, \
+    stream_user_comments
 from .views.user_requests import get_user_dlrequests, download
+from .views.events_feed import get_events_feed
 
 
 ROUTES = (
@@ -20,9 +22,13 @@ ROUTES = (
     ('GET', '/api/comments/branch/{i_id:\d+}/', get_comments_branch),
     ('GET', '/api/comments/branch/{i_id:\d+}/{itype_id:\d+}/', get_comments_branch),
 
+    ('GET', '/api/comments/changes/{i_id:\d+}/{itype_id:\d+}/{version:\d+}/', get_comments_changes),
+
     ('GET', '/api/comments/stream/user/{user_id:\d+}/', stream_user_comments),
 
     ('GET', '/api/comments/download/', download),
-    ('GET', '/api/comments/download/{format:\w{1,4}}/', download),
+    ('GET', '/api/comments/download/{format:[\w.]{1,9}}/', download),
     ('GET', '/api/comments/download/requests/{user_id:\d}/', get_user_dlrequests),
+
+    ('GET', '/api/events/feed/', get_events_feed),
 )
@@ -0,0 +1,87 @@
+"""Tests for EventLog compaction."""
+from datetime import datetime, timedelta
+
+import pytest
+from trafaret_config.simple import read_and_validate
+
+from core.config.trafaret import TRAFARET
+from core.db import get_connection
+from core.main import init, _initdb
+
+from ..lib.eventlog_compactor import EventLogCompactor
+from ..models import DlRequest, EventLog
+
+
+@pytest.fixture
+def cli(loop, test_client):
+    config = read_and_validate('./config/test.yaml', TRAFARET)
+    app = init(loop, config)
+    _initdb(config)
+    return loop.run_until_complete(test_client(app))
+
+
+async def add_events(db, *dates):
+    await EventLog.list(db).insert_many([
+        dict(EventLog(user_id=1, tree_id=1, author_id=1, comment_id=1,
+                      comment_cdate=d, e_date=d)) for d in dates])
+
+
+async def event_dates(db):
+    return sorted(e.e_date.replace(tzinfo=None)
+                  for e in await (await EventLog.list(db)))
+
+
+async def test_compaction(cli):
+    app = cli.server.app
+    db = get_connection(app)
+    now = datetime.utcnow()
+    try:
+        await db.execute(
+            "CREATE TABLE eventlog_p2020_01 PARTITION OF eventlog "
+            "FOR VALUES FROM ('2020-01-01') TO ('2020-02-01')")
+        await add_events(db, datetime(2020, 1, 10), datetime(2020, 1, 20),
+                         now - timedelta(days=3), now - timedelta(days=2),
+                         now - timedelta(hours=1))
+
+        # the oldest valid report limits the horizon
+        await db.execute(DlRequest._meta.storages[0].table.insert().values(
+            state=DlRequest.State.VALID, created=now - timedelta(days=2),
+            filename='report.xml'))
+
+        compactor = EventLogCompactor(app, interval=0, keep=0, batch_size=2,
+                                      pause=0)
+        assert await compactor.compact() == 3
+        assert await event_dates(db) == [now - timedelta(days=2),
+                                         now - timedelta(hours=1)]
+
+        # expired partition is dropped
+        r = await db.execute("SELECT to_regclass('eventlog_p2020_01')")
+        assert await r.scalar() is None
+
+        assert await compactor.compact() == 0
+
+        # indexes of all the partitions are counted
+        r = await db.execute(
+            "SELECT sum(pg_indexes_size(c.oid)) FROM pg_class c "
+            "WHERE c.relispartition AND left(c.relname, 9) = 'eventlog_'")
+        assert await compactor.get_index_size(db) == await r.scalar() > 0
+    finally:
+        await db.release()
+
+
+async def test_archive(cli):
+    app = cli.server.app
+    db = get_connection(app)
+    now = datetime.utcnow()
+    try:
+        await add_events(db, now - timedelta(days=3), now - timedelta(days=2))
+        compactor = EventLogCompactor(app, interval=0, keep=86400,
+                                      archive=True)
+        assert await compactor.compact() == 2
+        assert await event_dates(db) == []
+
+        r = await db.execute("SELECT count(*) FROM eventlog_archive")
+        assert await r.scalar() == 2
+    finally:
+        await db.execute("DROP TABLE IF EXISTS eventlog_archive")
+        await db.release()
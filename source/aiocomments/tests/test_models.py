@@ -165,3 +165,19 @@ async def test_delete_comments(db):
 
     c_ids = await Comment.list(db).order_by(text('lft_num/lft_den::float'), Comment.scale).flat(Comment.id)
     assert c_ids == [comment3.id]
+
+
+@acquire_connection
+async def test_insert_many_comments(db):
+    await Comment.list(db).delete()
+    await Instance.list(db).delete()
+
+    c = Comment(itype_id=1, i_id=1, author_id=1, content='test comment 1')
+    await c.save(db)
+
+    # content is stored aside and linked by the returned primary keys
+    rows = [dict(dict(c), content='bulk comment %s' % i) for i in range(3)]
+    assert await Comment.list(db).insert_many(rows) == 3
+
+    contents = await Comment.list(db).order_by(Comment.id).flat(Comment.content)
+    assert contents == ['test comment 1', 'bulk comment 0', 'bulk comment 1', 'bulk comment 2']
@@ -0,0 +1,43 @@
+"""Tests for the report index."""
+import os
+
+from ..lib.report_index import ReportIndex, Segment, copy_segment, \
+    index_path, load_index, save_index
+
+
+def test_report_index(tmpdir):
+    path = str(tmpdir.join('report.csv'))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fd:
+        fd.write(b'head|1,2|3|tail')
+
+    index = ReportIndex(head=5)
+    index.add(4, [1, 2])
+    index.add(0, [4])
+    index.add(2, [3])
+    index.tail = 4
+    assert index.size == 15
+    assert index.locate() == {1: 0, 2: 0, 3: 1}
+    assert list(index.copies()) == [Segment(5, 4, [1, 2]),
+                                    Segment(9, 2, [3])]
+
+    assert save_index(path, index, tmp_path) \
+        == os.path.getsize(index_path(path))
+    assert not os.path.exists(tmp_path)
+    loaded = load_index(path)
+    assert (loaded.head, loaded.segments, loaded.tail) \
+        == (5, [[4, [1, 2]], [2, [3]]], 4)
+
+    # segments are copied from the previous file
+    open(tmp_path, 'wb').close()
+    assert copy_segment(path, tmp_path, 9, 2) == 2
+    assert copy_segment(path, tmp_path, 5, 4) == 4
+    with open(tmp_path, 'rb') as fd:
+        assert fd.read() == b'3|1,2|'
+
+    # index of the changed file is stale
+    with open(path, 'ab') as fd:
+        fd.write(b'!')
+    assert load_index(path) is None
+    os.remove(index_path(path))
+    assert load_index(path) is None
@@ -0,0 +1,90 @@
+"""Tests for the report writers."""
+import csv
+import gzip
+import io
+import json
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from lxml import etree
+
+from ..lib.report_writers import CSVReportWriter, NDJSONReportWriter, \
+    XMLReportWriter, get_writer
+from ..models import DlRequest
+
+
+def comments(*ids):
+    return [OrderedDict([('id', i), ('i_id', 1), ('itype_id', 1),
+                         ('author_id', 1), ('content', 'коммент <%s>' % i),
+                         ('created', None), ('updated', None),
+                         ('parent_id', None)]) for i in ids]
+
+
+def render(writer, path, batches):
+    writer.write_head(path, {'i_id': 1, 'itype_id': 1, 'author_id': None},
+                      {'i_id': 1, 'itype_id': 1})
+    for rows in batches:
+        writer.write_rows(path, rows)
+    writer.write_tail(path)
+
+
+def test_xml_report(tmpdir):
+    path = str(tmpdir.join('report.xml'))
+    render(XMLReportWriter(), path, [comments(0, 1, 2), comments(3, 4)])
+
+    xml_tree = etree.parse(path)
+    assert xml_tree.docinfo.standalone
+    assert xml_tree.xpath('/user_request/request/i_id')[0].text == '1'
+    # None values of the request are skipped
+    assert not xml_tree.xpath('/user_request/request/author_id')
+    assert len(xml_tree.xpath('/user_request/report/root')) == 1
+
+    elements = xml_tree.xpath('/user_request/report/comment')
+    assert [c.findtext('id') for c in elements] == [str(i) for i in range(5)]
+    assert elements[1].findtext('content') == 'коммент <1>'
+    assert elements[1].findtext('parent_id') == 'None'
+
+
+def test_csv_report(tmpdir):
+    path = str(tmpdir.join('report.csv'))
+    render(CSVReportWriter(), path, [comments(0, 1), comments(2)])
+
+    with open(path, encoding='utf-8', newline='') as fd:
+        rows = list(csv.DictReader(fd))
+    assert [r['id'] for r in rows] == ['0', '1', '2']
+    assert rows[1]['content'] == 'коммент <1>'
+    assert rows[1]['parent_id'] == ''
+
+
+def test_compressed_report(tmpdir):
+    path = str(tmpdir.join('report.ndjson.gz'))
+    writer = NDJSONReportWriter(compress=True)
+    assert writer.mimetype == 'application/gzip'
+    render(writer, path, [comments(0, 1), comments(2)])
+
+    # every batch is a gzip member
+    with gzip.open(path, 'rt', encoding='utf-8') as fd:
+        rows = [json.loads(line) for line in fd]
+    assert [r['id'] for r in rows] == [0, 1, 2]
+
+    # empty report is a valid gzip file too
+    render(writer, path, [])
+    with gzip.open(path) as fd:
+        assert fd.read() == b''
+
+
+def test_report_writers_registry():
+    for fmt, verbose in DlRequest.Format:
+        writer = get_writer(fmt)
+        assert writer.compress == verbose.endswith('.gz')
+
+
+def test_report_rendering_in_process(tmpdir):
+    path = str(tmpdir.join('report.csv.gz'))
+    writer = get_writer(DlRequest.Format.CSV_GZ)
+    with ProcessPoolExecutor(1) as executor:
+        executor.submit(render, writer, path, [comments(1)]).result()
+
+    with gzip.open(path, 'rt', encoding='utf-8') as fd:
+        assert len(list(csv.DictReader(io.StringIO(fd.read())))) == 1
@@ -1,13 +1,34 @@
 """Tests for Comments Tree controller."""
+import asyncio
+import csv
+import gzip
+import io
 import json
 import math
+import os
+import threading
+import time
+
+import aiohttp
+import pytest
+import sqlalchemy as sa
 
 from datetime import datetime
 from io import BytesIO
 from lxml import etree
+from trafaret_config.simple import read_and_validate
 
+from core.config.trafaret import TRAFARET
+from core.db import get_connection
+from core.main import init, _initdb
 from core.utils import dict_to_uri_query
 
+from ...lib import reporter
+from ...lib.eventlog_compactor import EventLogCompactor
+from ...lib.report_writers import COMMENT_FIELDS, get_writer
+from ...models import DlRequest, EventLog
+from ...views import comments_tree
+
 
 # Define a tree for the tests
 test_tree_data = [
@@ -494,3 +515,513 @@ async def test_download_comments_for_period(cli):
     assert resp.headers.get('content-length', None) is None
 
     await resp.text()
+
+
+def test_tree_changes():
+    """Test for the changes of the events."""
+    created, deleted = EventLog.EventType.CREATED, EventLog.EventType.DELETED
+    events = [
+        dict(comment_id=1, e_type=created, tree_version=3),
+        dict(comment_id=2, e_type=created, tree_version=4),
+        # branch is deleted with a single version
+        dict(comment_id=1, e_type=deleted, tree_version=5),
+        dict(comment_id=2, e_type=deleted, tree_version=5),
+        dict(comment_id=3, e_type=created, tree_version=7),
+    ]
+    assert comments_tree.tree_changes(events, 2) == (5, set(), {1, 2})
+    assert comments_tree.tree_changes(events[:2], 2) == (4, {1, 2}, set())
+
+
+async def test_get_comments_changes(cli, monkeypatch):
+    """Test for the tree changes since the version."""
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    url = '/api/comments/changes/{i_id}/{itype_id}/{version}/'
+
+    # all the comments are created since version 0
+    resp = await cli.get(url.format(i_id=1, itype_id=1, version=0))
+    assert resp.status == 200
+    changes = await resp.json()
+    assert changes['version'] == len(ptree)
+    assert not changes['reset']
+    assert [c['id'] for c in changes['changed']] \
+        == [c['id'] for c in ptree]
+    assert changes['deleted'] == []
+    version = changes['version']
+
+    # nothing has changed
+    resp = await cli.get(url.format(i_id=1, itype_id=1, version=version))
+    changes = await resp.json()
+    assert changes == {'version': version, 'reset': False,
+                       'changed': [], 'deleted': []}
+
+    # reply, update and delete
+    response = await cli.put('/api/comment/', json={
+        'i_id': ptree[0]['id'], 'user_id': 3, 'content': 'reply'})
+    reply = await response.json()
+    response = await cli.post('/api/comment/{id}/'.format(id=ptree[-1]['id']),
+                              json={'user_id': 1, 'content': 'updated'})
+    assert response.status == 200
+    response = await cli.delete('/api/comment/{id}/'.format(id=ptree[3]['id']),
+                                json={'user_id': 3})
+    assert response.status == 200
+
+    resp = await cli.get(url.format(i_id=1, itype_id=1, version=version))
+    changes = await resp.json()
+    assert changes['version'] == version + 3
+    assert not changes['reset']
+    assert [(c['id'], c['content']) for c in changes['changed']] \
+        == [(reply['id'], 'reply'), (ptree[-1]['id'], 'updated')]
+    assert changes['deleted'] == [ptree[3]['id']]
+
+    # the lost events are replaced with the full tree
+    db = get_connection(cli.server.app)
+    try:
+        await EventLog.list(db).delete(EventLog.tree_version == version + 1)
+    finally:
+        await db.release()
+
+    monkeypatch.setattr(comments_tree, 'feed_settle', lambda app: 0)
+    resp = await cli.get(url.format(i_id=1, itype_id=1, version=version))
+    changes = await resp.json()
+    assert changes['version'] == version + 3
+    assert changes['reset']
+    assert len(changes['changed']) == len(ptree)
+    assert changes['deleted'] == []
+
+    # unknown instance
+    resp = await cli.get(url.format(i_id=100, itype_id=1, version=0))
+    assert resp.status == 404
+
+
+async def test_download_comments_formats(cli):
+    """Test for the reports of the other formats."""
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+
+    resp = await cli.get('/api/comments/download/csv/?%s'
+                         % dict_to_uri_query(req_data))
+    assert resp.status == 200
+    assert resp.headers['Content-Type'] == 'text/csv'
+    assert 'report.csv' in resp.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(await resp.text())))
+    assert [int(r['id']) for r in rows] == [c['id'] for c in ptree]
+
+    for i in range(2):
+        # new report is streamed, the next one is a file
+        resp = await cli.get('/api/comments/download/ndjson.gz/?%s'
+                             % dict_to_uri_query(req_data))
+        assert resp.status == 200
+        assert resp.headers['Content-Type'] == 'application/gzip'
+        data = gzip.decompress(await resp.read()).decode('utf-8')
+        rows = [json.loads(line) for line in data.splitlines()]
+        assert [r['id'] for r in rows] == [c['id'] for c in ptree]
+
+
+async def test_download_comments_failure(cli, monkeypatch):
+    """Test for the report generation errors."""
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    writer = get_writer(DlRequest.Format.CSV)
+
+    def fail(*args):
+        raise OSError('No space left on device')
+
+    def write_rows(path, rows):
+        time.sleep(0.2)
+        fail()
+
+    # the waiting request is responded in spite of the error
+    monkeypatch.setattr(writer, 'head', fail)
+    resp = await cli.get('/api/comments/download/csv/?%s'
+                         % dict_to_uri_query(req_data))
+    assert resp.status == 500
+
+    # the streamed response is broken off
+    monkeypatch.undo()
+    monkeypatch.setattr(writer, 'write_rows', write_rows)
+    resp = await cli.get('/api/comments/download/csv/?%s'
+                         % dict_to_uri_query(req_data))
+    assert resp.status == 200
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await resp.read()
+
+    # and the report could be generated again
+    monkeypatch.undo()
+    resp = await cli.get('/api/comments/download/csv/?%s'
+                         % dict_to_uri_query(req_data))
+    rows = list(csv.DictReader(io.StringIO(await resp.text())))
+    assert [int(r['id']) for r in rows] == [c['id'] for c in ptree]
+
+
+async def test_download_comments_locked(cli):
+    """Test for the report built by another process."""
+    await create_tree(cli, test_tree_data)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    await (await cli.get(url)).text()
+
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        # another process builds the report
+        await db.execute(sa.select([sa.func.pg_advisory_lock(
+            reporter.LOCK_KEY, dlreq.id)]))
+        dlreq.state = DlRequest.State.INVALID
+        await dlreq.save(db, cli.server.app['fs'])
+
+        download = asyncio.ensure_future(cli.get(url))
+        await asyncio.sleep(0.3)
+        assert not download.done()
+
+        with open(cli.server.app['fs'].path(dlreq.filename), 'w') as fd:
+            fd.write('id\n1\n')
+        dlreq.state = DlRequest.State.VALID
+        await dlreq.save(db, cli.server.app['fs'])
+        await db.execute(sa.select([sa.func.pg_advisory_unlock(
+            reporter.LOCK_KEY, dlreq.id)]))
+    finally:
+        await db.release()
+
+    # the report isn't built once again
+    resp = await asyncio.wait_for(download, 5)
+    assert await resp.text() == 'id\n1\n'
+
+
+async def test_download_comments_coalesced(cli):
+    """Test for the concurrent downloads of the same report."""
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    # the report is requested before the downloads
+    await (await cli.get(url)).text()
+    builds = cli.server.app['metrics'].metrics['report_builds_total']
+    assert builds.values == {('full',): 1}
+
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        dlreq.state = DlRequest.State.INVALID
+        await dlreq.save(db, cli.server.app['fs'])
+    finally:
+        await db.release()
+
+    async def load_ids():
+        resp = await cli.get(url)
+        assert resp.status == 200
+        return [int(r['id']) for r in
+                csv.DictReader(io.StringIO(await resp.text()))]
+
+    results = await asyncio.gather(*[load_ids() for i in range(5)],
+                                   loop=cli.server.app.loop)
+    assert results == [[c['id'] for c in ptree]] * 5
+    # the report is generated once
+    assert sum(builds.values.values()) == 2
+    waiters = cli.server.app['metrics'].metrics[
+        'report_waiters_coalesced_total']
+    assert waiters.values == {('csv',): 4}
+    assert cli.server.app['reporter'].jobs == {}
+
+
+async def test_download_comments_wait_timeout(cli):
+    """Test for the report that isn't built in time."""
+    await create_tree(cli, test_tree_data)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    await (await cli.get(url)).text()
+    cli.server.app['reporter'].wait_timeout = 0.2
+
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        # another process builds the report
+        await db.execute(sa.select([sa.func.pg_advisory_lock(
+            reporter.LOCK_KEY, dlreq.id)]))
+        dlreq.state = DlRequest.State.INVALID
+        await dlreq.save(db, cli.server.app['fs'])
+        try:
+            resp = await cli.get(url)
+            assert resp.status == 503
+            assert resp.headers['Retry-After'] == '1'
+        finally:
+            await db.execute(sa.select([sa.func.pg_advisory_unlock(
+                reporter.LOCK_KEY, dlreq.id)]))
+    finally:
+        await db.release()
+
+    timeouts = cli.server.app['metrics'].metrics['report_wait_timeouts_total']
+    assert timeouts.values == {('csv',): 1}
+    # the build goes on and the report is downloaded later
+    await asyncio.sleep(0.5)
+    resp = await cli.get(url)
+    assert resp.status == 200
+
+
+async def test_download_comments_progressive(cli, monkeypatch):
+    """Test for the report streamed while it's being generated."""
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    writer = get_writer(DlRequest.Format.CSV)
+    release = threading.Event()
+    render_rows = writer.write_rows
+
+    def write_rows(path, rows):
+        release.wait(5)
+        return render_rows(path, rows)
+
+    monkeypatch.setattr(writer, 'write_rows', write_rows)
+    resp = await cli.get(url)
+    assert resp.status == 200
+    # the head is sent before the comments are rendered
+    head = await asyncio.wait_for(resp.content.readline(), 1)
+    assert head.decode('utf-8').strip() == ','.join(COMMENT_FIELDS)
+
+    # the later request tails the same file
+    later = asyncio.ensure_future(cli.get(url))
+    await asyncio.sleep(0.1)
+    release.set()
+    responses = [(head + await resp.read()).decode('utf-8'),
+                 await (await later).text()]
+    for data in responses:
+        rows = list(csv.DictReader(io.StringIO(data)))
+        assert [int(r['id']) for r in rows] == [c['id'] for c in ptree]
+
+    builds = cli.server.app['metrics'].metrics['report_builds_total']
+    assert builds.values == {('full',): 1}
+
+
+async def test_download_comments_ranges(cli):
+    """Test for the resumed downloads of the report."""
+    await create_tree(cli, test_tree_data)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    # the new report is streamed
+    data = await (await cli.get(url)).read()
+
+    resp = await cli.get(url)
+    assert await resp.read() == data
+    etag = resp.headers['ETag']
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    resp = await cli.get(url, headers={'If-None-Match': etag})
+    assert resp.status == 304
+
+    resp = await cli.get(url, headers={'Range': 'bytes=10-', 'If-Range': etag})
+    assert resp.status == 206
+    assert resp.headers['Content-Range'] == 'bytes 10-%s/%s' % (
+        len(data) - 1, len(data))
+    assert await resp.read() == data[10:]
+
+    # the report is built again, so it's a new generation
+    await cli.put('/api/comment/', json={
+        'i_id': 1, 'itype_id': 1, 'user_id': 1, 'content': 'new comment'})
+    data = await (await cli.get(url)).read()
+    resp = await cli.get(url, headers={'Range': 'bytes=10-', 'If-Range': etag})
+    assert resp.status == 200
+    assert resp.headers['ETag'] != etag
+    assert await resp.read() == data
+
+
+@pytest.fixture
+def batches_cli(loop, test_client):
+    """Client of the app that builds reports in small batches."""
+    config = read_and_validate('./config/test.yaml', TRAFARET)
+    config['reports']['batch_size'] = 2
+    app = init(loop, config)
+    _initdb(config)
+    return loop.run_until_complete(test_client(app))
+
+
+async def test_download_comments_incremental(batches_cli):
+    """Test for the report rebuilt from the changes."""
+    cli = batches_cli
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv.gz/?%s' % dict_to_uri_query(req_data)
+
+    async def load_rows():
+        resp = await cli.get(url)
+        data = gzip.decompress(await resp.read()).decode('utf-8')
+        return [(int(r['id']), r['content'])
+                for r in csv.DictReader(io.StringIO(data))]
+
+    assert await load_rows() == [(c['id'], c['content']) for c in ptree]
+    builds = cli.server.app['metrics'].metrics['report_builds_total']
+    assert builds.values == {('full',): 1}
+
+    # change, delete and create comments
+    changed, deleted = ptree[6], ptree[4]
+    await cli.post('/api/comment/%s/' % changed['id'], json={
+        'user_id': changed['author_id'], 'content': 'changed comment'})
+    await cli.delete('/api/comment/%s/' % deleted['id'], json={
+        'user_id': deleted['author_id']})
+    created = {}
+    for parent, i_id, itype_id in ((None, 1, 1),
+                                   # the first one of its segment is deleted
+                                   (ptree[5], ptree[5]['id'], 0),
+                                   (ptree[1], ptree[1]['id'], 0),
+                                   (ptree[0], ptree[0]['id'], 0)):
+        resp = await cli.put('/api/comment/', json={
+            'i_id': i_id, 'itype_id': itype_id, 'user_id': 1,
+            'content': 'new comment'})
+        created[None if parent is None else parent['id']] = \
+            (await resp.json())['id']
+
+    # new comments are in the tree order, a new reply is the last child
+    rows = await load_rows()
+    assert builds.values == {('full',): 1, ('incremental',): 1}
+    assert [cid for cid, content in rows if content == 'new comment'] == [
+        created[ptree[0]['id']], created[ptree[5]['id']],
+        created[ptree[1]['id']], created[None]]
+    # and the report is the same as the full one
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV_GZ)
+        os.remove(cli.server.app['fs'].path(dlreq.filename) + '.idx')
+        dlreq.state = DlRequest.State.INVALID
+        await dlreq.save(db, cli.server.app['fs'])
+    finally:
+        await db.release()
+    assert await load_rows() == rows
+    assert builds.values == {('full',): 2, ('incremental',): 1}
+    assert [cid for cid, content in rows if content != 'new comment'] == [
+        c['id'] for c in ptree if c is not deleted]
+
+
+async def test_download_comments_compacted(batches_cli):
+    """Test for the events compacted before the incremental rebuild."""
+    cli = batches_cli
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    url = '/api/comments/download/csv/?%s' % dict_to_uri_query(req_data)
+    await (await cli.get(url)).read()
+
+    changed = ptree[3]
+    await cli.post('/api/comment/%s/' % changed['id'], json={
+        'user_id': changed['author_id'], 'content': 'changed comment'})
+    await cli.server.app['event_writer'].flush()
+
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        dlreq.state = DlRequest.State.INVALID
+        await dlreq.save(db, cli.server.app['fs'])
+    finally:
+        await db.release()
+
+    # events since the stored INVALID report are kept
+    compactor = EventLogCompactor(cli.server.app, interval=0, keep=0)
+    assert await compactor.compact() == len(ptree)
+
+    resp = await cli.get(url)
+    rows = list(csv.DictReader(io.StringIO(await resp.text())))
+    assert [(int(r['id']), r['content']) for r in rows] == [
+        (c['id'], 'changed comment' if c is changed else c['content'])
+        for c in ptree]
+
+
+@pytest.fixture
+def bounded_clis(loop, test_client, tmpdir):
+    """Clients of the two apps (workers) sharing the bounded storage."""
+    config = read_and_validate('./config/test.yaml', TRAFARET)
+    config['filestorage'] = {'root': str(tmpdir), 'max_size': 1}
+    _initdb(config)
+    return [loop.run_until_complete(test_client(init(loop, config)))
+            for i in range(2)]
+
+
+@pytest.fixture
+def bounded_cli(bounded_clis):
+    """Client of the app that keeps a single report in the storage."""
+    return bounded_clis[0]
+
+
+async def test_download_comments_evicted(bounded_cli, tmpdir):
+    """Test for the reports evicted from the storage."""
+    cli = bounded_cli
+    tree = await create_tree(cli, test_tree_data)
+    ptree = plain_tree(tree)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    urls = ['/api/comments/download/%s/?%s'
+            % (fmt, dict_to_uri_query(req_data)) for fmt in ('csv', 'xml')]
+
+    async def load_ids():
+        resp = await cli.get(urls[0])
+        assert resp.status == 200
+        return [int(r['id']) for r in
+                csv.DictReader(io.StringIO(await resp.text()))]
+
+    assert await load_ids() == [c['id'] for c in ptree]
+    db = get_connection(cli.server.app)
+    try:
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        assert dlreq.state == DlRequest.State.VALID
+        assert sorted(os.listdir(str(tmpdir))) == \
+            [dlreq.filename, dlreq.filename + '.idx']
+
+        # the least recently downloaded report is evicted by the new one
+        await (await cli.get(urls[1])).read()
+        dlreq = await DlRequest.list(db).get(
+            DlRequest.fmt == DlRequest.Format.CSV)
+        assert dlreq.state == DlRequest.State.INVALID
+        assert not os.path.exists(cli.server.app['fs'].path(dlreq.filename))
+    finally:
+        await db.release()
+
+    evictions = cli.server.app['metrics'].metrics['report_evictions_total']
+    assert evictions.values == {(): 1}
+
+    # and it's built again
+    assert await load_ids() == [c['id'] for c in ptree]
+    builds = cli.server.app['metrics'].metrics['report_builds_total']
+    assert builds.values == {('full',): 3}
+
+
+async def test_download_comments_evicted_lru(bounded_clis):
+    """Test for the eviction order shared by the workers."""
+    cli, other = bounded_clis
+    await create_tree(cli, test_tree_data)
+    req_data = {'i_id': 1, 'itype_id': 1, 'user_id': 1}
+    urls = {fmt: '/api/comments/download/%s/?%s'
+            % (fmt, dict_to_uri_query(req_data))
+            for fmt in ('csv', 'xml', 'ndjson')}
+    for app in (cli.server.app, other.server.app):
+        app['fs'].max_size = 0
+
+    async def sizes():
+        db = get_connection(cli.server.app)
+        try:
+            requests = await (await DlRequest.list(db))
+            return {DlRequest.Format[r.fmt].verbose: r.size
+                    for r in requests}
+        finally:
+            await db.release()
+
+    await (await cli.get(urls['csv'])).read()
+    await (await other.get(urls['xml'])).read()
+    # csv report is downloaded recently
+    await (await other.get(urls['csv'])).read()
+    stored = await sizes()
+    for app in (cli.server.app, other.server.app):
+        app['fs'].max_size = stored['csv'] + stored['xml'] - 1
+
+    # the report built by another worker is evicted
+    await (await cli.get(urls['ndjson'])).read()
+    stored = await sizes()
+    assert stored['xml'] is None
+    assert stored['ndjson'] + stored['csv'] <= cli.server.app['fs'].max_size
+    usage = cli.server.app['metrics'].metrics['report_storage_bytes']
+    assert usage.values == {(): stored['ndjson'] + stored['csv']}
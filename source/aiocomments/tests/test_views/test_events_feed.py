@@ -0,0 +1,137 @@
+"""Tests for the events change feed."""
+import asyncio
+import json
+
+from datetime import datetime, timedelta
+
+from core.db import get_connection
+
+from ...models import EventLog
+
+
+async def create_comment(cli, author_id, i_id=1):
+    """Comment create method."""
+    resp = await cli.put('/api/comment/', json={
+        'user_id': author_id, 'i_id': i_id, 'itype_id': 1,
+        'content': 'test feed comment'})
+    return await resp.json()
+
+
+async def load_feed(cli, **params):
+    """Return (events, next cursor) of the feed."""
+    resp = await cli.get('/api/events/feed/', params=params)
+    assert resp.status == 200
+    assert resp.headers['Content-Type'] == 'application/x-ndjson'
+    events = [json.loads(line) for line in
+              (await resp.text()).splitlines()]
+    return events, resp.headers['X-Next-Cursor']
+
+
+async def test_events_feed(cli):
+    """Test for the feed pages."""
+    author_id = 77
+    comments = [await create_comment(cli, author_id) for i in range(3)]
+    await create_comment(cli, author_id + 1)
+    await cli.server.app['event_writer'].flush()
+
+    events, cursor = await load_feed(cli, author_id=author_id, limit=2)
+    assert [e['comment_id'] for e in events] \
+        == [c['id'] for c in comments[:2]]
+    assert cursor == events[-1]['cursor']
+
+    events, cursor = await load_feed(cli, author_id=author_id,
+                                     cursor=cursor)
+    assert [e['comment_id'] for e in events] == [comments[2]['id']]
+
+    # nothing new after the last event
+    events, next_cursor = await load_feed(cli, author_id=author_id,
+                                          cursor=cursor)
+    assert events == []
+    assert next_cursor == cursor
+
+    # bad cursor
+    resp = await cli.get('/api/events/feed/', params={'cursor': '!'})
+    assert resp.status == 400
+    assert 'cursor' in (await resp.json())['data_errors']
+
+
+async def test_events_feed_long_polling(cli):
+    """Test for waiting for the new events."""
+    author_id = 79
+    await create_comment(cli, author_id)
+    await cli.server.app['event_writer'].flush()
+    events, cursor = await load_feed(cli, author_id=author_id)
+    assert len(events) == 1
+
+    # the request waits for the events stored by the writer
+    feed = asyncio.ensure_future(load_feed(cli, author_id=author_id,
+                                           cursor=cursor, wait=10))
+    await asyncio.sleep(0.2)
+    assert not feed.done()
+
+    comment = await create_comment(cli, author_id)
+    events, cursor = await asyncio.wait_for(feed, 5)
+    assert [e['comment_id'] for e in events] == [comment['id']]
+
+    # timeout
+    events, next_cursor = await load_feed(cli, author_id=author_id,
+                                          cursor=cursor, wait=0.2)
+    assert events == []
+    assert next_cursor == cursor
+
+
+async def test_events_feed_stored_late(cli):
+    """Test for the events stored after the cursor was given out."""
+    author_id = 81
+    await create_comment(cli, author_id)
+    await cli.server.app['event_writer'].flush()
+    events, cursor = await load_feed(cli, author_id=author_id)
+    assert len(events) == 1
+
+    # e.g. batch retried by the writer keeps the original event dates
+    event = EventLog(user_id=author_id, tree_id=1, author_id=author_id,
+                     comment_id=0, comment_cdate=datetime.utcnow(),
+                     e_date=datetime.utcnow() - timedelta(minutes=10))
+    db = get_connection(cli.server.app)
+    try:
+        await EventLog.list(db).insert_many([dict(event)])
+    finally:
+        await db.release()
+
+    events, next_cursor = await load_feed(cli, author_id=author_id,
+                                          cursor=cursor)
+    assert [e['comment_id'] for e in events] == [0]
+    assert next_cursor != cursor
+
+
+async def test_events_feed_in_flight(cli):
+    """Test for the events held back by the older transactions."""
+    author_id = 83
+    await create_comment(cli, author_id)
+    await cli.server.app['event_writer'].flush()
+    events, cursor = await load_feed(cli, author_id=author_id)
+    assert len(events) == 1
+
+    # the older transaction could store events before the newer ones
+    db = get_connection(cli.server.app)
+    try:
+        await db.execute('BEGIN')
+        await db.execute('SELECT txid_current()')
+
+        comment = await create_comment(cli, author_id)
+        await cli.server.app['event_writer'].flush()
+        events, next_cursor = await load_feed(cli, author_id=author_id,
+                                              cursor=cursor)
+        assert events == []
+        assert next_cursor == cursor
+
+        feed = asyncio.ensure_future(load_feed(cli, author_id=author_id,
+                                               cursor=cursor, wait=10))
+        await asyncio.sleep(0.2)
+        assert not feed.done()
+    finally:
+        await db.execute('COMMIT')
+        await db.release()
+
+    events, cursor = await asyncio.wait_for(feed, 5)
+    assert [e['comment_id'] for e in events] == [comment['id']]
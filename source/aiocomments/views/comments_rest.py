@@ -7,7 +7,12 @@ from core.exceptions import CoreException
 from core.db import acquire_connection
 from core.request import json_request_required
 
-from ..models import Comment, EventLog
+from ..models import Comment, EventLog, Instance
+
+
+# compiled representation of the comment
+comment_to_dict = Comment.projection('id', 'author_id', 'itype_id', 'i_id',
+                                     'content', 'created', 'updated')
 
 
 class CommentAPIView(web.View):
@@ -19,8 +24,7 @@ class CommentAPIView(web.View):
         cid = int(self.request.match_info['id'])
         try:
             comment = await Comment.list(db).get(Comment.id == cid)
-            return await comment.to_dict('id', 'author_id', 'itype_id', 'i_id',
-                                         'content', 'created', 'updated')
+            return comment_to_dict(comment)
         except Comment.DoesNotExist:
             raise CoreException(404, 'Comment Not Found')
 
@@ -42,18 +46,21 @@ class CommentAPIView(web.View):
             comment = Comment(**data)
             await comment.save(db)
 
-            # register an event
-            await EventLog(user_id=comment.author_id,
-                           tree_id=comment.tree_id,
-                           author_id=comment.author_id,
-                           comment_id=comment.id,
-                           comment_cdate=comment.created,
-                           e_type=EventLog.EventType.CREATED).save(db)
+            # register an event of the new tree version
+            # (it's stored in background)
+            version = await Instance.bump_version(db, comment.tree_id)
+            event = EventLog(user_id=comment.author_id,
+                             tree_id=comment.tree_id,
+                             author_id=comment.author_id,
+                             comment_id=comment.id,
+                             comment_cdate=comment.created,
+                             tree_version=version,
+                             e_type=EventLog.EventType.CREATED)
+            await self.request.app['event_writer'].write(event)
 
             # reload comment
             comment = await Comment.list(db).get(Comment.pk == comment.id)
-            return await comment.to_dict('id', 'author_id', 'itype_id', 'i_id',
-                                         'content', 'created', 'updated')
+            return comment_to_dict(comment)
 
         except t.DataError as e:
             raise CoreException(400, 'Bad Request', e.as_dict())
@@ -85,16 +92,19 @@ class CommentAPIView(web.View):
                 comment.content = data['content']
                 await comment.save(db)
 
-                # register an event
-                await EventLog(user_id=comment.author_id,
-                               tree_id=comment.tree_id,
-                               author_id=comment.author_id,
-                               comment_id=comment.id,
-                               comment_cdate=comment.created,
-                               e_type=EventLog.EventType.CHANGED).save(db)
+                # register an event of the new tree version
+                # (it's stored in background)
+                version = await Instance.bump_version(db, comment.tree_id)
+                event = EventLog(user_id=comment.author_id,
+                                 tree_id=comment.tree_id,
+                                 author_id=comment.author_id,
+                                 comment_id=comment.id,
+                                 comment_cdate=comment.created,
+                                 tree_version=version,
+                                 e_type=EventLog.EventType.CHANGED)
+                await self.request.app['event_writer'].write(event)
 
-            return await comment.to_dict('id', 'author_id', 'itype_id', 'i_id',
-                                         'content', 'created', 'updated')
+            return comment_to_dict(comment)
 
         except t.DataError as e:
             raise CoreException(400, 'Bad Request', e.as_dict())
@@ -119,7 +129,8 @@ class CommentAPIView(web.View):
         try:
             data = trafaret.check(await self.request.json())
             # load comment and check if it's author is the same as specified
-            comment = await Comment.list(db).get(Comment.pk == cid)
+            comment = await Comment.list(db).defer(Comment.content).get(
+                Comment.pk == cid)
             if not comment.author_id == data['user_id']:
                 raise CoreException(
                     403, 'Permission Denied',
@@ -130,16 +141,22 @@ class CommentAPIView(web.View):
                 raise CoreException(400, 'Bad Request',
                                     {'comment_id': 'Comment has children.'})
 
-            # delete comment
+            # delete comment (with the whole branch)
+            branch = await comment.branch(db)
             await comment.delete(db)
 
-            # register an event
-            await EventLog(user_id=comment.author_id,
-                           tree_id=comment.tree_id,
-                           author_id=comment.author_id,
-                           comment_id=cid,
-                           comment_cdate=comment.created,
-                           e_type=EventLog.EventType.DELETED).save(db)
+            # register events of the new tree version for every
+            # deleted comment (they are stored in background)
+            version = await Instance.bump_version(db, comment.tree_id)
+            for row in branch:
+                event = EventLog(user_id=data['user_id'],
+                                 tree_id=comment.tree_id,
+                                 author_id=row['author_id'],
+                                 comment_id=row['id'],
+                                 comment_cdate=row['created'],
+                                 tree_version=version,
+                                 e_type=EventLog.EventType.DELETED)
+                await self.request.app['event_writer'].write(event)
 
             return {}
 
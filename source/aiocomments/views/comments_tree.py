@@ -2,15 +2,24 @@
 import trafaret as t
 
 from aiohttp.web import StreamResponse
+from datetime import datetime, timedelta
 from sqlalchemy import text
 
 from core.exceptions import CoreException
-from core.db import acquire_connection
+from core.db import acquire_connection, STREAM_POOL
+from core.singleflight import single_flight
 from core.utils.json import json_dumps
 
-from ..models import Instance, Comment
+from ..models import Instance, Comment, EventLog
+from .events_feed import feed_settle
 
 
+# fields of the branch root (could be either Comment or Instance)
+ROOT_FIELDS = ('id', 'itype_id', 'i_id', 'author_id', 'content',
+               'created', 'updated', 'parent_id')
+
+
+@single_flight
 @acquire_connection
 async def get_comments_list(request, db):
     """Return JSON list of first level comments for the specified instance."""
@@ -49,7 +58,8 @@ async def get_comments_list(request, db):
 
         if req['last_id']:
             try:
-                c = await Comment.list(db).get(Comment.id == req['last_id'])
+                c = await Comment.list(db).defer(
+                    Comment.content).get(Comment.id == req['last_id'])
                 comments = comments.filter(
                     text('lft_num/lft_den::float > %s' % c.lft))
 
@@ -67,6 +77,7 @@ async def get_comments_list(request, db):
         raise CoreException(400, 'Bad Request', e.as_dict())
 
 
+@single_flight
 @acquire_connection
 async def get_comments_tree(request, db):
     """Return JSON list of comments in a tree hierarchy order.
@@ -104,6 +115,7 @@ async def get_comments_tree(request, db):
             {'i_id': req['i_id'], 'itype_id': req['itype_id']})
 
 
+@single_flight
 @acquire_connection
 async def get_comments_branch(request, db):
     """Return JSON dict that contains root node and the children comments."""
@@ -126,9 +138,7 @@ async def get_comments_branch(request, db):
                                              Comment.parent_id)
 
         result = {
-            "root": await root.to_dict('id', 'itype_id', 'i_id', 'author_id',
-                                       'content', 'created', 'updated',
-                                       'parent_id'),
+            "root": type(root).projection(*ROOT_FIELDS)(root),
             "comments": await comments,
         }
         return result
@@ -145,7 +155,110 @@ async def get_comments_branch(request, db):
             {'i_id': req['i_id'], 'itype_id': req['itype_id']})
 
 
+def tree_changes(events, version):
+    """Return (version, changed ids, deleted ids) of the events.
+
+    Events are applied in the tree versions order up to the first
+    missing version.
+    """
+    changed, deleted = set(), set()
+    for event in events:
+        if event['tree_version'] > version + 1:
+            break
+
+        version = max(version, event['tree_version'])
+        if event['e_type'] == EventLog.EventType.DELETED:
+            changed.discard(event['comment_id'])
+            deleted.add(event['comment_id'])
+        else:
+            changed.add(event['comment_id'])
+
+    return version, changed, deleted
+
+
+@single_flight
 @acquire_connection
+async def get_comments_changes(request, db):
+    """Return JSON dict of the tree comments changed since the version.
+
+    Changes are built from the EventLog, so the cost depends on the
+    number of changes, not on the tree size. The "changed" comments
+    (created or updated) are in the tree order, "deleted" are ids.
+    If events of some versions are lost (or compacted) the full tree
+    is returned with "reset" flag.
+    """
+    # use trafaret as validator
+    trafaret = t.Dict({
+        t.Key('i_id'): t.Int,
+        t.Key('itype_id'): t.Int,
+        t.Key('version'): t.Int,
+    })
+
+    try:
+        req = trafaret.check(request.match_info)
+        root = await Instance.list(db).get(
+            (Instance.itype_id == req['itype_id']) &
+            (Instance.i_id == req['i_id']))
+
+    except t.DataError as e:
+        raise CoreException(400, 'Bad Request', e.as_dict())
+
+    except Instance.DoesNotExist:
+        raise CoreException(
+            404, 'Instance Not Found',
+            {'i_id': req['i_id'], 'itype_id': req['itype_id']})
+
+    fields = (Comment.id, Comment.i_id, Comment.itype_id, Comment.author_id,
+              Comment.content, Comment.created, Comment.updated,
+              Comment.parent_id)
+    result = {'version': root.version, 'reset': False,
+              'changed': [], 'deleted': []}
+
+    version = req['version']
+    if version == root.version:
+        return result
+
+    reset = version > root.version
+    if not reset:
+        # store the events buffered by the process
+        await request.app['event_writer'].flush()
+        events = await (await EventLog.list(db).raw.select(
+            EventLog.comment_id, EventLog.e_type, EventLog.e_date,
+            EventLog.tree_version).filter(
+                (EventLog.tree_id == root.id) &
+                (EventLog.tree_version > version) &
+                (EventLog.tree_version <= root.version)).order_by(
+                    EventLog.tree_version))
+
+        version, changed, deleted = tree_changes(events, version)
+        if version < root.version:
+            # the missing version is older than the next event
+            # (or the last tree version), wait for it a bit
+            missed = next((e['e_date'] for e in events
+                           if e['tree_version'] > version), root.versioned)
+            horizon = datetime.utcnow() - timedelta(
+                seconds=feed_settle(request.app))
+            reset = missed.replace(tzinfo=None) < horizon
+
+    if reset:
+        _, comments = await Comment.tree(db, i_id=req['i_id'],
+                                         itype_id=req['itype_id'])
+        result['reset'] = True
+        result['changed'] = await (await comments.raw.select(*fields))
+        return result
+
+    if changed:
+        comments = Comment.list(db).raw.select(*fields) \
+            .filter((Comment.tree_id == root.id) &
+                    Comment.id.in_(sorted(changed))) \
+            .order_by(text('lft_num/lft_den::float'), Comment.scale)
+        result['changed'] = await (await comments)
+    result['version'] = version
+    result['deleted'] = sorted(deleted)
+    return result
+
+
+@acquire_connection(pool=STREAM_POOL)
 async def stream_comments_tree(request, db):
     r"""Return a collection of JSON dicts.
 
@@ -170,6 +283,11 @@ async def stream_comments_tree(request, db):
                                              Comment.created, Comment.updated,
                                              Comment.parent_id)
 
+        # fetch all the rows and give the connection back to the pool
+        # so it won't be pinned while the client is reading the stream
+        rows = await comments
+        await db.release()
+
         stream = StreamResponse(status=200,
                                 reason='OK',
                                 headers={'Content-Type': 'text/html'})
@@ -181,10 +299,8 @@ async def stream_comments_tree(request, db):
 
         await stream.prepare(request)
 
-        while True:
-            chunk = await comments.fetchmany(3)
-            if not chunk:
-                break
+        for i in range(0, len(rows), 3):
+            chunk = rows[i:i + 3]
             data = ''
             for row in chunk:
                 data += '%s\r\n' % json_dumps(row)
@@ -209,7 +325,7 @@ async def stream_comments_tree(request, db):
             {'i_id': req['i_id'], 'itype_id': req['itype_id']})
 
 
-@acquire_connection
+@acquire_connection(pool=STREAM_POOL)
 async def stream_user_comments(request, db):
     r"""Return a collection of JSON dicts.
 
@@ -229,6 +345,11 @@ async def stream_user_comments(request, db):
             .filter(Comment.author_id == req['user_id']) \
             .order_by(Comment.created)
 
+        # fetch all the rows and give the connection back to the pool
+        # so it won't be pinned while the client is reading the stream
+        rows = await comments
+        await db.release()
+
         stream = StreamResponse(status=200,
                                 reason='OK',
                                 headers={'Content-Type': 'text/html'})
@@ -240,10 +361,8 @@ async def stream_user_comments(request, db):
 
         await stream.prepare(request)
 
-        while True:
-            chunk = await comments.fetchmany(3)
-            if not chunk:
-                break
+        for i in range(0, len(rows), 3):
+            chunk = rows[i:i + 3]
             data = ''
             for row in chunk:
                 data += '%s\r\n' % json_dumps(row)
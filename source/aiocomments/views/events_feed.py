@@ -0,0 +1,163 @@
+"""AIOComments Change Feed."""
+import asyncio
+import base64
+import binascii
+import time
+
+import sqlalchemy as sa
+import trafaret as t
+
+from aiohttp.web import StreamResponse
+
+from core.exceptions import CoreException
+from core.db import acquire_connection, STREAM_POOL
+from core.utils.json import json_dumps
+
+from ..consumers import EventFeedConsumer
+from ..models import EventLog
+
+
+# retried batches and backpressure could delay the buffered events
+# for this time (in seconds) more than the writer flush interval
+FEED_SETTLE = 1
+# interval (in seconds) to recheck the events held back
+# by the older transactions still in flight
+FEED_POLL = 0.1
+# max number of events per response
+FEED_LIMIT = 1000
+# max time (in seconds) to wait for the new events
+FEED_MAX_WAIT = 60
+
+# fields of the feed events
+EVENT_FIELDS = ('id', 'tree_id', 'author_id', 'user_id', 'comment_id',
+                'comment_cdate', 'e_type', 'e_date')
+
+
+def encode_cursor(txid, event_id):
+    """Return opaque cursor pointing right after the event."""
+    value = '%d.%d' % (txid, event_id)
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (txid, event id) of the cursor."""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        txid, event_id = value.decode().split('.')
+        return int(txid), int(event_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise t.DataError({'cursor': 'invalid cursor'})
+
+
+def feed_settle(app):
+    """Return time (in seconds) the event could be buffered for.
+
+    Events are stored in background, retried batches and backpressure
+    could delay them even more, so it's a guess.
+    """
+    return app['event_writer'].flush_interval + FEED_SETTLE
+
+
+def feed_query(db, req):
+    """Return query of the events after the cursor.
+
+    Events are read with a seek by (txid, id) - the id of the transaction
+    that stored the event. Events of the transactions newer than the
+    oldest one still in flight are not settled: a transaction with
+    a smaller txid could commit after them. Settled events are final,
+    so the events stored late (e.g. retried by the writer) are still
+    after the cursors given out before. The redundant txid bound lets
+    the ix_tree_feed/ix_author_feed index range scan.
+    """
+    xmin = sa.func.txid_snapshot_xmin(sa.func.txid_current_snapshot())
+    query = EventLog.list(db).raw.select(
+        *(getattr(EventLog, n) for n in EVENT_FIELDS),
+        EventLog.txid,
+        (EventLog.txid < xmin).label('settled'))
+
+    if req['tree_id'] is not None:
+        query = query.filter(EventLog.tree_id == req['tree_id'])
+    if req['author_id'] is not None:
+        query = query.filter(EventLog.author_id == req['author_id'])
+    if req['cursor'] is not None:
+        txid, event_id = req['cursor']
+        query = query.filter(
+            EventLog.txid >= txid,
+            sa.tuple_(EventLog.txid, EventLog.id) > sa.tuple_(txid, event_id))
+
+    return query.order_by(EventLog.txid, EventLog.id)
+
+
+@acquire_connection(pool=STREAM_POOL)
+async def get_events_feed(request, db):
+    r"""Return events after the cursor as JSON dicts separated by \n.
+
+    Every event has the cursor to continue after it, X-Next-Cursor
+    header has the cursor of the last one. When there are no events
+    request waits up to `wait` seconds for them (long polling),
+    the connection goes back to the pool meanwhile.
+    """
+    # use trafaret as validator
+    trafaret = t.Dict({
+        t.Key('tree_id', optional=True, default=None): (t.Int | t.Null),
+        t.Key('author_id', optional=True, default=None): (t.Int | t.Null),
+        t.Key('cursor', optional=True, default=None):
+            (t.Null | t.String() & decode_cursor),
+        t.Key('limit', optional=True, default=100):
+            t.Int(gte=1, lte=FEED_LIMIT),
+        t.Key('wait', optional=True, default=0):
+            t.Float(gte=0, lte=FEED_MAX_WAIT),
+    })
+
+    try:
+        req = trafaret.check(dict(request.query))
+    except t.DataError as e:
+        raise CoreException(400, 'Bad Request', e.as_dict())
+
+    query = feed_query(db, req)
+    deadline = time.monotonic() + req['wait']
+    consumer = None
+    try:
+        while True:
+            rows = await (await query[req['limit']])
+            # hold back the events that are not settled yet
+            # (they are the last ones in the txid order)
+            events = [row for row in rows if row['settled']]
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                break
+
+            await db.release()
+            if rows:
+                # wait until the older transactions are finished
+                await asyncio.sleep(min(FEED_POLL, remaining),
+                                    loop=request.app.loop)
+            else:
+                if consumer is None:
+                    consumer = EventFeedConsumer(loop=request.app.loop)
+                await consumer.wait(remaining)
+    finally:
+        if consumer is not None:
+            consumer.close()
+
+    # give the connection back to the pool before the client reads
+    await db.release()
+
+    cursor = request.query.get('cursor', '')
+    data = ''
+    for row in events:
+        event = {n: row[n] for n in EVENT_FIELDS}
+        cursor = event['cursor'] = encode_cursor(row['txid'], row['id'])
+        data += '%s\n' % json_dumps(event)
+
+    stream = StreamResponse(status=200,
+                            reason='OK',
+                            headers={'Content-Type': 'application/x-ndjson'})
+    stream.headers['Cache-Control'] = 'no-cache'
+    stream.headers['X-Next-Cursor'] = cursor
+
+    await stream.prepare(request)
+    stream.write(data.encode('utf-8'))
+    await stream.drain()
+    await stream.write_eof()
+    return stream
@@ -1,16 +1,24 @@
 """User Requests Controller."""
+import asyncio
+import math
+import os
 
 import aiofiles
 import trafaret as t
 
-from aiohttp.web import StreamResponse, FileResponse
+from aiohttp.web import StreamResponse
 from datetime import datetime
 
 from core.exceptions import CoreException
-from core.db import acquire_connection
+from core.db import acquire_connection, STREAM_POOL
+from core.response import RangeFileResponse
 
-from ..consumers import DlResponseConsumer
-from ..models import UserDlRequest, DlRequest, Comment, Instance, EventLog
+from ..lib.report_writers import get_writer
+from ..models import UserDlRequest, DlRequest, Comment, Instance
+
+
+# max size of the report chunk written to the response
+CHUNK_SIZE = 65536
 
 
 @acquire_connection
@@ -37,7 +45,7 @@ async def get_user_dlrequests(request, db):
         raise CoreException(400, 'Bad Request', e.as_dict())
 
 
-@acquire_connection
+@acquire_connection(pool=STREAM_POOL)
 async def download(request, db):
     """Prepare and return report according to request params."""
     # use trafaret as validator
@@ -75,8 +83,8 @@ async def download(request, db):
             if req['i_id']:
                 # make sure that requested instance exists.
                 if req['itype_id'] == 0:
-                    root = await Comment.list(db).get(
-                        Comment.id == req['i_id'])
+                    root = await Comment.list(db).defer(
+                        Comment.content).get(Comment.id == req['i_id'])
 
                 else:
                     root = await Instance.list(db).get(
@@ -123,29 +131,24 @@ async def download(request, db):
         except (Comment.DoesNotExist, Instance.DoesNotExist):
             raise CoreException(404, 'Root Instance Not Found')
 
+        report_filepath = request.app['fs'].path(dlreq.filename)
+
+        # the report could be evicted from the storage meanwhile
+        if dlreq.state == DlRequest.State.VALID and \
+                not os.path.isfile(report_filepath):
+            dlreq.state = DlRequest.State.INVALID
+            dlreq.size = None
+            await dlreq.save(db, request.app['fs'])
+
         # proceed with request validation
         # make sure there are no events that could affect
         # previously generated report
         if dlreq.state == DlRequest.State.VALID:
+            # store buffered events first
+            await request.app['event_writer'].flush()
             # build events query based on DlRequest params
-            events = EventLog.list(db).filter(EventLog.e_date > dlreq.created)
-
-            if root is not None:
-                events = events.filter(EventLog.tree_id == root.tree_id)
-
-            if dlreq.author_id:
-                events = events.filter(EventLog.author_id == dlreq.author_id)
-
-            if dlreq.start:
-                if dlreq.end:
-                    events = events.filter(
-                        EventLog.comment_cdate.between(dlreq.start, dlreq.end))
-                else:
-                    events = events.filter(
-                        EventLog.comment_cdate >= dlreq.start)
-
-            elif dlreq.end:
-                events = events.filter(EventLog.comment_cdate <= dlreq.end)
+            events = dlreq.events(
+                db, root.tree_id if root is not None else None)
 
             # check the number of events which affected
             # previously generated report
@@ -155,8 +158,8 @@ async def download(request, db):
                 await dlreq.save(db, request.app['fs'])
 
         # prepare requested report
+        fmt = DlRequest.Format[dlreq.fmt].verbose
         report_filename = 'report'
-        report_filepath = request.app['fs'].path(dlreq.filename)
         # if req['author_id']:
         #     report_filename += '-user%s' % req['author_id']
         # if req['i_id']:
@@ -164,9 +167,9 @@ async def download(request, db):
         #         else '-instance%s(%s)' % (req['i_id'], req['itype_id'])
 
         headers = {
-            'Content-Type': 'text/xml',
+            'Content-Type': get_writer(dlreq.fmt).mimetype,
             'Content-Disposition':
-                'attachment; filename="%s.xml"' % report_filename,
+                'attachment; filename="%s.%s"' % (report_filename, fmt),
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive'
         }
@@ -175,32 +178,88 @@ async def download(request, db):
         # and if it's still valid (there were no updates or new comments
         # created within a period specified by the request)
         if dlreq.state == DlRequest.State.VALID:
-            # return a pure FileResponse
-            return FileResponse(report_filepath, headers=headers)
+            await touch_report(db, dlreq)
+            # return the file (supports ranges and conditional requests)
+            return RangeFileResponse(report_filepath, dlreq.etag,
+                                     headers=headers)
 
         else:
-            stream = StreamResponse(status=200, reason='OK', headers=headers)
-            # stream.enable_chunked_encoding()
-            await stream.prepare(request)
+            # don't keep the connection while report is being generated
+            await db.release()
 
-            # here we will await for the message from the report builder
-            # over local pubsub service
-            await DlResponseConsumer(dlreq.id, loop=request.app.loop).run()
+            # concurrent downloads of the request attach to the same build
+            reporter = request.app['reporter']
+            try:
+                job = await reporter.wait(dlreq.id, fmt)
+            except asyncio.TimeoutError:
+                raise CoreException(
+                    503, 'Service Unavailable',
+                    {'_': 'Report is being generated.'},
+                    {'Retry-After': str(math.ceil(reporter.wait_timeout))})
+
+            if job.done and not job.success:
+                raise CoreException(500, 'Internal Server Error',
+                                    {'_': 'Report generation failed.'})
+
+            if job.done:
+                # the report is already built (or built by another
+                # process), the generation of the file is reloaded
+                dlreq = await DlRequest.list(db).get(DlRequest.id == dlreq.id)
+                await touch_report(db, dlreq)
+                await db.release()
+                return RangeFileResponse(report_filepath, dlreq.etag,
+                                         headers=headers)
 
-            # stream generated report file
-            async with aiofiles.open(request.app['fs'].path(dlreq.filename),
-                                     'r') as fd:
-                while True:
-                    chunk = await fd.read(1024)
-                    if not chunk:
-                        break
-                    stream.write(chunk.encode('utf-8'))
+            stream = StreamResponse(status=200, reason='OK', headers=headers)
+            stream.enable_chunked_encoding()
+            await stream.prepare(request)
 
-                    # yield to the scheduler so other processes do stuff.
-                    await stream.drain()
+            if not await tail_report(stream, job, report_filepath):
+                # the response is already started, so the connection
+                # is closed to let the client know it's incomplete
+                request.transport.close()
+                return stream
 
             await stream.write_eof()
             return stream
 
     except t.DataError as e:
         raise CoreException(400, 'Bad Request', e.as_dict())
+
+
+async def touch_report(db, dlreq):
+    """Mark the report as recently downloaded (it's evicted later)."""
+    await DlRequest.list(db).filter(DlRequest.id == dlreq.id).update(
+        downloaded=datetime.utcnow())
+
+
+async def tail_report(stream, job, path):
+    """Write the report file to the stream while it's being written.
+
+    Parts of the file are sent as soon as the reporter writes them.
+    Return True if the whole report is sent.
+    """
+    try:
+        fd = await aiofiles.open(job.path, 'rb')
+    except FileNotFoundError:
+        # the build is done and the file is moved in place
+        fd = await aiofiles.open(path, 'rb')
+
+    sent = 0
+    try:
+        while True:
+            await job.wait(sent)
+            if job.size > sent:
+                chunk = await fd.read(min(job.size - sent, CHUNK_SIZE))
+                if not chunk:
+                    return False
+                stream.write(chunk)
+                sent += len(chunk)
+
+                # yield to the scheduler so other processes do stuff.
+                await stream.drain()
+
+            elif job.done:
+                return job.success
+    finally:
+        await fd.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Request throughput of the existing routes with different event loops.
+
+Every loop runs a separate server process (run.py) on the port from
+the config. Benchmark creates its own comments trees, so run it
+against the test database:
+
+    $ cd source
+    $ python benchmarks/loops.py -c config/test.yaml -n 2000 -C 50
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import yaml
+
+# instance type of the trees created by the benchmark
+BENCH_ITYPE_ID = 999
+
+ROUTES = (
+    '/api/comment/{comment_id}/',
+    '/api/comments/list/{i_id}/{itype_id}/',
+    '/api/comments/tree/{i_id}/{itype_id}/',
+    '/api/comments/branch/{comment_id}/',
+)
+
+
+def wait_for_port(host, port, timeout=30):
+    started = time.time()
+    while time.time() - started < timeout:
+        try:
+            socket.create_connection((host, port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server didn't start on %s:%s" % (host, port))
+
+
+async def make_tree(session, url, i_id, size):
+    """Create a tree with a root comment and its children."""
+    data = {'user_id': 1, 'i_id': i_id, 'itype_id': BENCH_ITYPE_ID,
+            'content': 'benchmark root'}
+    async with session.put(url + '/api/comment/', json=data) as resp:
+        if resp.status != 200:
+            raise RuntimeError('Failed to create a comment: %s'
+                               % await resp.text())
+        root = await resp.json()
+
+    for i in range(size):
+        data = {'user_id': 1, 'i_id': root['id'], 'itype_id': 0,
+                'content': 'benchmark comment %s' % i}
+        async with session.put(url + '/api/comment/', json=data) as resp:
+            await resp.read()
+
+    return root['id']
+
+
+async def bench_route(session, url, num, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def fetch():
+        nonlocal errors
+        async with sem:
+            async with session.get(url) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors += 1
+
+    started = time.time()
+    await asyncio.gather(*[fetch() for i in range(num)])
+    return num / (time.time() - started), errors
+
+
+async def bench(base_url, i_id, args):
+    results = []
+    conn = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=conn) as session:
+        comment_id = await make_tree(session, base_url, i_id, args.tree_size)
+        for route in ROUTES:
+            url = base_url + route.format(comment_id=comment_id, i_id=i_id,
+                                          itype_id=BENCH_ITYPE_ID)
+            rps, errors = await bench_route(session, url, args.requests,
+                                            args.concurrency)
+            results.append((route, rps, errors))
+    return results
+
+
+def main(argv):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('-c', '--config', default='./config/test.yaml')
+    ap.add_argument('-n', '--requests', type=int, default=2000,
+                    help='number of requests per route')
+    ap.add_argument('-C', '--concurrency', type=int, default=50)
+    ap.add_argument('-t', '--tree-size', type=int, default=50,
+                    help='number of comments in the benchmark tree')
+    ap.add_argument('loops', nargs='*', default=['asyncio', 'uvloop'])
+    args = ap.parse_args(argv)
+
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    base_url = 'http://%s:%s' % (config['host'], config['port'])
+
+    report = {}
+    for idx, loop_name in enumerate(args.loops):
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as cfg:
+            yaml.safe_dump(dict(config, loop=loop_name, debug=False), cfg)
+            cfg.flush()
+
+            proc = subprocess.Popen(
+                [sys.executable, 'run.py', '-c', cfg.name],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(config['host'], config['port'])
+                # every loop gets its own tree of the same size
+                i_id = int(time.time()) % 10 ** 8 * 10 + idx
+                report[loop_name] = asyncio.get_event_loop().run_until_complete(
+                    bench(base_url, i_id, args))
+            finally:
+                proc.send_signal(signal.SIGINT)
+                proc.wait()
+
+    print('%-42s' % 'route' +
+          ''.join('%14s' % name for name in report.keys()))
+    for i, route in enumerate(ROUTES):
+        row = '%-42s' % route
+        for results in report.values():
+            r, rps, errors = results[i]
+            row += '%14s' % ('%.0f rps' % rps + ('!' if errors else ''))
+        print(row)
+    print('(! - some requests failed)')
+
+
+if __name__ == '__main__':
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main(sys.argv[1:])
@@ -1,11 +1,15 @@
 import trafaret as T
 
+from core.utils.loop import LOOPS
+
 
 primitive_ip_regexp = r'^[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}$'
 dotted_path_regexp = r'^[\.]{0,2}([^\d][\w]+|\.[^\d]\w+)+[^.]$'
 
 TRAFARET = T.Dict({
     T.Key('debug'): T.Bool(),
+    # event loop: auto (uvloop if installed), uvloop or asyncio
+    T.Key('loop', optional=True, default='auto'): T.Enum(*LOOPS),
     T.Key('postgres'):
         T.Dict({
             T.Key('debug'): T.Bool(),
@@ -16,18 +20,80 @@ TRAFARET = T.Dict({
             'port': T.Int(),
             'minsize': T.Int(),
             'maxsize': T.Int(),
+            # named pools with their own sizes and acquire timeouts
+            T.Key('pools', optional=True):
+                T.Mapping(T.String(), T.Dict({
+                    'minsize': T.Int(),
+                    'maxsize': T.Int(),
+                    T.Key('timeout', optional=True): T.Float(),
+                })),
         }),
     T.Key('filestorage'):
         T.Dict({
-            T.Key('root'): T.String()
+            T.Key('root'): T.String(),
+            # bytes budget of the stored files (0 - unlimited)
+            T.Key('max_size', optional=True, default=0): T.Int(gte=0),
         }),
     T.Key('redis'):
         T.Dict({
             'host': T.String(),
             'port': T.Int(),
         }),
+    # write-behind of the comments events
+    T.Key('eventlog', optional=True, default={}):
+        T.Dict({
+            T.Key('durability', optional=True, default='async'):
+                T.Enum('async', 'group'),
+            T.Key('batch_size', optional=True, default=100): T.Int(gte=1),
+            T.Key('flush_interval', optional=True, default=0.5):
+                T.Float(gt=0),
+            T.Key('max_buffer', optional=True, default=10000): T.Int(gte=1),
+        }),
+    # compaction of the comments events
+    T.Key('retention', optional=True, default={}):
+        T.Dict({
+            T.Key('interval', optional=True, default=3600): T.Int(gte=0),
+            T.Key('keep', optional=True, default=3600): T.Int(gte=0),
+            T.Key('batch_size', optional=True, default=5000): T.Int(gte=1),
+            T.Key('pause', optional=True, default=0.1): T.Float(gte=0),
+            T.Key('archive', optional=True, default=False): T.Bool(),
+        }),
+    # rendering of the comments reports
+    T.Key('reports', optional=True, default={}):
+        T.Dict({
+            T.Key('executor', optional=True, default='thread'):
+                T.Enum('thread', 'process'),
+            T.Key('workers', optional=True, default=2): T.Int(gte=1),
+            T.Key('batch_size', optional=True, default=500): T.Int(gte=1),
+            T.Key('queue_size', optional=True, default=4): T.Int(gte=1),
+            T.Key('wait_timeout', optional=True, default=300):
+                T.Float(gt=0),
+        }),
+    # share of the requests with phases timing (Server-Timing header)
+    T.Key('timing', optional=True):
+        T.Dict({
+            T.Key('sample_rate', optional=True, default=1.0):
+                T.Float(gte=0, lte=1),
+        }),
+    # load shedding limits by request classes
+    T.Key('admission', optional=True):
+        T.Dict({
+            T.Key('retry_after', optional=True, default=1): T.Int(gte=1),
+            T.Key('exempt', optional=True, default=['/metrics']):
+                T.List(T.String()),
+            T.Key('streams', optional=True, default=[]): T.List(T.String()),
+            T.Key('classes', optional=True, default={}):
+                T.Mapping(T.Enum('write', 'read', 'stream'), T.Dict({
+                    T.Key('pool', optional=True, default='default'):
+                        T.String(),
+                    T.Key('max_inflight', optional=True): T.Int(gte=1),
+                    T.Key('max_wait', optional=True): T.Float(gte=0),
+                })),
+        }),
     T.Key('host'): T.String(regex=primitive_ip_regexp),
     T.Key('port'): T.Int(),
     T.Key('apps'): T.List(T.String(regex=r'^[^\d]\w+$')),
     T.Key('middlewares'): T.List(T.String(regex=dotted_path_regexp)),
+    # package with jinja2 templates (templates are disabled if not set)
+    T.Key('templates', optional=True): T.String(regex=r'^[^\d]\w+$'),
 })
@@ -1,17 +1,30 @@
 import aiopg.sa
+import asyncio
+import functools
 import logging
 import sqlalchemy as sa
 
 from aiohttp.web_request import Request
 
-__all__ = ['acquire_connection']
+from .exceptions import PoolTimeout
+from .stats import PoolStats
+from ..utils.timing import phase
+
+__all__ = ['acquire_connection', 'get_connection', 'LazyConnection',
+           'PoolStats',
+           'DEFAULT_POOL', 'STREAM_POOL', 'BACKGROUND_POOL']
+
+# named connection pools
+DEFAULT_POOL = 'default'
+STREAM_POOL = 'stream'
+BACKGROUND_POOL = 'background'
 
 meta = sa.MetaData()
 
 log = logging.getLogger('database')
 
 
-def migrate(config):
+def create_sync_engine(config):
     conf = config['postgres']
     dsn = 'postgresql://{user}:{password}@{host}:{port}/{database}'.format(
         database=conf['database'],
@@ -20,7 +33,11 @@ def migrate(config):
         host=conf['host'],
         port=conf['port'])
 
-    engine = sa.create_engine(dsn, echo=conf['debug'])
+    return sa.create_engine(dsn, echo=conf['debug'])
+
+
+def migrate(config):
+    engine = create_sync_engine(config)
     with engine.connect() as conn:
         for tname, t in meta.tables.items():
             try:
@@ -30,30 +47,156 @@ def migrate(config):
                 log.debug("Table '%s' does not exists" % tname)
 
     meta.create_all(engine)
+    _create_partitions(engine)
+
+
+def maintain_partitions(config):
+    """Create missing partitions of the partitioned tables.
+
+    Should be run periodically (e.g. by cron) so range partitions
+    are always created ahead of time.
+    """
+    _create_partitions(create_sync_engine(config))
+
+
+def _create_partitions(engine):
+    with engine.connect() as conn:
+        for tname, t in meta.tables.items():
+            partition = t.info.get('partition')
+            if partition is not None:
+                for ddl in partition.create_ddl(tname):
+                    # DO blocks aren't autocommitted by default
+                    conn.execute(sa.text(ddl).execution_options(
+                        autocommit=True))
+
+
+def pools_config(conf):
+    """Return settings of the named pools.
+
+    Default pool settings are taken from the postgres section itself
+    unless the pool is declared explicitly.
+    """
+    pools = {
+        DEFAULT_POOL: {
+            'minsize': conf['minsize'],
+            'maxsize': conf['maxsize'],
+        },
+    }
+    pools.update(conf.get('pools', {}))
+    return pools
 
 
 async def init_pg(app):
     conf = app['config']['postgres']
-    engine = await aiopg.sa.create_engine(
-        database=conf['database'],
-        user=conf['user'],
-        password=conf['password'],
-        host=conf['host'],
-        port=conf['port'],
-        minsize=conf['minsize'],
-        maxsize=conf['maxsize'],
-        loop=app.loop)
-    app['db'] = engine
+    pools = {}
+    for name, pool_conf in pools_config(conf).items():
+        engine = await aiopg.sa.create_engine(
+            database=conf['database'],
+            user=conf['user'],
+            password=conf['password'],
+            host=conf['host'],
+            port=conf['port'],
+            minsize=pool_conf['minsize'],
+            maxsize=pool_conf['maxsize'],
+            loop=app.loop)
+        pools[name] = (engine, pool_conf.get('timeout'))
+
+    app['db_pools'] = pools
+    app['db_stats'] = {name: PoolStats() for name in pools}
+    app['db'] = pools[DEFAULT_POOL][0]
 
 
 async def close_pg(app):
-    app['db'].close()
-    await app['db'].wait_closed()
+    engines = [engine for engine, timeout in app['db_pools'].values()]
+    for engine in engines:
+        engine.close()
+    for engine in engines:
+        await engine.wait_closed()
+
+
+def get_connection(app, pool=DEFAULT_POOL):
+    """Return a lazy connection to the named pool.
+
+    Falls back to the default pool if the requested one isn't configured.
+    """
+    pools = app['db_pools']
+    if pool not in pools:
+        pool = DEFAULT_POOL
+    engine, timeout = pools[pool]
+    return LazyConnection(engine, timeout, app.get('db_stats', {}).get(pool))
+
+
+class LazyConnection:
+    """Proxy for the engine connection that is acquired on demand.
+
+    Pool connection is taken on the first executed query and could be
+    returned back to the pool with release() as soon as all the results
+    are fetched. Next query will acquire a connection again.
+    """
+
+    def __init__(self, engine, timeout=None, stats=None):
+        """Setup proxy for the engine.
+
+        Timeout limits the time (in seconds) to wait for a free connection.
+        Wait time is recorded to the pool stats if provided.
+        """
+        self._engine = engine
+        self._timeout = timeout
+        self._stats = stats
+        self._conn = None
+
+    @property
+    def acquired(self):
+        """If proxy holds a pool connection at the moment."""
+        return self._conn is not None
+
+    async def acquire(self):
+        """Acquire a pool connection if it wasn't acquired yet."""
+        if self._conn is None:
+            token = self._stats.started() if self._stats else None
+            try:
+                with phase('db-acquire'):
+                    self._conn = await asyncio.wait_for(
+                        self._engine.acquire(), self._timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeout()
+            finally:
+                if token is not None:
+                    self._stats.finished(token)
+        return self._conn
+
+    async def execute(self, *args, **kwargs):
+        """Execute query using acquired connection."""
+        with phase('sql'):
+            conn = await self.acquire()
+            return await conn.execute(*args, **kwargs)
+
+    async def release(self):
+        """Return the connection to the pool."""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._engine.release(conn)
+
+
+def acquire_connection(f=None, pool=DEFAULT_POOL):
+    """Provide a lazy db connection to the handler.
+
+    Connection is not taken from the pool until the first query and
+    is released when the handler is done (or earlier by the handler itself).
 
+    Usage:
+        @acquire_connection
+        @acquire_connection(pool=STREAM_POOL)
+    """
+    if f is None:
+        return lambda f: acquire_connection(f, pool=pool)
 
-def acquire_connection(f):
+    @functools.wraps(f)
     async def wrapper(view, *args, **kwargs):
         _request = view if isinstance(view, Request) else view.request
-        async with _request.app['db'].acquire() as conn:
+        conn = get_connection(_request.app, pool)
+        try:
             return await f(view, conn, *args, **kwargs)
+        finally:
+            await conn.release()
     return wrapper
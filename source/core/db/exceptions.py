@@ -1,3 +1,5 @@
+from ..exceptions import CoreException
+
 
 class RecordNotFound(Exception):
     """Requested record in database was not found."""
@@ -5,3 +7,10 @@ class RecordNotFound(Exception):
 
 class ObjectDoesNotExist(Exception):
     pass
+
+
+class PoolTimeout(CoreException):
+    """There was no free connection in the pool within a timeout."""
+
+    def __init__(self, msg='Service Unavailable', data=None):
+        super().__init__(503, msg, data)
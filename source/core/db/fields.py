@@ -7,6 +7,7 @@ __all__ = [
     'CheckConstraint',
     'String',
     'Integer',
+    'BigInteger',
     'Text',
     'DateTime',
     'Float',
@@ -42,6 +43,12 @@ class Integer(Field):
         super().__init__(*args, **kwargs)
 
 
+class BigInteger(Field):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.type = sa.BigInteger
+
+
 class Float(Field):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -75,7 +82,9 @@ class Boolean(Field):
 
 
 class ForeignKey(Field):
-    def __init__(self, fk_column, *args, **kwargs):
+    def __init__(self, fk_column, *args, ondelete=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.type = sa.ForeignKey
         self.type_args = [fk_column]
+        if ondelete:
+            self.type_kwargs = {'ondelete': ondelete}
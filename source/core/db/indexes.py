@@ -0,0 +1,73 @@
+"""Index Declarations."""
+import sqlalchemy as sa
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateIndex
+
+__all__ = ['Index']
+
+
+class Index:
+    """Extended index declaration for the model Meta.
+
+    Columns could be specified either by field names or by functions
+    bound to the model which return sqlalchemy expressions.
+
+    Usage:
+        class Meta:
+            index = (
+                # expression index
+                Index('ix_key', 'tree_id',
+                      lambda m: m.lft_num / cast(m.lft_den, Float)),
+                # covering index (PostgreSQL 11+)
+                Index('ix_level', 'tree_id', 'parent_id',
+                      include=('id', 'created')),
+                # partial index
+                Index('ix_valid', 'created',
+                      where=lambda m: m.state == m.State.VALID),
+                # BRIN index
+                Index('ix_date', 'e_date', using='brin'),
+            )
+    """
+
+    def __init__(self, name, *columns, include=(), where=None, using=None,
+                 unique=False):
+        """Setup index declaration."""
+        self.name = name
+        self.columns = columns
+        self.include = tuple(include)
+        self.where = where
+        self.using = using
+        self.unique = unique
+
+    def define(self, model):
+        """Return sqlalchemy Index for the model."""
+        columns = [c(model) if hasattr(c, '__call__') else getattr(model, c)
+                   for c in self.columns]
+        options = {}
+        if self.using:
+            options['postgresql_using'] = self.using
+        if self.where is not None:
+            options['postgresql_where'] = self.where(model)
+
+        index = sa.Index(self.name, *columns, unique=self.unique, **options)
+        index.info['include'] = self.include
+        return index
+
+
+@compiles(CreateIndex, 'postgresql')
+def compile_create_index(create, compiler, **kw):
+    """Add INCLUDE clause to the CREATE INDEX statement."""
+    ddl = compiler.visit_create_index(create, **kw)
+    include = create.element.info.get('include')
+    if include:
+        clause = ' INCLUDE (%s)' % ', '.join(
+            compiler.preparer.quote(c) for c in include)
+        # INCLUDE goes right before WHERE clause of the partial index
+        if create.element.dialect_options['postgresql']['where'] is not None:
+            pos = ddl.rfind(' WHERE ')
+            ddl = ddl[:pos] + clause + ddl[pos:]
+        else:
+            ddl += clause
+
+    return ddl
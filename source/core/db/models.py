@@ -3,8 +3,9 @@
 from collections import OrderedDict
 
 from .exceptions import ObjectDoesNotExist
-from .fields import Field, Serial
+from .fields import Field, ForeignKey, Integer, Serial
 from .fieldslist import FieldsList, exclude
+from .indexes import Index
 from .managers import ModelManager
 from .storage import Storage
 from ..utils.comboprops import comboproperty
@@ -25,8 +26,86 @@ class ModelMeta:
             'unique': (),
             'index': (),
         }
+        # side storages declarations: ((storagename, (field_name, ...)), ...)
+        self.side_storages = ()
+        # partitioning declaration of the primary storage
+        self.partition = None
         # instance db state: 0 - unsaved; 1 - saved;
         self.db_state = 0
+        # compiled projections cache
+        self.projections = {}
+
+    def columns(self, deferred=()):
+        """Return columns to select the model from all its storages.
+
+        Primary keys of the side storages are skipped as well as
+        deferred fields.
+        """
+        columns = []
+        for storage in self.storages:
+            for n, c in storage.c.items():
+                if n in deferred or (n == self.pk and columns):
+                    continue
+                columns.append(c)
+
+        return columns
+
+
+def projection_key(fields):
+    """Return hashable key for the fields declaration."""
+    key = []
+    for el in fields:
+        if isinstance(el, dict):
+            # custom and related declarations
+            key.append((type(el).__name__, tuple(
+                (n, tuple(v) if isinstance(v, (list, tuple)) else v)
+                for n, v in sorted(el.items()))))
+
+        elif isinstance(el, list):
+            # exclude declaration
+            key.append((type(el).__name__, tuple(el)))
+
+        else:
+            key.append(el)
+
+    return tuple(key)
+
+
+def compile_projection(meta, fl):
+    """Compile a function that builds dict representation of the instance.
+
+    All the parsing of the fields list is done once here,
+    so the function itself only reads attributes.
+    """
+    names = tuple(n for n in meta.fields.keys() if n in fl)
+    custom = tuple((alias, tuple(path)) for alias, path in fl.custom.items())
+    related = tuple((fld, sfl, {}) for fld, sfl in fl.related.items())
+
+    def projection(obj):
+        result = {n: getattr(obj, n, None) for n in names}
+
+        # handle custom fields
+        for alias, path in custom:
+            value = obj
+            for fld in path:
+                value = getattr(value, fld, None)
+
+            result[alias] = value() if hasattr(value, '__call__') else value
+
+        # handle related fields
+        for fld, sfl, compiled in related:
+            value = getattr(obj, fld, None)
+            if isinstance(value, Model):
+                model = type(value)
+                if model not in compiled:
+                    compiled[model] = compile_projection(model._meta, sfl)
+                value = compiled[model](value)
+
+            result[fld] = value
+
+        return result
+
+    return projection
 
 
 class ModelMetaBase(type):
@@ -52,6 +131,7 @@ class ModelMetaBase(type):
         meta.storagename = getattr(_meta, 'storagename', meta.storagename)
         meta.constraints['unique'] = getattr(_meta, 'unique', ())
         meta.constraints['index'] = getattr(_meta, 'index', ())
+        meta.partition = getattr(_meta, 'partition', None)
 
         # set serial field
         meta.fields[meta.pk] = Serial()
@@ -67,13 +147,44 @@ class ModelMetaBase(type):
             else:
                 setattr(model, n, attr)
 
-        # define model storage
-        storage = Storage(meta.storagename, meta.fields, meta.constraints)
+        # fields that are stored in the side storages
+        meta.side_storages = getattr(_meta, 'storages', ())
+        side_fields = set()
+        for storagename, names in meta.side_storages:
+            side_fields.update(names)
+
+        # define model primary storage
+        storage = Storage(meta.storagename,
+                          OrderedDict((n, f) for n, f in meta.fields.items()
+                                      if n not in side_fields),
+                          meta.constraints, meta.partition)
         meta.storages.append(storage)
 
+        # define side storages linked to the primary one by primary key
+        # (partitioned table primary key couldn't be referenced by pk only)
+        for storagename, names in meta.side_storages:
+            fields = OrderedDict()
+            if meta.partition is None:
+                fields[meta.pk] = ForeignKey(
+                    '%s.%s' % (meta.storagename, meta.pk),
+                    primary_key=True, nullable=False, ondelete='CASCADE')
+            else:
+                fields[meta.pk] = Integer(primary_key=True, nullable=False)
+            fields[meta.pk].name = meta.pk
+            for n in names:
+                fields[n] = meta.fields[n]
+
+            meta.storages.append(Storage(storagename, fields))
+
         # set model fields as pointers to storage fields (columns)
-        for n, f in meta.fields.items():
-            setattr(model, n, storage.c[n])
+        for storage in reversed(meta.storages):
+            for n in storage.fields.keys():
+                setattr(model, n, storage.c[n])
+
+        # define extended indexes bound to the model columns
+        for c in meta.constraints['index']:
+            if isinstance(c, Index):
+                c.define(model)
 
         model._meta = meta
         model.list = ModelManager(model)
@@ -83,6 +194,25 @@ class ModelMetaBase(type):
 
         return model
 
+    def projection(self, *fields):
+        """Return compiled projection for the fields declaration.
+
+        Projection is a plain function that transforms model instance
+        into a dict. Compiled projections are cached per model.
+
+        Usage:
+            to_dict = Model.projection('id', exclude('name'))
+            to_dict(instance)
+
+        """
+        key = projection_key(fields)
+        try:
+            return self._meta.projections[key]
+        except KeyError:
+            projection = compile_projection(self._meta, FieldsList(*fields))
+            self._meta.projections[key] = projection
+            return projection
+
     def __repr__(self):
         """Override representation."""
         return u'<Model: %s>' % self.__name__
@@ -93,6 +223,8 @@ class Model(metaclass=ModelMetaBase):
 
     def __init__(self, **kwargs):
         """Fill the model fields with supplied data."""
+        # fields that weren't loaded from the db
+        self._deferred = ()
         self.__fill(**kwargs)
 
     # @property
@@ -114,6 +246,8 @@ class Model(metaclass=ModelMetaBase):
         """Init model with data loaded from the db."""
         instance = cls(**kwargs)
         instance._meta.db_state = 1
+        instance._deferred = tuple(n for n in cls._meta.fields.keys()
+                                   if n not in kwargs)
         return instance
 
     def __fill(self, **kwargs):
@@ -142,47 +276,70 @@ class Model(metaclass=ModelMetaBase):
             wherein custom_file_name will actully point to another field or
             method of the model.
 
+        Use Model.projection() directly to avoid coroutine overhead
+        in hot paths.
         """
-        fl = options.pop('fieldslist', FieldsList()).append(*fields)
-        result = {fld: value for fld, value in self if fld in fl}
-        # handle custom fields
-        for alias, fpath in fl.custom:
-            obj = self
-            for fld in fpath:
-                obj = getattr(obj, fld, None)
-
-            value = obj() if hasattr(obj, '__call__') else obj
-            # if not is_protected_type(value):
-            #     if hasattr(value, 'to_dict'):
-            #         value = value.to_dict(**self._options)
-            #     else:
-            #         value = str(value)
-            result[fld] = value
+        if 'fieldslist' in options:
+            fl = options['fieldslist'].append(*fields)
+            projection = compile_projection(self._meta, fl)
+        else:
+            projection = type(self).projection(*fields)
 
-        # handle related fields
-        for fld, sfl in fl.related.items():
-            result[fld] = getattr(self, fld).to_dict(fields_list=sfl)
+        return projection(self)
 
-        return result
+    def __pk_filter(self):
+        """Return filter by primary key of the instance.
+
+        Partition key is added as well so the query is pruned
+        to a single partition.
+        """
+        flt = type(self).pk == self.pk
+        partition = self._meta.partition
+        if partition is not None:
+            flt &= getattr(type(self), partition.key) == \
+                getattr(self, partition.key)
+        return flt
 
     async def save(self, db):
         """Save model instance to the database."""
         if self.pk and self._meta.db_state == 1:
             # update previosly saved object record
-            data = await self.to_dict(exclude(type(self)._meta.pk))
-            r = await self.list(db).filter(
-                type(self).pk == self.pk).update(**data)
+            # (fields that weren't loaded are left untouched)
+            data = type(self).projection(
+                exclude(type(self)._meta.pk, *self._deferred))(self)
+            r = await self.list(db).filter(self.__pk_filter()).update(**data)
+
+            for n, v in r.items():
+                setattr(self, n, v)
         else:
             # insert new object record
             r = await self.list(db).insert(**dict(self))
             self._meta.db_state = 1
+            self._deferred = ()
+
+            self.__fill(**r)
+
+    async def load_deferred(self, db, *fields):
+        """Load deferred fields of the instance from the database.
+
+        All deferred fields will be loaded if none were specified.
+        """
+        fields = fields or self._deferred
+        if fields:
+            row = await self.list(db).raw.select(
+                *(getattr(type(self), n) for n in fields)).get(
+                    type(self).pk == self.pk)
+
+            for n, v in row.items():
+                setattr(self, n, v)
 
-        self.__fill(**r)
+            self._deferred = tuple(n for n in self._deferred
+                                   if n not in row)
 
     async def delete(self, db):
         """Delete model instance from the database."""
         if self.pk and self._meta.db_state == 1:
-            await self.list(db).delete(type(self).pk == self.pk)
+            await self.list(db).delete(self.__pk_filter())
             # reset instance primary key to None
             setattr(self, type(self)._meta.pk, None)
 
@@ -0,0 +1,138 @@
+"""Declarative Table Partitioning (PostgreSQL 11+)."""
+from datetime import datetime
+
+__all__ = ['HashPartition', 'RangePartition']
+
+
+class Partition:
+    """Base partitioning declaration.
+
+    Partition key becomes a part of the table primary key
+    since PostgreSQL requires it for the partitioned tables.
+    """
+
+    method = None
+
+    def __init__(self, key):
+        """Setup partition key (field name)."""
+        self.key = key
+
+    @property
+    def partition_by(self):
+        """Return PARTITION BY clause of the table."""
+        return '%s (%s)' % (self.method, self.key)
+
+    def create_ddl(self, tablename, now=None):
+        """Return DDL statements to create the table partitions."""
+        return []
+
+
+class HashPartition(Partition):
+    """Partition rows by the hash of the key in fixed number of partitions.
+
+    Usage:
+        class Meta:
+            partition = HashPartition('tree_id', 8)
+    """
+
+    method = 'HASH'
+
+    def __init__(self, key, modulus):
+        """Setup number of partitions."""
+        super().__init__(key)
+        self.modulus = modulus
+
+    def create_ddl(self, tablename, now=None):
+        """Return DDL statements to create all the partitions."""
+        return ['CREATE TABLE IF NOT EXISTS %s_p%s PARTITION OF %s '
+                'FOR VALUES WITH (MODULUS %s, REMAINDER %s)'
+                % (tablename, r, tablename, self.modulus, r)
+                for r in range(self.modulus)]
+
+
+def add_months(date, months):
+    """Return the first day of the month shifted by the number of months."""
+    month = date.month - 1 + months
+    return datetime(date.year + month // 12, month % 12 + 1, 1)
+
+
+# creates the month partition, the rows of its range which already
+# landed in the default partition (e.g. maintenance was run late)
+# are moved to it, otherwise CREATE TABLE ... PARTITION OF fails
+CREATE_RANGE_PARTITION = """DO $$
+BEGIN
+  IF to_regclass('{partition}') IS NULL THEN
+    LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;
+    CREATE TEMP TABLE {partition}_moved ON COMMIT DROP AS
+      SELECT * FROM {default} WHERE {range};
+    DELETE FROM {default} WHERE {range};
+    CREATE TABLE {partition} PARTITION OF {table}
+      FOR VALUES FROM ('{start}') TO ('{end}');
+    INSERT INTO {table} SELECT * FROM {partition}_moved;
+    DROP TABLE {partition}_moved;
+  END IF;
+END $$"""
+
+
+class RangePartition(Partition):
+    """Partition rows by date ranges of the key (one partition per month).
+
+    Partitions for the current month and several months ahead
+    are created by migrate and maintain_partitions. Rows out of
+    the created ranges go to the default partition and are moved
+    to the month partition once it's created.
+
+    Usage:
+        class Meta:
+            partition = RangePartition('e_date', premake=3)
+    """
+
+    method = 'RANGE'
+
+    def __init__(self, key, premake=3):
+        """Setup number of partitions created ahead."""
+        super().__init__(key)
+        self.premake = premake
+
+    def bounds(self, now=None):
+        """Yield (suffix, start, end) of the partitions up to premake."""
+        start = add_months(now or datetime.utcnow(), 0)
+        for i in range(self.premake + 1):
+            end = add_months(start, 1)
+            yield start.strftime('%Y_%m'), start, end
+            start = end
+
+    def expired(self, tablename, partitions, before):
+        """Return names of the partitions which ranges end before the date.
+
+        partitions - names of the existing partitions of the table.
+        """
+        prefix = '%s_p' % tablename
+        expired = []
+        for name in partitions:
+            if not name.startswith(prefix):
+                continue
+            try:
+                start = datetime.strptime(name[len(prefix):], '%Y_%m')
+            except ValueError:
+                continue
+            if add_months(start, 1) <= before:
+                expired.append(name)
+        return sorted(expired)
+
+    def create_ddl(self, tablename, now=None):
+        """Return DDL statements to create missing partitions."""
+        default = '%s_default' % tablename
+        ddl = ['CREATE TABLE IF NOT EXISTS %s PARTITION OF %s DEFAULT'
+               % (default, tablename)]
+        for suffix, start, end in self.bounds(now):
+            start, end = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+            ddl.append(CREATE_RANGE_PARTITION.format(
+                table=tablename,
+                default=default,
+                partition='%s_p%s' % (tablename, suffix),
+                range="%s >= '%s' AND %s < '%s'" % (self.key, start,
+                                                     self.key, end),
+                start=start,
+                end=end))
+        return ddl
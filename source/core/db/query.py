@@ -4,6 +4,9 @@ import sys
 
 from collections import OrderedDict
 from sqlalchemy import select, func
+from sqlalchemy.sql.util import find_tables
+
+from ..utils.timing import phase
 
 
 PY_34 = sys.version_info < (3, 5)
@@ -32,20 +35,25 @@ class QueryResultIterator:
     async def fetchone(self):
         """Fetch one row from the result."""
         row = await self._result_proxy.fetchone()
-        return self.handle_row(row) if row else None
+        if row:
+            with phase('rows'):
+                return self.handle_row(row)
+        return None
 
     async def fetchmany(self, chunk_size=1000):
         """Fetch many rows from the result."""
         chunk = await self._result_proxy.fetchmany(chunk_size)
         if chunk:
-            return [self.handle_row(row) for row in chunk]
+            with phase('rows'):
+                return [self.handle_row(row) for row in chunk]
         else:
             return None
 
     async def fetchall(self):
         """Fetch all rows from the result."""
         rows = await self._result_proxy.fetchall()
-        return [self.handle_row(row) for row in rows]
+        with phase('rows'):
+            return [self.handle_row(row) for row in rows]
 
     def __await__(self):
         """Await override. Return the result of fetchall()."""
@@ -98,14 +106,18 @@ class Query:
         self._select = None
         self._limit = None
         self._offset = None
+        # names of the fields that shouldn't be loaded
+        self._deferred = ()
         # class that will iterate query results
         self._iterator_class = ModelIterator
 
     def _clone(self):
         clone = Query(self._model, self._db)
-        clone._where = self._where
-        clone._order_by = self._order_by
+        # clauses are added in place, so clones don't share the lists
+        clone._where = list(self._where)
+        clone._order_by = list(self._order_by)
         clone._select = self._select
+        clone._deferred = self._deferred
         clone._limit = self._limit
         clone._offset = self._offset
         clone._iterator_class = self._iterator_class
@@ -116,6 +128,30 @@ class Query:
             q = q.where(w)
         return q
 
+    def _join_storages(self, q):
+        """Join side storages that are used by the query.
+
+        Side storages which columns are neither selected nor filtered
+        are not joined at all.
+        """
+        storages = self._model._meta.storages
+        if len(storages) == 1:
+            return q
+
+        used = set(q.froms)
+        for clause in self._order_by:
+            used.update(find_tables(clause))
+
+        primary = storages[0].table
+        pk = self._model._meta.pk
+        joined = primary
+        for storage in storages[1:]:
+            if storage.table in used:
+                joined = joined.join(storage.table,
+                                     storage.c[pk] == primary.c[pk])
+
+        return q.select_from(joined)
+
     def select(self, *args):
         """Set the list of requred fields."""
         clone = self._clone()
@@ -123,8 +159,7 @@ class Query:
             clone._select = []
             for arg in args:
                 if isinstance(arg, type(self._model)):
-                    for storage in arg._meta.storages:
-                        clone._select.append(storage.table)
+                    clone._select += arg._meta.columns()
                 else:
                     clone._select.append(arg)
         else:
@@ -150,6 +185,16 @@ class Query:
             clone._order_by = []
         return clone
 
+    def defer(self, *fields):
+        """Do not load specified fields (columns or field names).
+
+        Side storages with all the fields deferred are not joined.
+        """
+        clone = self._clone()
+        clone._deferred = clone._deferred + tuple(
+            getattr(f, 'name', f) for f in fields)
+        return clone
+
     @property
     def raw(self):
         """Return clone of the query and makes it to yeild raw rows."""
@@ -159,9 +204,10 @@ class Query:
 
     def _build_select_query(self):
         q = select(self._select) if self._select \
-            else select([s.table for s in self._model._meta.storages])
+            else select(self._model._meta.columns(self._deferred))
         q = self._build_where(q)
         q = q.order_by(*self._order_by)
+        q = self._join_storages(q)
         if self._limit:
             q = q.limit(self._limit)
         if self._offset:
@@ -207,6 +253,7 @@ class Query:
     async def insert(self, **values):
         """Transform query to insert supplied values."""
         result = {}
+        pk = self._model._meta.pk
         for storage in self._model._meta.storages:
             q = storage.table.insert().returning(*storage.c).values(
                 **{n: values[n] for n in storage.fields.keys()
@@ -214,27 +261,83 @@ class Query:
 
             r = await self._db.execute(q)
             result.update(await r.fetchone())
+            # side storages are linked by the primary key
+            values[pk] = result[pk]
 
         return result
 
+    async def insert_many(self, rows):
+        """Insert several records with a single query per storage.
+
+        Rows are dicts of the field values. Side storages are linked
+        by the primary keys returned by the primary storage insert
+        (in the order of the rows). Return number of inserted rows.
+        """
+        meta = self._model._meta
+        primary = meta.storages[0]
+        # server defaults are used unless the values are set
+        names = [n for n in primary.fields.keys() if n != meta.pk and (
+            primary.c[n].server_default is None or
+            any(row.get(n) is not None for row in rows))]
+        q = primary.table.insert().values(
+            [{n: row.get(n) for n in names} for row in rows])
+        if len(meta.storages) == 1:
+            r = await self._db.execute(q)
+            return r.rowcount
+
+        r = await self._db.execute(q.returning(primary.c[meta.pk]))
+        pks = [row[0] for row in await r.fetchall()]
+        for storage in meta.storages[1:]:
+            names = [n for n in storage.fields.keys() if n != meta.pk]
+            q = storage.table.insert().values(
+                [dict({n: row.get(n) for n in names}, **{meta.pk: pk})
+                 for row, pk in zip(rows, pks)])
+            await self._db.execute(q)
+
+        return len(pks)
+
     async def update(self, **values):
         """Transform query to update db records with supplied values."""
         result = {}
-        for storage in self._model._meta.storages:
-            q = self._build_where(storage.table.update().returning(*storage.c))
-            q = q.values(**{n: values[n] for n in storage.fields.keys()
-                            if n in values})
+        storages = self._model._meta.storages
+        pk = self._model._meta.pk
+        for storage in storages:
+            data = {n: values[n] for n in storage.fields.keys()
+                    if n in values and n != pk}
+            if not data and storage is not storages[0]:
+                continue
+
+            q = storage.table.update().returning(*storage.c)
+            if storage is storages[0]:
+                q = self._build_where(q)
+            else:
+                # filter side storage rows by primary keys of the query
+                q = q.where(storage.c[pk].in_(self._join_storages(
+                    self._build_where(select([storages[0].c[pk]])))))
+            q = q.values(**data)
 
             r = await self._db.execute(q)
-            result.update(await r.fetchone())
+            row = await r.fetchone()
+            if row is not None:
+                result.update(row)
 
         return result
 
     async def delete(self, *args):
         """Transform query to delete db records."""
-        self.filter(*args)
-        storage = self._model._meta.storages[0]
-        q = self._build_where(storage.table.delete())
+        clone = self.filter(*args)
+        storages = self._model._meta.storages
+        pk = self._model._meta.pk
+        # side storages of the partitioned model are not linked
+        # with cascade foreign keys so clean them up explicitly
+        if self._model._meta.partition is not None:
+            for storage in storages[1:]:
+                q = storage.table.delete().where(
+                    storage.c[pk].in_(clone._join_storages(
+                        clone._build_where(select([storages[0].c[pk]])))))
+                await self._db.execute(q)
+
+        q = clone._build_where(storages[0].table.delete())
         r = await self._db.execute(q)
         return r.rowcount
 
@@ -0,0 +1,56 @@
+"""Connection Pool Statistics."""
+import time
+
+
+class PoolStats:
+    """Wait time of the pool connections acquisition.
+
+    Keeps moving average of the finished waits which decays with time
+    (so it recovers when there are no new acquisitions) and the waits
+    that are still in progress.
+    """
+
+    # weight of the new sample in the moving average
+    ALPHA = 0.2
+    # time (in seconds) the average is halved in without new samples
+    HALF_LIFE = 5
+
+    def __init__(self):
+        """Setup stats."""
+        self.avg = 0.
+        self.updated = time.monotonic()
+        # token -> start time of the waits in progress
+        self.waiters = {}
+        self._token = 0
+
+    def started(self):
+        """Register the wait start and return its token."""
+        self._token += 1
+        self.waiters[self._token] = time.monotonic()
+        return self._token
+
+    def finished(self, token):
+        """Register the wait end."""
+        now = time.monotonic()
+        elapsed = now - self.waiters.pop(token, now)
+        self.avg = self.average(now) * (1 - self.ALPHA) + elapsed * self.ALPHA
+        self.updated = now
+
+    def average(self, now=None):
+        """Return moving average of the waits decayed by time."""
+        now = now or time.monotonic()
+        return self.avg * 0.5 ** ((now - self.updated) / self.HALF_LIFE)
+
+    @property
+    def waiting(self):
+        """Number of the waits in progress."""
+        return len(self.waiters)
+
+    def wait_time(self):
+        """Return current wait time estimation of the pool.
+
+        It's the greater of the average and the longest wait in progress.
+        """
+        now = time.monotonic()
+        longest = now - min(self.waiters.values()) if self.waiters else 0
+        return max(self.average(now), longest)
@@ -3,21 +3,38 @@
 import sqlalchemy as sa
 
 from core.db import meta
+from core.db.indexes import Index
 
 
 class Storage(object):
     """Storage Class."""
 
-    def __init__(self, name, fields, constraints={}):
-        """Setup storage with name, fields and possible constratints."""
+    def __init__(self, name, fields, constraints={}, partition=None):
+        """Setup storage with name, fields and possible constratints.
+
+        Partitioned storage includes partition key into its primary key.
+        """
         defined_fields = [f.define() for f in fields.values()]
-        self.__table = sa.Table(name, meta, *defined_fields)
+        options = {}
+        if partition is not None:
+            for c in defined_fields:
+                if c.primary_key:
+                    c.autoincrement = True
+                elif c.name == partition.key:
+                    c.primary_key = True
+                    c.nullable = False
+            options['postgresql_partition_by'] = partition.partition_by
+            options['info'] = {'partition': partition}
+
+        self.__table = sa.Table(name, meta, *defined_fields, **options)
 
         for c in constraints.get('unique', ()):
             self.__table.append_constraint(sa.UniqueConstraint(*c))
 
         for c in constraints.get('index', ()):
-            self.__table.append_constraint(sa.Index(*c))
+            # extended declarations are bound to the model later
+            if not isinstance(c, Index):
+                self.__table.append_constraint(sa.Index(*c))
 
         self.__fields = fields
 
@@ -36,6 +53,11 @@ class Storage(object):
         """Defined fields."""
         return self.__fields
 
+    @property
+    def partition(self):
+        """Partitioning declaration of the storage."""
+        return self.__table.info.get('partition')
+
     @property
     def is_primary(self):
         """If storage has a primary key."""
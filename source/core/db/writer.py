@@ -0,0 +1,136 @@
+"""Write-behind Batch Writer."""
+import asyncio
+import logging
+
+from . import get_connection, BACKGROUND_POOL
+from ..pubsub import Channel
+
+__all__ = ['BatchWriter', 'ASYNC', 'GROUP']
+
+# durability modes:
+# write returns as soon as the record is buffered
+ASYNC = 'async'
+# write returns when the batch with the record is stored (group commit)
+GROUP = 'group'
+
+log = logging.getLogger('database')
+
+
+class BatchWriter:
+    """Buffer model records and store them with multi-row inserts.
+
+    Buffer is flushed when it reaches batch_size records or every
+    flush_interval seconds. Writers wait for the flush when the buffer
+    holds max_buffer records already (backpressure).
+
+    With ASYNC durability records buffered in the process are lost
+    if it crashes. With GROUP durability every write waits for its batch
+    to be stored, so it's still one round-trip per batch, not per record.
+
+    Number of the stored records is published to the channel (if it's set)
+    after every flush.
+
+    Usage:
+        writer = BatchWriter(app, EventLog)
+        await writer.write(EventLog(...))
+        ...
+        await writer.stop()
+    """
+
+    def __init__(self, app, model, pool=BACKGROUND_POOL, batch_size=100,
+                 flush_interval=0.5, max_buffer=10000, durability=ASYNC,
+                 channel=None, loop=None):
+        """Setup writer and start periodic flushes.
+
+        channel - name of the channel notified about stored records.
+        """
+        self.app = app
+        self.model = model
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.durability = durability
+        self.channel = Channel(channel) if channel else None
+        self.loop = loop or asyncio.get_event_loop()
+
+        self.buffer = []
+        # resolved when the current buffer is stored
+        self.stored = self.loop.create_future()
+        self.lock = asyncio.Lock(loop=self.loop)
+        self._flush_scheduled = False
+        self.task = self.loop.create_task(self.run())
+
+        if 'metrics' in app:
+            app['metrics'].gauge(
+                'batch_writer_buffer', 'Records waiting to be stored',
+                ('model',), lambda: [((model.__name__,), len(self.buffer))])
+            self.written = app['metrics'].counter(
+                'batch_writer_records_total', 'Stored records',
+                ('model',))
+        else:
+            self.written = None
+
+    async def write(self, instance):
+        """Add model instance to the buffer."""
+        if len(self.buffer) >= self.max_buffer:
+            await self.flush()
+
+        self.buffer.append(dict(instance))
+        stored = self.stored
+
+        if len(self.buffer) >= self.batch_size and not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.create_task(self.flush())
+
+        if self.durability == GROUP:
+            await asyncio.shield(stored)
+
+    async def flush(self):
+        """Store all the buffered records."""
+        async with self.lock:
+            self._flush_scheduled = False
+            if not self.buffer:
+                return
+
+            rows, self.buffer = self.buffer, []
+            stored, self.stored = self.stored, self.loop.create_future()
+
+            db = get_connection(self.app, self.pool)
+            try:
+                await self.model.list(db).insert_many(rows)
+
+            except Exception as e:
+                log.exception("Couldn't store %s %s records",
+                              len(rows), self.model.__name__)
+                if self.durability == GROUP:
+                    stored.set_exception(e)
+                else:
+                    # return records to the buffer to retry them later
+                    # (drop the oldest ones that don't fit)
+                    self.buffer = (rows + self.buffer)[-self.max_buffer:]
+                    stored.set_result(0)
+
+            else:
+                stored.set_result(len(rows))
+                if self.written is not None:
+                    self.written.inc((self.model.__name__,), len(rows))
+                if self.channel is not None:
+                    self.channel.publish(len(rows))
+
+            finally:
+                await db.release()
+
+    async def run(self):
+        """Flush the buffer periodically."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval, loop=self.loop)
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def stop(self):
+        """Stop periodic flushes and store the rest of the records."""
+        self.task.cancel()
+        await self.flush()
@@ -3,10 +3,12 @@
 
 class CoreException(Exception):
 
-    def __init__(self, code=500, msg='', data=None):
+    def __init__(self, code=500, msg='', data=None, headers=None):
         self.msg = msg
         self.code = code
         self.data = data or {}
+        # extra headers of the error response (e.g. Retry-After)
+        self.headers = headers or {}
 
     def __str__(self):
         return u'%s : %s' % (self.code, self.msg or 'Unknown')
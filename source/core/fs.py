@@ -3,27 +3,48 @@ import uuid
 
 
 class FileStorage:
-    """Simple file storage handler."""
+    """Simple file storage handler.
 
-    def __init__(self, root):
+    Storage could be bounded by max_size bytes, the usage is tracked
+    by the owners of the files (e.g. in the database, so it's shared
+    by the worker processes). Sidecar files of a file (named by its
+    name with a suffix, e.g. index of a report) are removed along
+    with it. remove does file IO, so it's called in the executor.
+    """
+
+    def __init__(self, root, max_size=0):
         self.root = root
+        # 0 - unlimited
+        self.max_size = max_size
         # create storage dirs
         if not os.path.isdir(self.root):
             os.makedirs(self.root)
 
     def generate_filename(self, ext=None):
-        """Return a brand new filename for a new file created within storage."""
-        while True:
-            fname = str(uuid.uuid4())
-            if ext:
-                fname = '%s.%s' % (fname, ext)
-            fpath = self.path(fname)
-            if not os.path.isfile(fpath):
-                open(fpath, 'w+')
-                break
+        """Return a brand new filename for a new file created within storage.
 
+        The file itself is created by its writer.
+        """
+        fname = str(uuid.uuid4())
+        if ext:
+            fname = '%s.%s' % (fname, ext)
         return fname
 
     def path(self, fname):
         """Retrun absoulute path to the file in storage."""
         return os.path.join(self.root, fname)
+
+    def remove(self, fnames):
+        """Remove the files and their sidecars from the storage."""
+        fnames = set(fnames)
+        if not fnames:
+            return
+        for entry in os.scandir(self.root):
+            name = entry.name
+            while name not in fnames and '.' in name:
+                name = name.rsplit('.', 1)[0]
+            if name in fnames:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
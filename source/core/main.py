@@ -4,27 +4,29 @@ import asyncio
 import importlib
 import logging
 import os
+import socket
+import subprocess
 import sys
 
-import jinja2
-import aiohttp_jinja2
-
 from aiohttp import web
 from trafaret_config import commandline
 from pathlib import Path
 
-from core.db import close_pg, init_pg, migrate as db_migrate
+from core.db import close_pg, init_pg, migrate as db_migrate, \
+    maintain_partitions
 from core.fs import FileStorage
+from core.metrics import setup_metrics
+from core.middlewares import setup_admission
 # from core.pubsub import init_redis_pub, init_redis_sub, \
 #   close_redis_pub, close_redis_sub
 from core.utils import import_string, query_yes_no
+from core.utils.loop import setup_event_loop_policy
+from core.utils.prefork import Prefork, create_reuseport_socket, \
+    notify_ready
 from core.utils.supervisor import Supervisor
 from core.config.trafaret import TRAFARET
 
 
-from aiocomments.lib.xml_reporter import CommentsXMLReporter
-
-
 PROJECT_PATH = Path(__file__).parent.parent.absolute()
 PROJECT_ROOT = str(PROJECT_PATH)
 
@@ -34,13 +36,33 @@ class BackgroundTasks:
     async def startup(self, app):
         # setup database
         await init_pg(app)
-        # setup XML Comments Download Tasks Handler
-        self.c_xml_reporter = CommentsXMLReporter(app, 3, loop=app.loop)
-        # app.loop.create_task(self.c_xml_reporter.run())
+        # setup Comments Reports Download Tasks Handler
+        # (imported here to keep it out of the import time)
+        from aiocomments.lib.reporter import CommentsReporter
+        self.c_reporter = CommentsReporter(
+            app, 3, loop=app.loop, **app['config']['reports'])
+        app['reporter'] = self.c_reporter
+        # setup write-behind of the comments events
+        # (the events feed is notified about the stored ones)
+        from aiocomments.consumers import EVENTS_CHANNEL
+        from aiocomments.models import EventLog
+        from core.db.writer import BatchWriter
+        app['event_writer'] = BatchWriter(app, EventLog,
+                                          channel=EVENTS_CHANNEL,
+                                          loop=app.loop,
+                                          **app['config']['eventlog'])
+        # setup compaction of the old events
+        from aiocomments.lib.eventlog_compactor import EventLogCompactor
+        self.compactor = EventLogCompactor(app, loop=app.loop,
+                                           **app['config']['retention'])
+        # app.loop.create_task(self.c_reporter.run())
 
     async def cleanup(self, app):
-        # stop XML Download Handler
-        await self.c_xml_reporter.stop()
+        # stop Reports Download Handler
+        await self.c_reporter.stop()
+        # store buffered events
+        await app['event_writer'].stop()
+        await self.compactor.stop()
         # close database
         await close_pg(app)
 
@@ -52,26 +74,27 @@ def init(loop, config):
     # load config from yaml file in current dir
     app['config'] = config
 
-    # setup Jinja2 template renderer
-    aiohttp_jinja2.setup(
-        app, loader=jinja2.PackageLoader('aiocomments', 'templates'))
+    # setup Jinja2 template renderer (only if some app provides templates)
+    if config.get('templates'):
+        import jinja2
+        import aiohttp_jinja2
+
+        aiohttp_jinja2.setup(
+            app, loader=jinja2.PackageLoader(config['templates'], 'templates'))
 
     bg_tasks = BackgroundTasks()
     app.on_startup.append(bg_tasks.startup)
     app.on_cleanup.append(bg_tasks.cleanup)
 
-    for ap in config['apps']:
-        # setup router
-        # load routes for the application from app_name.routes
-        routes_file = Path(os.path.join(PROJECT_ROOT, ap, "routes.py"))
-        if routes_file.is_file():
-            url_import = ".".join([ap, "routes"])
-            m = importlib.import_module(url_import)
-            # setup views and routes
-            for route in m.ROUTES:
-                app.router.add_route(*route)
-        else:
-            logging.warning("Couldn't parse routes for applicaton: %s", ap)
+    # setup metrics registry and endpoint
+    setup_metrics(app)
+    # setup admission control limits
+    setup_admission(app)
+
+    # setup views and routes
+    for m in _load_apps(config):
+        for route in m.ROUTES:
+            app.router.add_route(*route)
 
     # setup middlewares
     for url_import in config['middlewares']:
@@ -85,7 +108,8 @@ def init(loop, config):
     # setup simple file storage
     if config['filestorage']:
         storage_path = config['filestorage']['root']
-        app['fs'] = FileStorage(storage_path)
+        app['fs'] = FileStorage(storage_path,
+                                config['filestorage']['max_size'])
 
     return app
 
@@ -103,18 +127,46 @@ def initdb(options):
 
 def _initdb(config):
     """Run migration process."""
-    # load user defined apps
+    _load_apps(config)
+    db_migrate(config)
+
+
+def _load_apps(config):
+    """Load user defined apps (and their models).
+
+    Return list of the apps routes modules.
+    """
+    modules = []
     for ap in config['apps']:
         # setup router
         routes_file = Path(os.path.join(PROJECT_ROOT, ap, "routes.py"))
         if routes_file.is_file():
             # load routes for the application from app_name.routes
             url_import = ".".join([ap, "routes"])
-            importlib.import_module(url_import)
+            modules.append(importlib.import_module(url_import))
         else:
             logging.warning("Couldn't parse routes for applicaton: %s", ap)
 
-    db_migrate(config)
+    return modules
+
+
+def partitions(options):
+    """Create missing partitions of the partitioned tables."""
+    config = commandline.config_from_options(options, TRAFARET)
+    _load_apps(config)
+    maintain_partitions(config)
+    sys.exit(0)
+
+
+def importtime(options):
+    """Print the slowest imports of the application start up.
+
+    Profiling is done in a fresh interpreter, since the current one
+    has loaded most of the modules already.
+    """
+    args = [sys.executable, '-m', 'core.utils.importtime',
+            '-c', os.path.abspath(options.config), '-n', str(options.limit)]
+    sys.exit(subprocess.call(args, cwd=PROJECT_ROOT))
 
 
 def serve(options):
@@ -126,27 +178,62 @@ def serve(options):
     sargv.remove('serve')
     args = [sys.executable] + ['-W%s' % o for o in sys.warnoptions] + sargv
 
-    Supervisor(args, options).start()
+    Supervisor(args, options, root=PROJECT_ROOT).start()
 
 
 def server(options):
     """Run standalone server."""
     # read config
     config = commandline.config_from_options(options, TRAFARET)
+    run_server(config)
+
+
+def workers(options):
+    """Run prefork server with multiple worker processes."""
+    config = commandline.config_from_options(options, TRAFARET)
+    logging.getLogger('prefork').debug(
+        "Prefork Mode: %s workers on %s:%s",
+        options.num, config['host'], config['port'])
+
+    Prefork(options.num, _run_worker, config).start()
+
+
+def _run_worker(config):
+    """Run server in a worker process.
+
+    Every worker has its own event loop, db pools and background consumers
+    and listens to the same port using SO_REUSEPORT.
+    """
+    sock = create_reuseport_socket(config['host'], config['port'])
+    # connections are queued by the listening socket until the server
+    # starts accepting them, so the master is notified on app startup
+    sock.listen(socket.SOMAXCONN)
+    run_server(config, sock=sock, on_ready=notify_ready)
+
 
+def run_server(config, sock=None, on_ready=None):
     # init asyncio loop
+    loop_name = setup_event_loop_policy(config.get('loop', 'auto'))
     loop = asyncio.get_event_loop()
+    logging.info("Event loop: %s (%s)", loop_name, type(loop).__name__)
 
     # init application
     app = init(loop, config)
+    if on_ready is not None:
+        async def startup_done(app):
+            on_ready()
+        app.on_startup.append(startup_done)
     # app.on_startup.append(start_background_tasks)
     # app.on_cleanup.append(cleanup_background_tasks)
 
     # run application server
-    web.run_app(app,
-                host=app['config']['host'],
-                port=app['config']['port'],
-                loop=loop)
+    if sock is not None:
+        web.run_app(app, sock=sock, loop=loop)
+    else:
+        web.run_app(app,
+                    host=app['config']['host'],
+                    port=app['config']['port'],
+                    loop=loop)
 
     # close loop (aiohttp didn't close it cuz we provided custom loop)
     loop.close()
@@ -173,6 +260,18 @@ def main(argv):
     ap_migrate.set_defaults(mode=initdb)
     ap_migrate.add_argument("-s", "--silent", action="store_true",
                             dest="silent", help="run in silent mode")
+    ap_partitions = subparsers.add_parser(
+        'partitions', help='Create missing partitions of the tables')
+    ap_partitions.set_defaults(mode=partitions)
+    ap_workers = subparsers.add_parser(
+        'workers', help='Prefork Mode (Multiple worker processes)')
+    ap_workers.set_defaults(mode=workers)
+    ap_workers.add_argument("num", type=int, help="number of workers")
+    ap_importtime = subparsers.add_parser(
+        'importtime', help='Print the slowest imports of the start up')
+    ap_importtime.set_defaults(mode=importtime)
+    ap_importtime.add_argument("-n", "--limit", type=int, default=20,
+                               help="number of imports to show")
     ap_serve = subparsers.add_parser(
         'serve', help='Development Mode (Reload on module update)')
     ap_serve.set_defaults(mode=serve)
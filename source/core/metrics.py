@@ -0,0 +1,217 @@
+"""Prometheus-style Metrics.
+
+Metrics are updated from the event loop thread only, so counters
+and histograms are plain dicts and lists without any locks.
+Histogram buckets are fixed on creation, observation is a bisect
+and an increment.
+
+Usage:
+    metrics = app['metrics']
+    requests = metrics.counter('requests_total', 'Total requests',
+                               ('route', 'method', 'status'))
+    requests.inc((route, method, status))
+"""
+from bisect import bisect_left
+
+from aiohttp import web
+
+from .pubsub import Channel
+
+
+# latency buckets in seconds
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# background jobs duration buckets in seconds
+JOB_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def format_labels(names, values, extra=''):
+    """Return labels in the exposition format."""
+    labels = ['%s="%s"' % (n, str(v).replace('\\', r'\\').replace('"', r'\"'))
+              for n, v in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{%s}' % ','.join(labels) if labels else ''
+
+
+def format_value(value):
+    """Return numeric value in the exposition format."""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base metric."""
+
+    type = None
+
+    def __init__(self, name, doc, labels=()):
+        """Setup metric."""
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        # label values -> value
+        self.values = {}
+
+    def samples(self):
+        """Yield (name suffix, label values, extra label, value)."""
+        for labels, value in self.values.items():
+            yield '', labels, '', value
+
+    def render(self):
+        """Return metric in the exposition format."""
+        lines = ['# HELP %s %s' % (self.name, self.doc),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        for suffix, labels, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (
+                self.name, suffix, format_labels(self.labels, labels, extra),
+                format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    type = 'counter'
+
+    def inc(self, labels=(), value=1):
+        """Increase the counter."""
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or collected on render."""
+
+    type = 'gauge'
+
+    def __init__(self, name, doc, labels=(), collect=None):
+        """Setup gauge.
+
+        collect - function returning iterable of (label values, value).
+        """
+        super().__init__(name, doc, labels)
+        self.collect = collect
+
+    def set(self, value, labels=()):
+        """Set the gauge value."""
+        self.values[labels] = value
+
+    def samples(self):
+        """Yield collected samples."""
+        if self.collect is not None:
+            self.values = dict(self.collect())
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Histogram with the fixed buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        """Setup histogram buckets."""
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        """Record an observation."""
+        try:
+            counts = self.values[labels]
+        except KeyError:
+            # bucket counters + [+Inf] + [sum]
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        """Yield cumulative buckets, sum and count."""
+        bounds = self.buckets + (float('inf'),)
+        for labels, counts in self.values.items():
+            total = 0
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield '_bucket', labels, 'le="%s"' % format_value(
+                    float(bound)), total
+            yield '_sum', labels, '', counts[-1]
+            yield '_count', labels, '', total
+
+
+class Registry:
+    """Metrics registry of the application."""
+
+    def __init__(self):
+        """Setup registry."""
+        self.metrics = {}
+
+    def register(self, metric):
+        """Add metric to the registry or return the registered one."""
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, doc, labels=()):
+        """Return counter by its name."""
+        return self.metrics.get(name) or \
+            self.register(Counter(name, doc, labels))
+
+    def gauge(self, name, doc, labels=(), collect=None):
+        """Return gauge by its name."""
+        return self.metrics.get(name) or \
+            self.register(Gauge(name, doc, labels, collect))
+
+    def histogram(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        """Return histogram by its name."""
+        return self.metrics.get(name) or \
+            self.register(Histogram(name, doc, labels, buckets))
+
+    def render(self):
+        """Return all the metrics in the exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def collect_pools(app):
+    """Return collector of the db pools utilization."""
+    def collect():
+        for name, (engine, timeout) in app.get('db_pools', {}).items():
+            yield (name, 'size'), engine.size
+            yield (name, 'free'), engine.freesize
+            yield (name, 'max'), engine.maxsize
+    return collect
+
+
+def collect_consumers():
+    """Return queue depth of the subscribed consumers by their class."""
+    depth = {}
+    for channel in list(Channel.instances.values()):
+        for consumer in channel.consumers:
+            name = type(consumer).__name__
+            depth.setdefault(name, {})[id(consumer)] = consumer.queue.qsize()
+
+    for name, queues in depth.items():
+        yield (name,), sum(queues.values())
+
+
+async def metrics_view(request):
+    """Return metrics of the application."""
+    text = request.app['metrics'].render()
+    return web.Response(body=text.encode('utf-8'),
+                        headers={'Content-Type': CONTENT_TYPE})
+
+
+def setup_metrics(app, path='/metrics'):
+    """Setup metrics registry and the metrics endpoint."""
+    metrics = app['metrics'] = Registry()
+    metrics.gauge('db_pool_connections', 'DB pool connections',
+                  ('pool', 'state'), collect_pools(app))
+    metrics.gauge('consumer_queue_depth', 'Messages waiting in the queues',
+                  ('consumer',), collect_consumers)
+    app.router.add_route('GET', path, metrics_view)
+    return metrics
@@ -1,11 +1,20 @@
+import json
+import logging
+import random
 import sys
+import time
 import traceback
 
 from aiohttp.web import StreamResponse, HTTPException, json_response
 
 from .exceptions import CoreException
+from .metrics import SIZE_BUCKETS
 from .response import error_response, prepare_json_response
 from .utils.json import json_dumps
+from .utils.timing import Timing, current_timing
+
+
+timing_logger = logging.getLogger('access.timing')
 
 
 async def handle_404(request, response):
@@ -28,6 +37,7 @@ def handlers(error_handlers):
 
             except CoreException as e:
                 response = error_response(e.code, e.msg, e.data)
+                response.headers.update(e.headers)
 
             except HTTPException as e:
                 override = error_handlers.get(e.status)
@@ -46,3 +56,203 @@ def handlers(error_handlers):
 
 json_response_middleware = handlers({404: handle_404,
                                      500: handle_500})
+
+
+def route_name(request):
+    """Return route pattern of the request.
+
+    Patterns are used as metric labels instead of paths
+    to keep labels cardinality low.
+    """
+    resource = getattr(request.match_info.route, 'resource', None)
+    if resource is None:
+        return 'unmatched'
+    info = resource.get_info()
+    return info.get('formatter') or info.get('path') or \
+        info.get('prefix') or 'unmatched'
+
+
+async def metrics_middleware(app, handler):
+    """Middleware records requests count, latency and response size.
+
+    It should be the first one to see the final responses.
+    """
+    metrics = app['metrics']
+    requests = metrics.counter('http_requests_total', 'Total HTTP requests',
+                               ('route', 'method', 'status'))
+    latency = metrics.histogram('http_request_duration_seconds',
+                                'HTTP request latency', ('route', 'method'))
+    sizes = metrics.histogram('http_response_size_bytes',
+                              'HTTP response size', ('route',), SIZE_BUCKETS)
+
+    async def middleware_handler(request):
+        started = time.monotonic()
+        status = 500
+        size = 0
+        try:
+            response = await handler(request)
+            status = response.status
+            if response.prepared:
+                size = response.body_length
+            else:
+                size = response.content_length or 0
+            return response
+
+        except HTTPException as e:
+            status = e.status
+            raise
+
+        finally:
+            route = route_name(request)
+            requests.inc((route, request.method, status))
+            latency.observe(time.monotonic() - started,
+                            (route, request.method))
+            sizes.observe(size, (route,))
+
+    return middleware_handler
+
+
+async def timing_middleware(app, handler):
+    """Middleware measures phases of the sampled requests.
+
+    Phases are sent in the Server-Timing header (unless the response
+    was streamed already) and logged as json to the 'access.timing' logger.
+    """
+    config = app.get('config', {}).get('timing') or {}
+    sample_rate = config.get('sample_rate', 1.0)
+
+    async def middleware_handler(request):
+        if random.random() >= sample_rate:
+            return await handler(request)
+
+        timing = Timing()
+        token = current_timing.set(timing)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            if not response.prepared:
+                response.headers['Server-Timing'] = timing.header()
+            return response
+
+        except HTTPException as e:
+            status = e.status
+            raise
+
+        finally:
+            current_timing.reset(token)
+            timing_logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'route': route_name(request),
+                'status': status,
+                'ms': round(timing.total * 1000, 3),
+                'phases': timing.to_dict(),
+            }))
+
+    return middleware_handler
+
+
+class AdmissionControl:
+    """Admission control of the requests by their classes.
+
+    Requests are classified as write (PUT, POST, PATCH, DELETE),
+    stream (GET by the stream path prefixes) and read (the rest GET).
+    Requests by the exempt path prefixes (e.g. /metrics, they don't use
+    the database) are always admitted.
+    Every class is limited by the number of requests in flight and
+    by the wait time of its db pool. Setting lower limits for reads and
+    streams sheds them first and keeps the pool for writes.
+    """
+
+    WRITE_METHODS = ('PUT', 'POST', 'PATCH', 'DELETE')
+
+    def __init__(self, config=None):
+        """Setup admission limits.
+
+        config: {
+            'retry_after': seconds,
+            'exempt': [path_prefix, ...],
+            'streams': [path_prefix, ...],
+            'classes': {name: {'pool', 'max_inflight', 'max_wait'}},
+        }
+        """
+        config = config or {}
+        self.retry_after = config.get('retry_after', 1)
+        self.exempt = tuple(config.get('exempt', ('/metrics',)))
+        self.streams = tuple(config.get('streams', ()))
+        self.classes = config.get('classes', {})
+        self.inflight = {'write': 0, 'read': 0, 'stream': 0}
+
+    def classify(self, request):
+        """Return class of the request (None if it's exempt)."""
+        if self.exempt and request.path.startswith(self.exempt):
+            return None
+        if request.method in self.WRITE_METHODS:
+            return 'write'
+        if self.streams and request.path.startswith(self.streams):
+            return 'stream'
+        return 'read'
+
+    def check(self, rclass, db_stats):
+        """Return the reason to reject the request or None to admit it."""
+        limits = self.classes.get(rclass)
+        if not limits:
+            return None
+
+        max_inflight = limits.get('max_inflight')
+        if max_inflight is not None and self.inflight[rclass] >= max_inflight:
+            return 'inflight'
+
+        max_wait = limits.get('max_wait')
+        stats = db_stats.get(limits.get('pool', 'default'))
+        if max_wait is not None and stats is not None and \
+                stats.wait_time() > max_wait:
+            return 'pool_wait'
+
+        return None
+
+
+def setup_admission(app):
+    """Setup admission control of the app by its config."""
+    admission = app['admission'] = AdmissionControl(
+        app['config'].get('admission'))
+    if 'metrics' in app:
+        app['metrics'].gauge(
+            'admission_inflight', 'Requests in flight by class', ('class',),
+            lambda: (((n,), v) for n, v in admission.inflight.items()))
+    return admission
+
+
+async def admission_middleware(app, handler):
+    """Middleware rejects requests with 503 when the db pools are saturated.
+
+    Rejected responses are fast and carry Retry-After header.
+    """
+    admission = app.get('admission')
+    if admission is None:
+        return handler
+
+    async def middleware_handler(request):
+        rclass = admission.classify(request)
+        if rclass is None:
+            return await handler(request)
+
+        reason = admission.check(rclass, app.get('db_stats', {}))
+        if reason is not None:
+            if 'metrics' in app:
+                app['metrics'].counter(
+                    'admission_rejected_total', 'Rejected requests',
+                    ('class', 'reason')).inc((rclass, reason))
+            response = error_response(503, 'Service Unavailable',
+                                      {'reason': reason})
+            response.headers['Retry-After'] = str(admission.retry_after)
+            return response
+
+        admission.inflight[rclass] += 1
+        try:
+            return await handler(request)
+        finally:
+            admission.inflight[rclass] -= 1
+
+    return middleware_handler
@@ -1,4 +1,5 @@
-from aiohttp.web import json_response
+from aiohttp import hdrs
+from aiohttp.web import FileResponse, StreamResponse, json_response
 
 from .db.models import Model
 from .db.query import QueryResultIterator
@@ -28,3 +29,80 @@ async def prepare_json_response(response):
         response = {"data": str(response)}
 
     return response
+
+
+class RangeFileResponse(FileResponse):
+    """File response validated by the ETag and served in byte ranges.
+
+    The body is sent with sendfile (see FileResponse, the aiohttp 2.x
+    internals are used, so aiohttp is pinned <3). If-None-Match
+    with the etag is answered with 304, the single byte range (Range)
+    is served with 206 unless If-Range has another etag (the file was
+    changed, so it's served from the start).
+    """
+
+    def __init__(self, path, etag, *args, **kwargs):
+        """Setup response of the file with the etag."""
+        super().__init__(path, *args, **kwargs)
+        self.headers[hdrs.ETAG] = etag
+        self.headers[hdrs.ACCEPT_RANGES] = 'bytes'
+
+    async def prepare(self, request):
+        """Send the headers and the requested part of the file."""
+        etag = self.headers[hdrs.ETAG]
+        st = self._path.stat()
+        size = st.st_size
+        self.last_modified = st.st_mtime
+
+        if request.headers.get(hdrs.IF_NONE_MATCH) in (etag, '*'):
+            self.set_status(304)
+            self._length_check = False
+            return await StreamResponse.prepare(self, request)
+
+        start, count = 0, size
+        if hdrs.RANGE in request.headers and \
+                request.headers.get(hdrs.IF_RANGE, etag) == etag:
+            byte_range = self.byte_range(request, size)
+            if byte_range is None:
+                self.set_status(416)
+                self.headers[hdrs.CONTENT_RANGE] = 'bytes */%s' % size
+                self.content_length = 0
+                return await StreamResponse.prepare(self, request)
+
+            if byte_range != (0, size):
+                start, end = byte_range
+                count = end - start
+                self.set_status(206)
+                self.headers[hdrs.CONTENT_RANGE] = 'bytes %s-%s/%s' % (
+                    start, end - 1, size)
+
+        self.content_length = count
+        if not count:
+            return await StreamResponse.prepare(self, request)
+
+        with self._path.open('rb') as fobj:
+            fobj.seek(start)
+            return await self._sendfile(request, fobj, count)
+
+    @staticmethod
+    def byte_range(request, size):
+        """Return (start, end) of the requested range of the file.
+
+        The whole file is returned for malformed or multiple ranges
+        (they are ignored), None if the range isn't satisfiable.
+        """
+        try:
+            requested = request.http_range
+        except ValueError:
+            return 0, size
+
+        if requested.start is None:
+            # suffix of the file
+            if not requested.stop:
+                return None
+            return max(size + requested.stop, 0), size
+
+        if requested.start >= size:
+            return None
+        end = size if requested.stop is None else min(requested.stop, size)
+        return requested.start, end
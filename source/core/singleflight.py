@@ -0,0 +1,85 @@
+"""Single-flight Coalescing of the Identical Requests."""
+import asyncio
+import functools
+
+from aiohttp.web import Response, StreamResponse
+
+from .response import prepare_json_response
+from .utils.json import json_dumps
+
+__all__ = ['single_flight']
+
+# max time (in seconds) to wait for the in-flight computation
+# before doing it on its own
+SINGLE_FLIGHT_TIMEOUT = 5
+
+
+async def _compute(handler, request):
+    """Run the handler and return encoded json response body."""
+    response = await handler(request)
+    if isinstance(response, StreamResponse):
+        raise TypeError("Single-flight handler couldn't return a response")
+    response = await prepare_json_response(response)
+    return json_dumps(response).encode('utf-8')
+
+
+def _record(request, name, role):
+    metrics = request.app.get('metrics')
+    if metrics is not None:
+        metrics.counter('singleflight_requests_total',
+                        'Requests by single-flight role',
+                        ('handler', 'role')).inc((name, role))
+
+
+def single_flight(f=None, timeout=SINGLE_FLIGHT_TIMEOUT):
+    """Coalesce concurrent identical requests of the idempotent GET handler.
+
+    The first request (leader) runs the handler, the rest requests
+    with the same path and query (followers) wait for its encoded json
+    body. Handler runs as a separate task, so leader disconnect doesn't
+    cancel it. Followers that wait longer than timeout run the handler
+    on their own.
+
+    Should be applied on top of acquire_connection, so followers
+    don't take connections from the pool.
+
+    Usage:
+        @single_flight
+        @acquire_connection
+        async def handler(request, db):
+    """
+    if f is None:
+        return lambda f: single_flight(f, timeout=timeout)
+
+    # request key -> in-flight computation
+    flights = {}
+
+    @functools.wraps(f)
+    async def wrapper(request):
+        key = request.path_qs
+        flight = flights.get(key)
+        if flight is None:
+            flight = flights[key] = request.app.loop.create_task(
+                _compute(f, request))
+
+            def done(fut):
+                if flights.get(key) is fut:
+                    del flights[key]
+
+            flight.add_done_callback(done)
+            _record(request, f.__name__, 'leader')
+            body = await asyncio.shield(flight)
+
+        else:
+            try:
+                body = await asyncio.wait_for(asyncio.shield(flight),
+                                              timeout)
+                _record(request, f.__name__, 'follower')
+            except asyncio.TimeoutError:
+                _record(request, f.__name__, 'timeout')
+                body = await _compute(f, request)
+
+        return Response(body=body, content_type='application/json',
+                        charset='utf-8')
+
+    return wrapper
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+
+from core.db import LazyConnection, get_connection, \
+    DEFAULT_POOL, STREAM_POOL, BACKGROUND_POOL
+from core.db.exceptions import PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.queries = []
+
+    async def execute(self, q):
+        self.queries.append(q)
+        return q
+
+
+class FakeEngine:
+    def __init__(self):
+        self.acquired = 0
+        self.released = 0
+
+    async def acquire(self):
+        self.acquired += 1
+        return FakeConnection()
+
+    async def release(self, conn):
+        self.released += 1
+
+
+async def test_lazy_acquire(loop):
+    engine = FakeEngine()
+    db = LazyConnection(engine)
+
+    # nothing should be taken from the pool until the first query
+    assert not db.acquired
+    assert engine.acquired == 0
+
+    assert await db.execute('q1') == 'q1'
+    assert await db.execute('q2') == 'q2'
+    assert db.acquired
+    assert engine.acquired == 1
+
+
+async def test_release(loop):
+    engine = FakeEngine()
+    db = LazyConnection(engine)
+
+    # release without acquired connection does nothing
+    await db.release()
+    assert engine.released == 0
+
+    await db.execute('q1')
+    await db.release()
+    assert not db.acquired
+    assert engine.released == 1
+
+    # next query acquires a connection again
+    await db.execute('q2')
+    assert engine.acquired == 2
+    await db.release()
+    assert engine.released == 2
+
+
+class BusyEngine(FakeEngine):
+    async def acquire(self):
+        await asyncio.sleep(1)
+
+
+async def test_acquire_timeout(loop):
+    db = LazyConnection(BusyEngine(), timeout=0.01)
+    with pytest.raises(PoolTimeout):
+        await db.execute('q1')
+    assert not db.acquired
+
+
+def test_named_pools():
+    default, stream = FakeEngine(), FakeEngine()
+    app = {'db_pools': {DEFAULT_POOL: (default, None),
+                        STREAM_POOL: (stream, 30)}}
+
+    assert get_connection(app)._engine is default
+    assert get_connection(app, STREAM_POOL)._engine is stream
+    assert get_connection(app, STREAM_POOL)._timeout == 30
+    # not configured pools fall back to the default one
+    assert get_connection(app, BACKGROUND_POOL)._engine is default
@@ -0,0 +1,54 @@
+from sqlalchemy import Float, cast
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from core.db import fields as f
+from core.db.indexes import Index
+from core.db.models import Model
+
+
+class IndexedPost(Model):
+    lft_num = f.Integer()
+    lft_den = f.Integer()
+    state = f.Integer()
+    created = f.DateTime()
+
+    VALID = 1
+
+    class Meta:
+        index = (
+            ('ix_plain', 'lft_num', 'lft_den'),
+            Index('ix_expression', 'state',
+                  lambda m: m.lft_num / cast(m.lft_den, Float)),
+            Index('ix_covering', 'state', include=('lft_num', 'lft_den'),
+                  where=lambda m: m.state == m.VALID),
+            Index('ix_brin', 'created', using='brin'),
+        )
+
+
+def create_index_ddl(name):
+    table = IndexedPost._meta.storages[0].table
+    index = [ix for ix in table.indexes if ix.name == name][0]
+    return str(CreateIndex(index).compile(dialect=postgresql.dialect()))
+
+
+def test_plain_index():
+    assert create_index_ddl('ix_plain') == \
+        'CREATE INDEX ix_plain ON indexedpost (lft_num, lft_den)'
+
+
+def test_expression_index():
+    assert create_index_ddl('ix_expression') == \
+        'CREATE INDEX ix_expression ON indexedpost ' \
+        '(state, (lft_num / CAST(lft_den AS FLOAT)))'
+
+
+def test_covering_partial_index():
+    assert create_index_ddl('ix_covering') == \
+        'CREATE INDEX ix_covering ON indexedpost (state) ' \
+        'INCLUDE (lft_num, lft_den) WHERE state = 1'
+
+
+def test_brin_index():
+    assert create_index_ddl('ix_brin') == \
+        'CREATE INDEX ix_brin ON indexedpost USING brin (created)'
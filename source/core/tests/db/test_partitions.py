@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from trafaret_config.simple import read_and_validate
+
+from core.config.trafaret import TRAFARET
+from core.db import create_sync_engine, fields as f
+from core.db.models import Model
+from core.db.partitions import HashPartition, RangePartition
+
+
+class PartitionedPost(Model):
+    tree_id = f.Integer(nullable=False)
+    content = f.Text()
+
+    class Meta:
+        storages = (
+            ('partitionedpost_content', ('content',)),
+        )
+        partition = HashPartition('tree_id', 2)
+
+
+def test_hash_partition_ddl():
+    assert HashPartition('tree_id', 2).create_ddl('post') == [
+        'CREATE TABLE IF NOT EXISTS post_p0 PARTITION OF post '
+        'FOR VALUES WITH (MODULUS 2, REMAINDER 0)',
+        'CREATE TABLE IF NOT EXISTS post_p1 PARTITION OF post '
+        'FOR VALUES WITH (MODULUS 2, REMAINDER 1)',
+    ]
+
+
+def test_range_partition_ddl():
+    ddl = RangePartition('e_date', premake=1).create_ddl(
+        'log', datetime(2017, 12, 15))
+    assert len(ddl) == 3
+    assert ddl[0] == \
+        'CREATE TABLE IF NOT EXISTS log_default PARTITION OF log DEFAULT'
+    assert "to_regclass('log_p2017_12')" in ddl[1]
+    assert "CREATE TABLE log_p2017_12 PARTITION OF log\n" \
+        "      FOR VALUES FROM ('2017-12-01') TO ('2018-01-01')" in ddl[1]
+    assert "DELETE FROM log_default WHERE " \
+        "e_date >= '2018-01-01' AND e_date < '2018-02-01'" in ddl[2]
+
+
+def create_partitions(conn, ddl):
+    for statement in ddl:
+        conn.execute(sa.text(statement).execution_options(autocommit=True))
+
+
+def test_range_partition_default_rows():
+    config = read_and_validate('./config/test.yaml', TRAFARET)
+    engine = create_sync_engine(config)
+    partition = RangePartition('e_date', premake=0)
+    with engine.connect() as conn:
+        conn.execute('DROP TABLE IF EXISTS partlog')
+        conn.execute('CREATE TABLE partlog (e_date timestamp NOT NULL) '
+                     'PARTITION BY RANGE (e_date)')
+        try:
+            now = datetime(2017, 12, 15)
+            conn.execute(partition.create_ddl('partlog', now)[0])
+            # the rows of December land in the default partition
+            conn.execute("INSERT INTO partlog VALUES "
+                         "('2017-12-20'), ('2018-03-01')")
+
+            create_partitions(conn, partition.create_ddl('partlog', now))
+            # and are moved once the partition is created
+            assert engine.execute(
+                'SELECT e_date FROM partlog_p2017_12').fetchall() \
+                == [(datetime(2017, 12, 20),)]
+            assert engine.execute(
+                'SELECT e_date FROM partlog_default').fetchall() \
+                == [(datetime(2018, 3, 1),)]
+
+            # nothing is done for the existing partition
+            create_partitions(conn, partition.create_ddl('partlog', now))
+            assert engine.execute(
+                'SELECT count(*) FROM partlog').scalar() == 2
+        finally:
+            conn.execute('DROP TABLE partlog')
+
+
+def test_range_partition_expired():
+    partitions = ['log_default', 'log_p2017_11', 'log_p2017_12',
+                  'log_p2018_01', 'log_archive']
+    partition = RangePartition('e_date')
+    assert partition.expired('log', partitions,
+                             datetime(2018, 1, 1)) == ['log_p2017_11',
+                                                       'log_p2017_12']
+    assert partition.expired('log', partitions,
+                             datetime(2017, 12, 31)) == ['log_p2017_11']
+
+
+def test_partitioned_storage():
+    primary, side = PartitionedPost._meta.storages
+    assert primary.partition.key == 'tree_id'
+    assert [c.name for c in primary.primary_key] == ['id', 'tree_id']
+    assert primary.c.id.autoincrement is True
+    # side storage isn't linked by foreign key to the partitioned table
+    assert not side.c.id.foreign_keys
+    assert side.partition is None
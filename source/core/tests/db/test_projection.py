@@ -0,0 +1,77 @@
+from core.db import fields as f
+from core.db.fieldslist import FieldsList, exclude, custom, related
+from core.db.models import Model
+
+
+class ProjectionAuthor(Model):
+    name = f.String()
+    email = f.String()
+
+
+class ProjectionPost(Model):
+    title = f.String()
+    content = f.Text()
+    author_id = f.Integer()
+
+    @property
+    def short_title(self):
+        return self.title[:3]
+
+    def title_length(self):
+        return len(self.title)
+
+
+def make_post():
+    post = ProjectionPost(id=1, title='Title', content='Content',
+                          author_id=2)
+    post.author = ProjectionAuthor(id=2, name='Name', email='e@mail')
+    return post
+
+
+def test_projection_fields():
+    post = make_post()
+
+    assert ProjectionPost.projection('id', 'title')(post) == {
+        'id': 1, 'title': 'Title'}
+
+    assert ProjectionPost.projection(exclude('content', 'author_id'))(post) == {
+        'id': 1, 'title': 'Title'}
+
+    # all the fields
+    assert list(ProjectionPost.projection()(post).keys()) == [
+        'id', 'title', 'content', 'author_id']
+
+
+def test_projection_cache():
+    p1 = ProjectionPost.projection('id', exclude('title'))
+    p2 = ProjectionPost.projection('id', exclude('title'))
+    p3 = ProjectionPost.projection('id')
+    assert p1 is p2
+    assert p1 is not p3
+
+
+def test_projection_custom_fields():
+    post = make_post()
+    projection = ProjectionPost.projection(
+        'id', custom(short='short_title', length='title_length',
+                     author_name='author__name'))
+
+    assert projection(post) == {
+        'id': 1, 'short': 'Tit', 'length': 5, 'author_name': 'Name'}
+
+
+def test_projection_related_fields():
+    post = make_post()
+    projection = ProjectionPost.projection(
+        'id', related(author=('name',)))
+
+    assert projection(post) == {'id': 1, 'author': {'name': 'Name'}}
+
+
+async def test_to_dict(loop):
+    post = make_post()
+    assert await post.to_dict('id', 'title') == {'id': 1, 'title': 'Title'}
+    # fields are appended to the supplied fields list
+    fl = FieldsList('id')
+    assert await post.to_dict('title', fieldslist=fl) \
+        == {'id': 1, 'title': 'Title'}
@@ -0,0 +1,52 @@
+from core.db import fields as f
+from core.db.models import Model
+
+
+class SplitPost(Model):
+    title = f.String()
+    content = f.Text(nullable=False)
+
+    class Meta:
+        storages = (
+            ('splitpost_content', ('content',)),
+        )
+
+
+def test_side_storage():
+    primary, side = SplitPost._meta.storages
+    assert list(primary.c.keys()) == ['id', 'title']
+    assert list(side.c.keys()) == ['id', 'content']
+
+    assert SplitPost.id.table is primary.table
+    assert SplitPost.content.table is side.table
+
+
+def test_joined_select():
+    q = str(SplitPost.list(None))
+    assert 'splitpost.id, splitpost.title, splitpost_content.content' in q
+    assert 'JOIN splitpost_content' in q
+
+
+def test_deferred_select():
+    q = str(SplitPost.list(None).defer(SplitPost.content))
+    assert 'splitpost_content' not in q
+
+    q = str(SplitPost.list(None).defer('content'))
+    assert 'splitpost_content' not in q
+
+
+def test_join_only_used_storages():
+    q = str(SplitPost.list(None).raw.select(SplitPost.id, SplitPost.title))
+    assert 'splitpost_content' not in q
+
+    q = str(SplitPost.list(None).raw.select(SplitPost.id).filter(
+        SplitPost.content == 'text'))
+    assert 'JOIN splitpost_content' in q
+
+
+def test_deferred_instance():
+    post = SplitPost.from_db(id=1, title='Title')
+    assert post._deferred == ('content',)
+
+    post = SplitPost(title='Title')
+    assert post._deferred == ()
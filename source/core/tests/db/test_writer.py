@@ -0,0 +1,104 @@
+import asyncio
+
+from core.db import fields as f
+from core.db.models import Model
+from core.db.writer import BatchWriter, GROUP
+from core.pubsub import Channel, Consumer
+
+
+class WriterNote(Model):
+    text = f.String()
+
+
+class FakeResult:
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+
+
+class FakeConnection:
+    def __init__(self, inserts):
+        self.inserts = inserts
+
+    async def execute(self, q):
+        rows = q.parameters
+        self.inserts.append([r['text'] for r in rows])
+        return FakeResult(len(rows))
+
+
+class FakeEngine:
+    def __init__(self):
+        self.inserts = []
+
+    async def acquire(self):
+        return FakeConnection(self.inserts)
+
+    async def release(self, conn):
+        pass
+
+
+def make_writer(loop, **kwargs):
+    engine = FakeEngine()
+    app = {'db_pools': {'default': (engine, None)}}
+    return engine, BatchWriter(app, WriterNote, loop=loop, **kwargs)
+
+
+async def test_batch_size_flush(loop):
+    engine, writer = make_writer(loop, batch_size=3, flush_interval=10)
+    for i in range(3):
+        await writer.write(WriterNote(text=str(i)))
+    await asyncio.sleep(0, loop=loop)
+
+    # multi-row insert of the full batch
+    assert engine.inserts == [['0', '1', '2']]
+
+    await writer.write(WriterNote(text='3'))
+    assert len(writer.buffer) == 1
+
+    # the rest is stored on stop
+    await writer.stop()
+    assert engine.inserts == [['0', '1', '2'], ['3']]
+
+
+async def test_interval_flush(loop):
+    engine, writer = make_writer(loop, flush_interval=0.05)
+    await writer.write(WriterNote(text='a'))
+    assert engine.inserts == []
+
+    await asyncio.sleep(0.1, loop=loop)
+    assert engine.inserts == [['a']]
+    await writer.stop()
+
+
+async def test_group_durability(loop):
+    engine, writer = make_writer(loop, flush_interval=0.05,
+                                 durability=GROUP)
+    await asyncio.gather(writer.write(WriterNote(text='a')),
+                         writer.write(WriterNote(text='b')), loop=loop)
+    # writes return when their batch is stored
+    assert [sorted(rows) for rows in engine.inserts] == [['a', 'b']]
+    await writer.stop()
+
+
+async def test_backpressure(loop):
+    engine, writer = make_writer(loop, flush_interval=10, max_buffer=2)
+    for i in range(3):
+        await writer.write(WriterNote(text=str(i)))
+
+    # the third write waited for the full buffer to be stored
+    assert engine.inserts == [['0', '1']]
+    assert len(writer.buffer) == 1
+    await writer.stop()
+
+
+async def test_channel_notification(loop):
+    engine, writer = make_writer(loop, flush_interval=10,
+                                 channel='test-writer-notes')
+    consumer = Consumer(loop=loop).subscribe(Channel('test-writer-notes'))
+    await writer.write(WriterNote(text='0'))
+    await writer.write(WriterNote(text='1'))
+    assert consumer.queue.empty()
+
+    # number of the stored records is published after the flush
+    await writer.stop()
+    assert consumer.queue.get_nowait() == 2
+    consumer.unsubscribe()
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from core.db import PoolStats
+from core.middlewares import AdmissionControl, admission_middleware, \
+    json_response_middleware
+
+
+async def read_handler(request):
+    await request.app['release'].wait()
+    return {"read": 1}
+
+
+async def write_handler(request):
+    return {"write": 1}
+
+
+@pytest.fixture
+def app(loop):
+    app = web.Application(loop=loop)
+    app['admission'] = AdmissionControl({
+        'retry_after': 2,
+        'classes': {
+            'write': {'pool': 'default', 'max_wait': 3},
+            'read': {'pool': 'default', 'max_wait': 1, 'max_inflight': 1},
+        },
+    })
+    app['db_stats'] = {'default': PoolStats()}
+    app['release'] = asyncio.Event(loop=loop)
+    app['release'].set()
+    app.router.add_get('/test', read_handler)
+    app.router.add_get('/metrics', write_handler)
+    app.router.add_put('/test', write_handler)
+    app.middlewares.append(admission_middleware)
+    app.middlewares.append(json_response_middleware)
+    return app
+
+
+@pytest.fixture
+def cli(loop, app, test_client):
+    return loop.run_until_complete(test_client(app))
+
+
+async def test_pool_wait_shedding(app, cli):
+    # reads are shed ahead of writes
+    stats = app['db_stats']['default']
+    stats.avg = 2
+    stats.updated = time.monotonic()
+
+    resp = await cli.get('/test')
+    assert resp.status == 503
+    assert resp.headers['Retry-After'] == '2'
+    assert (await resp.json())['data_errors'] == {'reason': 'pool_wait'}
+
+    resp = await cli.put('/test')
+    assert resp.status == 200
+
+    # metrics don't use the database
+    resp = await cli.get('/metrics')
+    assert resp.status == 200
+
+
+async def test_inflight_shedding(app, cli, loop):
+    app['release'].clear()
+    first = loop.create_task(cli.get('/test'))
+    await asyncio.sleep(0.1, loop=loop)
+
+    resp = await cli.get('/test')
+    assert resp.status == 503
+    assert (await resp.json())['data_errors'] == {'reason': 'inflight'}
+
+    app['release'].set()
+    assert (await first).status == 200
+    assert app['admission'].inflight['read'] == 0
+
+
+def test_pool_stats():
+    stats = PoolStats()
+    token = stats.started()
+    assert stats.waiting == 1
+    stats.waiters[token] -= 10
+    # wait in progress is taken into account
+    assert stats.wait_time() >= 10
+
+    stats.finished(token)
+    assert stats.waiting == 0
+    assert stats.average() == pytest.approx(2, 0.01)
+
+    # average decays with time
+    stats.updated -= PoolStats.HALF_LIFE
+    assert stats.wait_time() == pytest.approx(1, 0.01)
@@ -0,0 +1,29 @@
+import pytest
+from aiohttp import web
+
+from core.middlewares import json_response_middleware, timing_middleware
+from core.utils.timing import phase
+
+
+async def timed_handler(request):
+    with phase('sql'):
+        pass
+    return {"a": 1}
+
+
+@pytest.fixture
+def cli(loop, test_client):
+    app = web.Application()
+    app.router.add_get('/test/timing', timed_handler)
+    app.middlewares.append(timing_middleware)
+    app.middlewares.append(json_response_middleware)
+
+    return loop.run_until_complete(test_client(app))
+
+
+async def test_server_timing_header(cli):
+    resp = await cli.get('/test/timing')
+    assert resp.status == 200
+    phases = [m.split(';')[0]
+              for m in resp.headers['Server-Timing'].split(', ')]
+    assert phases == ['sql', 'json', 'total']
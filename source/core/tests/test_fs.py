@@ -0,0 +1,29 @@
+import os
+
+from core.fs import FileStorage
+
+
+def write(fs, fname, size):
+    with open(fs.path(fname), 'wb') as fd:
+        fd.write(b'x' * size)
+
+
+def test_generate_filename(tmpdir):
+    fs = FileStorage(str(tmpdir))
+    fname = fs.generate_filename('csv')
+    assert fname.endswith('.csv')
+    assert fname != fs.generate_filename('csv')
+    # the file is created by its writer
+    assert not os.path.exists(fs.path(fname))
+
+
+def test_remove(tmpdir):
+    fs = FileStorage(str(tmpdir), max_size=100)
+    for fname in ('a.csv', 'a.csv.idx', 'b.csv', 'b.csv.idx', 'b.csv.tmp',
+                  '.gitignore'):
+        write(fs, fname, 10)
+
+    # sidecars are removed with the file
+    fs.remove(['b.csv'])
+    assert sorted(os.listdir(str(tmpdir))) == \
+        ['.gitignore', 'a.csv', 'a.csv.idx']
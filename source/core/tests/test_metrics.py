@@ -0,0 +1,69 @@
+import pytest
+from aiohttp import web
+
+from core.metrics import Registry, setup_metrics
+from core.middlewares import json_response_middleware, metrics_middleware
+
+
+def test_histogram():
+    metrics = Registry()
+    h = metrics.histogram('latency', 'Latency', ('route',), (0.1, 1))
+    assert metrics.histogram('latency', 'Latency') is h
+
+    for v in (0.05, 0.1, 0.5, 3):
+        h.observe(v, ('/a',))
+
+    assert metrics.render().splitlines() == [
+        '# HELP latency Latency',
+        '# TYPE latency histogram',
+        'latency_bucket{route="/a",le="0.1"} 2',
+        'latency_bucket{route="/a",le="1"} 3',
+        'latency_bucket{route="/a",le="+Inf"} 4',
+        'latency_sum{route="/a"} 3.65',
+        'latency_count{route="/a"} 4',
+    ]
+
+
+def test_counter_and_gauge():
+    metrics = Registry()
+    c = metrics.counter('requests_total', 'Requests', ('status',))
+    c.inc((200,))
+    c.inc((200,), 2)
+    metrics.gauge('depth', 'Depth', ('q',), lambda: [(('x',), 5)])
+
+    lines = metrics.render().splitlines()
+    assert 'requests_total{status="200"} 3' in lines
+    assert 'depth{q="x"} 5' in lines
+
+
+async def json_test_handler(request):
+    return {"a": 1}
+
+
+@pytest.fixture
+def cli(loop, test_client):
+    app = web.Application()
+    setup_metrics(app)
+    app.router.add_get('/test/{id}', json_test_handler)
+    app.middlewares.append(metrics_middleware)
+    app.middlewares.append(json_response_middleware)
+
+    return loop.run_until_complete(test_client(app))
+
+
+async def test_metrics_endpoint(cli):
+    await cli.get('/test/1')
+    await cli.get('/test/2')
+    await cli.get('/missing')
+
+    resp = await cli.get('/metrics')
+    assert resp.status == 200
+    text = await resp.text()
+    assert 'http_requests_total{route="/test/{id}",method="GET",' \
+           'status="200"} 2' in text
+    assert 'http_requests_total{route="unmatched",method="GET",' \
+           'status="404"} 1' in text
+    assert 'http_request_duration_seconds_count{route="/test/{id}",' \
+           'method="GET"} 2' in text
+    assert 'http_response_size_bytes_bucket{route="/test/{id}",' \
+           'le="256"} 2' in text
@@ -0,0 +1,74 @@
+import pytest
+from aiohttp import web
+
+from core.response import RangeFileResponse
+
+
+DATA = bytes(range(256)) * 4
+ETAG = '"1-2"'
+
+
+@pytest.fixture
+def app(loop, tmpdir):
+    path = tmpdir.join('report.bin')
+    path.write_binary(DATA)
+
+    async def handler(request):
+        return RangeFileResponse(str(path), ETAG)
+
+    app = web.Application(loop=loop)
+    app.router.add_get('/report', handler)
+    return app
+
+
+@pytest.fixture
+def cli(loop, app, test_client):
+    return loop.run_until_complete(test_client(app))
+
+
+async def test_whole_file(cli):
+    resp = await cli.get('/report')
+    assert resp.status == 200
+    assert resp.headers['ETag'] == ETAG
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert await resp.read() == DATA
+
+
+@pytest.mark.parametrize('value,status,content_range,data', [
+    ('bytes=0-9', 206, 'bytes 0-9/1024', DATA[:10]),
+    ('bytes=1000-', 206, 'bytes 1000-1023/1024', DATA[1000:]),
+    ('bytes=1000-2000', 206, 'bytes 1000-1023/1024', DATA[1000:]),
+    ('bytes=-4', 206, 'bytes 1020-1023/1024', DATA[-4:]),
+    ('bytes=0-', 200, None, DATA),
+    ('bytes=1024-', 416, 'bytes */1024', b''),
+    ('bytes=-0', 416, 'bytes */1024', b''),
+    # malformed and multiple ranges are ignored
+    ('bytes=0-1,5-6', 200, None, DATA),
+    ('lines=1-2', 200, None, DATA),
+])
+async def test_range(cli, value, status, content_range, data):
+    resp = await cli.get('/report', headers={'Range': value})
+    assert resp.status == status
+    assert resp.headers.get('Content-Range') == content_range
+    assert await resp.read() == data
+
+
+async def test_conditional(cli):
+    resp = await cli.get('/report', headers={'If-None-Match': ETAG})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == ETAG
+
+    resp = await cli.get('/report', headers={'If-None-Match': '"0-0"'})
+    assert resp.status == 200
+
+    # the range of the same generation
+    resp = await cli.get('/report', headers={'Range': 'bytes=10-19',
+                                             'If-Range': ETAG})
+    assert resp.status == 206
+    assert await resp.read() == DATA[10:20]
+
+    # the file is changed since the range was requested
+    resp = await cli.get('/report', headers={'Range': 'bytes=10-19',
+                                             'If-Range': '"0-0"'})
+    assert resp.status == 200
+    assert await resp.read() == DATA
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from core.exceptions import CoreException
+from core.metrics import setup_metrics
+from core.middlewares import json_response_middleware
+from core.singleflight import single_flight
+
+
+@single_flight
+async def slow_handler(request):
+    request.app['calls'] += 1
+    await asyncio.sleep(0.1, loop=request.app.loop)
+    if request.match_info['id'] == '0':
+        raise CoreException(404, 'Not Found')
+    return {'id': request.match_info['id']}
+
+
+@single_flight(timeout=0.01)
+async def impatient_handler(request):
+    request.app['calls'] += 1
+    await asyncio.sleep(0.1, loop=request.app.loop)
+    return {'calls': request.app['calls']}
+
+
+@pytest.fixture
+def app(loop):
+    app = web.Application(loop=loop)
+    app['calls'] = 0
+    setup_metrics(app)
+    app.router.add_get('/slow/{id}', slow_handler)
+    app.router.add_get('/impatient', impatient_handler)
+    app.middlewares.append(json_response_middleware)
+    return app
+
+
+@pytest.fixture
+def cli(loop, app, test_client):
+    return loop.run_until_complete(test_client(app))
+
+
+async def fetch(cli, url):
+    resp = await cli.get(url)
+    return resp.status, await resp.json()
+
+
+async def test_coalescing(app, cli, loop):
+    results = await asyncio.gather(*[fetch(cli, '/slow/1') for i in range(5)],
+                                   fetch(cli, '/slow/2'), loop=loop)
+
+    assert app['calls'] == 2
+    assert results[:5] == [(200, {'id': '1'})] * 5
+    assert results[5] == (200, {'id': '2'})
+
+    counter = app['metrics'].metrics['singleflight_requests_total']
+    assert counter.values[('slow_handler', 'leader')] == 2
+    assert counter.values[('slow_handler', 'follower')] == 4
+
+    # finished flights are not reused
+    await fetch(cli, '/slow/1')
+    assert app['calls'] == 3
+
+
+async def test_shared_error(app, cli, loop):
+    results = await asyncio.gather(*[fetch(cli, '/slow/0') for i in range(3)],
+                                   loop=loop)
+    assert app['calls'] == 1
+    assert [status for status, data in results] == [404] * 3
+
+
+async def test_wait_timeout(app, cli, loop):
+    await asyncio.gather(*[fetch(cli, '/impatient') for i in range(3)],
+                         loop=loop)
+    assert app['calls'] == 3
+
+    counter = app['metrics'].metrics['singleflight_requests_total']
+    assert counter.values[('impatient_handler', 'timeout')] == 2
@@ -0,0 +1,31 @@
+"""Application start up budget."""
+import json
+import subprocess
+import sys
+
+# time to import and init the application in a fresh interpreter
+STARTUP_BUDGET = 3.0
+
+STARTUP_SCRIPT = '''
+import asyncio, json, sys, time
+started = time.perf_counter()
+from trafaret_config.simple import read_and_validate
+from core.config.trafaret import TRAFARET
+from core.main import init
+config = read_and_validate('./config/test.yaml', TRAFARET)
+init(asyncio.get_event_loop(), config)
+print(json.dumps({
+    'elapsed': time.perf_counter() - started,
+    'modules': [m for m in ('lxml', 'jinja2', 'aiohttp_jinja2')
+                if m in sys.modules],
+}))
+'''
+
+
+def test_startup_budget():
+    out = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT])
+    result = json.loads(out.decode().strip().splitlines()[-1])
+
+    # optional subsystems are loaded on demand
+    assert result['modules'] == []
+    assert result['elapsed'] < STARTUP_BUDGET
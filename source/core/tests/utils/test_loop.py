@@ -0,0 +1,27 @@
+import asyncio
+
+from core.utils.loop import setup_event_loop_policy
+
+
+def test_asyncio_loop():
+    try:
+        assert setup_event_loop_policy('asyncio') == 'asyncio'
+        assert type(asyncio.get_event_loop_policy()) is \
+            asyncio.DefaultEventLoopPolicy
+    finally:
+        asyncio.set_event_loop_policy(None)
+
+
+def test_auto_loop():
+    try:
+        name = setup_event_loop_policy('auto')
+        try:
+            import uvloop
+        except ImportError:
+            assert name == 'asyncio'
+        else:
+            assert name == 'uvloop'
+            assert isinstance(asyncio.get_event_loop_policy(),
+                              uvloop.EventLoopPolicy)
+    finally:
+        asyncio.set_event_loop_policy(None)
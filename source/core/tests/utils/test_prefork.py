@@ -0,0 +1,94 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from core.main import PROJECT_ROOT
+from core.utils.prefork import create_reuseport_socket
+
+
+def test_reuseport_socket():
+    sock1 = create_reuseport_socket('127.0.0.1', 0)
+    port = sock1.getsockname()[1]
+    # the second socket is bound to the same port without errors
+    sock2 = create_reuseport_socket('127.0.0.1', port)
+    try:
+        assert sock2.getsockname()[1] == port
+        assert sock2.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+    finally:
+        sock1.close()
+        sock2.close()
+
+
+# master process with the workers that record their pids to the directory
+MASTER = '''
+import os, sys, time
+from core.utils import prefork
+
+prefork.MIN_WORKER_LIFETIME = 0.5
+
+
+def target(path, crash):
+    with open(os.path.join(path, str(os.getpid())), 'w'):
+        pass
+    if crash:
+        raise RuntimeError('crash')
+    time.sleep(0.5)
+    prefork.notify_ready()
+    while True:
+        time.sleep(0.1)
+
+
+prefork.Prefork(2, target, sys.argv[1], sys.argv[2] == '1').start()
+'''
+
+
+def start_master(tmpdir, crash):
+    return subprocess.Popen(
+        [sys.executable, '-c', MASTER, str(tmpdir), '1' if crash else '0'],
+        cwd=PROJECT_ROOT, stderr=subprocess.DEVNULL)
+
+
+def alive(pid):
+    return os.path.exists('/proc/%s' % pid)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+def test_prefork_restart_crashed(tmpdir):
+    master = start_master(tmpdir, crash=True)
+    try:
+        time.sleep(1.2)
+    finally:
+        master.terminate()
+        assert master.wait(10) == 0
+    # crashed workers are restarted with a delay
+    assert 2 < len(tmpdir.listdir()) <= 6
+
+
+def test_prefork_reload(tmpdir):
+    master = start_master(tmpdir, crash=False)
+    try:
+        wait_for(lambda: len(tmpdir.listdir()) == 2)
+        old = [int(p.basename) for p in tmpdir.listdir()]
+
+        master.send_signal(signal.SIGHUP)
+        wait_for(lambda: len(tmpdir.listdir()) == 4)
+        # old workers are stopped only when the new ones are ready
+        time.sleep(0.2)
+        assert all(alive(pid) for pid in old)
+        wait_for(lambda: not any(alive(pid) for pid in old))
+        new = [int(p.basename) for p in tmpdir.listdir()
+               if int(p.basename) not in old]
+        assert all(alive(pid) for pid in new)
+    finally:
+        master.terminate()
+        assert master.wait(10) == 0
+    assert not any(alive(pid) for pid in new)
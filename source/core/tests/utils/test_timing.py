@@ -0,0 +1,29 @@
+import time
+
+from core.utils.timing import NO_PHASE, Timing, current_timing, phase
+
+
+def test_no_timing():
+    assert phase('sql') is NO_PHASE
+
+
+async def test_nested_phases():
+    timing = Timing()
+    token = current_timing.set(timing)
+    try:
+        with phase('sql'):
+            with phase('db-acquire'):
+                time.sleep(0.02)
+            time.sleep(0.01)
+        with phase('sql'):
+            pass
+    finally:
+        current_timing.reset(token)
+
+    assert set(timing.phases) == {'sql', 'db-acquire'}
+    sql, acquire = timing.phases['sql'], timing.phases['db-acquire']
+    assert sql[1] == 2
+    # nested phase is excluded from the outer one
+    assert 0.01 <= sql[0] < 0.02 <= acquire[0]
+    assert timing.header(0.5).endswith('total;dur=500.00')
+    assert current_timing.get() is None
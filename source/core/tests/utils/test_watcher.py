@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from core.utils import watcher
+from core.utils.watcher import InotifyWatcher, PollingWatcher
+
+
+@pytest.mark.skipif(watcher.libc is None, reason='inotify is not available')
+def test_inotify_watcher(tmpdir):
+    root = tmpdir.mkdir('project')
+    config = tmpdir.join('config.yaml')
+    config.write('debug: True')
+
+    w = InotifyWatcher(str(root), [str(config)])
+    try:
+        assert w.wait(0.1) == set()
+
+        # several changes are reported at once
+        root.join('views.py').write('x = 1')
+        root.join('models.py').write('y = 1')
+        root.join('readme.txt').write('skip me')
+        assert w.wait(1) == {str(root.join('views.py')),
+                             str(root.join('models.py'))}
+
+        # new packages are watched as well
+        pkg = root.mkdir('pkg')
+        assert w.wait(0.3) == set()
+        pkg.join('__init__.py').write('')
+        assert w.wait(1) == {str(pkg.join('__init__.py'))}
+
+        # config file out of the project dir
+        config.write('debug: False')
+        assert w.wait(1) == {str(config)}
+    finally:
+        w.close()
+
+
+def test_polling_watcher(tmpdir):
+    config = tmpdir.join('config.yaml')
+    config.write('debug: True')
+
+    w = PollingWatcher(str(tmpdir.mkdir('project')), [str(config)],
+                       interval=0.05)
+    assert w.wait(0.1) == set()
+
+    mtime = os.stat(str(config)).st_mtime
+    os.utime(str(config), (mtime + 10, mtime + 10))
+    assert w.wait(0.1) == {str(config)}
@@ -0,0 +1,101 @@
+"""Import Time Profiler.
+
+Measures how long it takes to import every module during the application
+start up. Should be run in a fresh interpreter, so modules loaded earlier
+don't hide their import time:
+
+    $ python -m core.utils.importtime -c ./config/main.yaml
+"""
+import argparse
+import asyncio
+import builtins
+import importlib.util
+import sys
+import time
+
+
+class ImportProfiler:
+    """Context manager that records import time of the loaded modules.
+
+    Self time of the module excludes time spent on importing
+    the modules it depends on.
+    """
+
+    def __init__(self):
+        """Setup profiler."""
+        # module name -> [cumulative time, self time]
+        self.timings = {}
+        self.stack = []
+        self._import = None
+
+    def __enter__(self):
+        """Start recording imports."""
+        self._import = builtins.__import__
+        builtins.__import__ = self.__import
+        return self
+
+    def __exit__(self, *exc):
+        """Stop recording imports."""
+        builtins.__import__ = self._import
+
+    def __import(self, name, globals=None, locals=None, fromlist=(),
+                 level=0):
+        if level:
+            try:
+                fullname = importlib.util.resolve_name(
+                    '.' * level + name, (globals or {}).get('__package__'))
+            except (ImportError, ValueError):
+                fullname = name
+        else:
+            fullname = name
+
+        # modules that are loaded already cost nothing
+        if fullname in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        self.stack.append(0)
+        started = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            self.timings[fullname] = [elapsed, elapsed - children]
+
+    def report(self, limit=20):
+        """Return report lines about the slowest imports (by self time)."""
+        lines = ['%10s %10s  %s' % ('self, ms', 'cumul, ms', 'module')]
+        timings = sorted(self.timings.items(), key=lambda i: i[1][1],
+                         reverse=True)
+        for name, (cumulative, own) in timings[:limit]:
+            lines.append('%10.1f %10.1f  %s' % (own * 1000, cumulative * 1000,
+                                                name))
+        return lines
+
+
+def main(argv):
+    """Profile imports of the application and its initialization."""
+    ap = argparse.ArgumentParser(description='Import Time Profiler')
+    ap.add_argument('-c', '--config', default='./config/main.yaml')
+    ap.add_argument('-n', '--limit', type=int, default=20,
+                    help='number of the slowest imports to show')
+    options = ap.parse_args(argv)
+
+    started = time.perf_counter()
+    with ImportProfiler() as profiler:
+        from trafaret_config.simple import read_and_validate
+        from core.config.trafaret import TRAFARET
+        from core.main import init
+
+        config = read_and_validate(options.config, TRAFARET)
+        init(asyncio.get_event_loop(), config)
+
+    print('\n'.join(profiler.report(options.limit)))
+    print('Total: %.1f ms to import %s modules and init the app'
+          % ((time.perf_counter() - started) * 1000, len(profiler.timings)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,6 +8,7 @@ from collections import OrderedDict
 from core.db.models import Model
 
 from .duration import duration_iso_string
+from .timing import phase
 
 
 def is_aware(value):
@@ -50,4 +51,5 @@ class JSONEncoder(json.JSONEncoder):
 
 
 def json_dumps(*args, **kwargs):
-    return json.dumps(*args, cls=JSONEncoder, **kwargs)
+    with phase('json'):
+        return json.dumps(*args, cls=JSONEncoder, **kwargs)
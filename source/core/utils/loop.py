@@ -0,0 +1,29 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger('loop')
+
+LOOPS = ('auto', 'uvloop', 'asyncio')
+
+
+def setup_event_loop_policy(name='auto'):
+    """Set event loop policy by its name and return the name of the loop.
+
+    'auto' - use uvloop if it's installed and stdlib loop otherwise;
+    'uvloop' - same as auto, but warns if uvloop isn't installed;
+    'asyncio' - always use stdlib loop.
+    """
+    if name in ('auto', 'uvloop'):
+        try:
+            import uvloop
+        except ImportError:
+            if name == 'uvloop':
+                logger.warning("uvloop isn't installed. "
+                               "Fallback to asyncio event loop.")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    return 'asyncio'
@@ -0,0 +1,177 @@
+import logging
+import os
+import select
+import signal
+import socket
+import time
+
+
+logger = logging.getLogger('prefork')
+
+# workers that die faster than that are restarted with a delay
+MIN_WORKER_LIFETIME = 1
+# time to wait for the new workers on reload
+READY_TIMEOUT = 30
+
+# write end of the readiness pipe in the worker process
+_ready_fd = None
+
+
+def notify_ready():
+    """Tell the master that the worker is listening.
+
+    Does nothing outside of the prefork worker or if it's told already.
+    """
+    global _ready_fd
+    if _ready_fd is not None:
+        os.write(_ready_fd, b'1')
+        os.close(_ready_fd)
+        _ready_fd = None
+
+
+def create_reuseport_socket(host, port):
+    """Create a listening socket that could be shared between processes.
+
+    Every process binds its own socket to the same address
+    and the kernel balances incoming connections between them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+class Prefork:
+    """Master process that forks and supervises worker processes.
+
+    Signals:
+        SIGINT, SIGTERM - gracefully stop workers and exit;
+        SIGHUP - graceful reload: start new workers, then stop the old ones.
+    """
+
+    def __init__(self, num, target, *args):
+        self.num = num
+        self.target = target
+        self.args = args
+        # pid -> spawn time
+        self.workers = {}
+        # pid -> read end of the readiness pipe
+        self.pipes = {}
+        # pids of the workers being stopped on reload
+        self.retiring = set()
+        self.running = False
+
+    def spawn(self):
+        global _ready_fd
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # worker process
+            os.close(rfd)
+            for fd in self.pipes.values():
+                os.close(fd)
+            _ready_fd = wfd
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                self.target(*self.args)
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                logger.exception('Worker %s failed', os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(wfd)
+        logger.debug('Worker %s started', pid)
+        self.workers[pid] = time.time()
+        self.pipes[pid] = rfd
+        return pid
+
+    def wait_ready(self, pids, timeout=READY_TIMEOUT):
+        """Return pids of the workers that notified they are ready.
+
+        Workers that exit before that close the pipe without notification.
+        """
+        pending = {self.pipes.pop(pid): pid for pid in pids
+                   if pid in self.pipes}
+        ready = set()
+        deadline = time.time() + timeout
+        try:
+            while pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                fds, _, _ = select.select(list(pending), [], [], remaining)
+                for fd in fds:
+                    pid = pending.pop(fd)
+                    if os.read(fd, 1):
+                        ready.add(pid)
+                    os.close(fd)
+        finally:
+            for fd in pending:
+                os.close(fd)
+        return ready
+
+    def kill(self, pid, sig=signal.SIGINT):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def start(self):
+        self.running = True
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+
+        for i in range(self.num):
+            self.spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            started = self.workers.pop(pid, None)
+            if pid in self.pipes:
+                os.close(self.pipes.pop(pid))
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+
+            elif self.running and started is not None:
+                logger.warning('Worker %s exited with status %s. Restart.',
+                               pid, status)
+                # don't respawn crashing workers in a tight loop
+                if time.time() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+                if self.running:
+                    self.spawn()
+
+        logger.debug('All workers are stopped')
+
+    def on_stop(self, signum, frame):
+        logger.debug('Stop workers...')
+        self.running = False
+        for pid in list(self.workers):
+            self.kill(pid)
+
+    def on_reload(self, signum, frame):
+        logger.debug('Reload workers...')
+        old = set(self.workers) - self.retiring
+        new = [self.spawn() for i in range(self.num)]
+        # the old workers finish their requests and exit
+        # only when the new ones are listening already
+        ready = self.wait_ready(new)
+        if len(ready) < len(new):
+            logger.error('New workers are not ready. Reload is cancelled.')
+            old = new
+
+        self.retiring.update(old)
+        for pid in old:
+            self.kill(pid)
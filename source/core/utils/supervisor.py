@@ -4,21 +4,24 @@ import os
 import signal
 import subprocess
 import sys
-import time
 
 from trafaret_config import commandline
 
 from ..config.trafaret import TRAFARET
+from .watcher import get_watcher, source_filename
 
 
-IS_WIN = (sys.platform == "win32")
 logger = logging.getLogger('supervisor')
 
 
 class Supervisor:
-    def __init__(self, args, options):
-        self._mtimes = {}
-        self._error_files = []
+    """Restart the application subprocess when project files are changed.
+
+    Changes are watched with inotify on Linux and by polling
+    modification time of the loaded modules elsewhere.
+    """
+
+    def __init__(self, args, options, root=None):
         self._warm_start = False
 
         self.args = args
@@ -27,6 +30,9 @@ class Supervisor:
         # self.config_filename = os.path.abspath(os.path.join(os.environ['PROJECT_ROOT'] + self.options.config))
         self.config_filename = os.path.abspath(self.options.config)
         self.user_modules = {}
+        # project directory to watch (current dir by default)
+        self.root = os.path.abspath(root or os.getcwd())
+        self.watcher = None
 
     def start(self):
         if not self._warm_start:
@@ -42,35 +48,38 @@ class Supervisor:
                 else:
                     self.user_modules[module_path] = importlib.import_module(module_path)
 
+        if self.watcher is None:
+            self.watcher = get_watcher(self.root, [self.config_filename])
+            logger.debug('Watch for changes using %s',
+                         type(self.watcher).__name__)
+
         # run application in a subprocess
         self.p = subprocess.Popen(self.args, env=self.environ)
         try:
-            while True:
-                cfilename, cmodule = self.code_changed()
-                if cfilename:
-                    # send a keyboardinterrupt signal to subprocess
-                    # this will stop aiohttp in it.
-                    self.stop()
-                    # do warm start if config file wasn't chnaged
-                    self._warm_start = not cfilename == self.config_filename
-                    # reload changed module
-                    if cmodule:
-                        # try to reload changed module and just skip any excptions
-                        # (they will be caught in the subprocess)
-                        try:
-                            importlib.reload(cmodule)
-                        except Exception:
-                            pass
-
-                    # strart process again
-                    logger.debug('Restart Development Server...')
-                    self.start()
-                    break
-                # recheck timer
-                time.sleep(2)
+            # wait for changes of the project files
+            changed = self.watcher.wait()
+            # send a keyboardinterrupt signal to subprocess
+            # this will stop aiohttp in it.
+            self.stop()
+            # do warm start if config file wasn't chnaged
+            self._warm_start = self.config_filename not in changed
+            # reload changed modules
+            modules = self.changed_modules(changed)
+            for cmodule in modules:
+                # try to reload changed module and just skip any excptions
+                # (they will be caught in the subprocess)
+                try:
+                    importlib.reload(cmodule)
+                except Exception:
+                    pass
+
+            # strart process again
+            logger.debug('Restart Development Server...')
+            self.start()
         except KeyboardInterrupt:
             # stop aiohttp in the subprocess
             self.stop()
+            self.watcher.close()
             sys.exit(0)
 
     def stop(self):
@@ -79,47 +88,11 @@ class Supervisor:
         # wait for subprocess terminaiton
         self.p.wait()
 
-    def code_changed(self):
-        files = {self.config_filename: None}
-
-        for m in sys.modules.values():
-            try:
-                files[m.__file__] = m
-            except AttributeError:
-                pass
-
-        for filename in list(files.keys()) + self._error_files:
-            if not filename:
-                continue
-
-            if filename.endswith(".pyc") or filename.endswith(".pyo"):
-                filename = filename[:-1]
-
-            if filename.endswith("$py.class"):
-                filename = filename[:-9] + ".py"
-
-            if not os.path.exists(filename):
-                # File might be in an egg, so it can't be reloaded.
-                continue
-
-            stat = os.stat(filename)
-            mtime = stat.st_mtime
-
-            if IS_WIN:
-                mtime -= stat.st_ctime
-
-            if filename not in self._mtimes:
-                self._mtimes[filename] = mtime
-                continue
-
-            if mtime != self._mtimes[filename]:
-                self._mtimes.clear()
-
-                try:
-                    del self._error_files[self._error_files.index(filename)]
-                except ValueError:
-                    pass
-
-                return filename, files.get(filename, None)
-
-        return False, None
+    def changed_modules(self, changed):
+        """Return loaded modules of the changed files."""
+        modules = []
+        for m in list(sys.modules.values()):
+            filename = getattr(m, '__file__', None)
+            if filename and source_filename(filename) in changed:
+                modules.append(m)
+        return modules
@@ -0,0 +1,154 @@
+"""Request Phases Timing.
+
+Timing of the current request is carried in a context variable, so any
+code (db connection, query results, json encoder) could record its phase
+without access to the request:
+
+    with phase('sql'):
+        result = await conn.execute(q)
+
+Phases are measured exclusively: time of the nested phases is subtracted
+from the outer one (e.g. pool acquisition within query execution).
+When the request isn't sampled phase() costs a single lookup.
+"""
+import asyncio
+import time
+import weakref
+
+from collections import OrderedDict
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # python 3.6
+    ContextVar = None
+
+
+class TaskLocal:
+    """Minimal ContextVar replacement that stores values per asyncio task.
+
+    It is used on python 3.6 which has no contextvars.
+    """
+
+    def __init__(self, name, default=None):
+        """Setup storage."""
+        self.name = name
+        self.default = default
+        self.values = weakref.WeakKeyDictionary()
+
+    def current_task(self):
+        """Return the current task (None outside of the event loop)."""
+        # executor threads have no event loop
+        loop = asyncio._get_running_loop()
+        if loop is None:
+            return None
+        return asyncio.Task.current_task(loop)
+
+    def get(self):
+        """Return value of the current task."""
+        task = self.current_task()
+        if task is None:
+            return self.default
+        return self.values.get(task, self.default)
+
+    def set(self, value):
+        """Set value for the current task and return the previous one."""
+        task = self.current_task()
+        if task is None:
+            return self.default
+        token = self.values.get(task, self.default)
+        self.values[task] = value
+        return token
+
+    def reset(self, token):
+        """Restore the previous value."""
+        self.set(token)
+
+
+if ContextVar is not None:
+    current_timing = ContextVar('current_timing', default=None)
+else:
+    current_timing = TaskLocal('current_timing')
+
+
+class Timing:
+    """Phases timing of a single request."""
+
+    def __init__(self):
+        """Setup timing."""
+        self.started = time.perf_counter()
+        # phase name -> [duration, count]
+        self.phases = OrderedDict()
+        # time of the nested phases for every running phase
+        self.stack = []
+
+    def add(self, name, duration):
+        """Add duration of the phase."""
+        try:
+            record = self.phases[name]
+            record[0] += duration
+            record[1] += 1
+        except KeyError:
+            self.phases[name] = [duration, 1]
+
+    @property
+    def total(self):
+        """Time since the timing start."""
+        return time.perf_counter() - self.started
+
+    def header(self, total=None):
+        """Return Server-Timing header value (durations in ms)."""
+        metrics = ['%s;dur=%.2f' % (name, duration * 1000)
+                   for name, (duration, count) in self.phases.items()]
+        metrics.append('total;dur=%.2f' % ((total or self.total) * 1000))
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        """Return phases as a dict: name -> {'ms': duration, 'count': n}."""
+        return {name: {'ms': round(duration * 1000, 3), 'count': count}
+                for name, (duration, count) in self.phases.items()}
+
+
+class Phase:
+    """Context manager that measures the phase."""
+
+    __slots__ = ('timing', 'name', 'started')
+
+    def __init__(self, timing, name):
+        """Setup phase."""
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        """Start measuring."""
+        self.timing.stack.append(0)
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        """Record exclusive duration of the phase."""
+        elapsed = time.perf_counter() - self.started
+        stack = self.timing.stack
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        self.timing.add(self.name, elapsed - nested)
+
+
+class NoPhase:
+    """Context manager that does nothing (request isn't sampled)."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+def phase(name):
+    """Return context manager that records the phase of the current request."""
+    timing = current_timing.get()
+    return NO_PHASE if timing is None else Phase(timing, name)
@@ -0,0 +1,265 @@
+"""File Watchers for the Development Supervisor.
+
+InotifyWatcher is event driven (Linux only, inotify via ctypes).
+PollingWatcher checks modification time of the loaded modules
+and is used when inotify isn't available.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+
+IS_WIN = (sys.platform == "win32")
+
+# inotify constants (see sys/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# directories that never contain the project sources
+SKIP_DIRS = ('__pycache__', 'node_modules')
+
+# changes that come within the interval are reported together
+DEBOUNCE_INTERVAL = 0.2
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+libc = _load_libc()
+
+
+def source_filename(filename):
+    """Return source file name of the compiled module file."""
+    if filename.endswith(".pyc") or filename.endswith(".pyo"):
+        filename = filename[:-1]
+
+    if filename.endswith("$py.class"):
+        filename = filename[:-9] + ".py"
+
+    return filename
+
+
+def is_under(filename, root):
+    """Check if the file is located in the root directory."""
+    return filename.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class InotifyWatcher:
+    """Watch python files in the project directories and extra files.
+
+    Directories are watched instead of files, so editors that save
+    files by replacing them are handled as well.
+    """
+
+    def __init__(self, root, extra_files=()):
+        """Setup inotify instance and add watches."""
+        self.root = os.path.abspath(root)
+        self.extra_files = set(os.path.abspath(f) for f in extra_files)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # watch descriptor -> directory path
+        self.watches = {}
+
+        try:
+            self.add_tree(self.root)
+            for filename in self.extra_files:
+                if not is_under(filename, self.root):
+                    self.add_watch(os.path.dirname(filename))
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, path):
+        """Add watch for the directory."""
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, 'inotify watch limit reached '
+                                   '(fs.inotify.max_user_watches)')
+            # directory might be removed already
+            return
+        self.watches[wd] = path
+
+    def add_tree(self, root):
+        """Add watches for the directory and its subdirectories."""
+        for path, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs
+                       if d not in SKIP_DIRS and not d.startswith('.')]
+            self.add_watch(path)
+
+    def is_watched(self, filename):
+        """Check if changes of the file should be reported."""
+        return filename in self.extra_files or \
+            (filename.endswith('.py') and is_under(filename, self.root))
+
+    def read_events(self):
+        """Read pending events and return changed files."""
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # some events are lost, restart anyway
+                changed.add(self.root)
+                continue
+
+            path = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            if path is None or not name:
+                continue
+
+            filename = os.path.join(path, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and \
+                        is_under(filename, self.root) and \
+                        name not in SKIP_DIRS and not name.startswith('.'):
+                    # new package might be added
+                    self.add_tree(filename)
+
+            elif self.is_watched(filename):
+                changed.add(filename)
+
+        return changed
+
+    def wait(self, timeout=None):
+        """Wait for changes and return set of changed files.
+
+        Changes that come one after another are debounced, so saving
+        several files at once causes a single restart.
+        Empty set is returned on timeout.
+        """
+        changed = set()
+        while not changed:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return changed
+            changed |= self.read_events()
+
+        # wait until changes settle down
+        while select.select([self.fd], [], [], DEBOUNCE_INTERVAL)[0]:
+            changed |= self.read_events()
+
+        return changed
+
+    def close(self):
+        """Close inotify instance."""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Check modification time of the loaded modules and extra files."""
+
+    def __init__(self, root, extra_files=(), interval=2):
+        """Setup watcher."""
+        self.root = os.path.abspath(root)
+        self.extra_files = [os.path.abspath(f) for f in extra_files]
+        self.interval = interval
+        self._mtimes = {}
+
+    def files(self):
+        """Return project files of the loaded modules and extra files."""
+        files = list(self.extra_files)
+        for m in list(sys.modules.values()):
+            filename = getattr(m, '__file__', None)
+            if filename:
+                filename = source_filename(filename)
+                if is_under(filename, self.root):
+                    files.append(filename)
+        return files
+
+    def check(self):
+        """Return set of files changed since the previous check."""
+        changed = set()
+        for filename in self.files():
+            if not os.path.exists(filename):
+                # File might be in an egg, so it can't be reloaded.
+                continue
+
+            stat = os.stat(filename)
+            mtime = stat.st_mtime
+
+            if IS_WIN:
+                mtime -= stat.st_ctime
+
+            if self._mtimes.setdefault(filename, mtime) != mtime:
+                self._mtimes[filename] = mtime
+                changed.add(filename)
+
+        return changed
+
+    def wait(self, timeout=None):
+        """Wait for changes and return set of changed files.
+
+        Empty set is returned on timeout.
+        """
+        started = time.time()
+        # remember current state of the files
+        if not self._mtimes:
+            self.check()
+
+        while True:
+            changed = self.check()
+            if changed:
+                return changed
+            if timeout is not None and time.time() - started >= timeout:
+                return changed
+            # recheck timer
+            time.sleep(self.interval if timeout is None
+                       else min(self.interval, timeout))
+
+    def close(self):
+        """Nothing to close."""
+
+
+def get_watcher(root, extra_files=()):
+    """Return inotify watcher if available and polling watcher otherwise."""
+    if libc is not None:
+        try:
+            return InotifyWatcher(root, extra_files)
+        except OSError:
+            pass
+
+    return PollingWatcher(root, extra_files)
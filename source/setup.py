@@ -1,8 +1,9 @@
 from setuptools import find_packages, setup
 
 
+# aiohttp 3 changed the FileResponse internals used by RangeFileResponse
 install_requires = ['aiofiles',
-                    'aiohttp',
+                    'aiohttp<3',
                     'aiopg[sa]',
                     'aiohttp-jinja2',
                     'lxml',
@@ -19,4 +20,5 @@ setup(name='aiocomments',
       },
       include_package_data=True,
       install_requires=install_requires,
+      extras_require={'uvloop': ['uvloop']},
       zip_safe=False)